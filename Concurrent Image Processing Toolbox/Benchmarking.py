@@ -1,34 +1,288 @@
 #Imports
-import timeit
-#import os
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
 import cv2
-from main import apply_operation, ImageOperation
-def benchmark_apply_operation(operation, input_image, *args, **kwargs):
-    """
-    Benchmark the execution time of an image processing operation by applying
-    the specified operation to the input_image using the given arguments and
-    keyword arguments.
-
-    :param operation: The image processing operation to be benchmarked.
-    :type operation: ImageOperation
-    :param input_image: The input image to be processed.
-    :type input_image: numpy.ndarray
-    :param args: Positional arguments for the image processing operation.
-    :param kwargs: Keyword arguments for the image processing operation.
-    :return: None
-    """
-    input_image = cv2.imread('test_image.jpg', cv2.IMREAD_COLOR)
-    assert input_image is not None, "Test image not found."
-
-    operations = [ImageOperation.RESIZE, ImageOperation.ROTATE, ImageOperation.BLUR]
-
-    for operation in operations:
-        exec_time = timeit.timeit(
-            'apply_operation(operation, input_image, **kwargs)',
-            globals=globals(),
-            number=100
-        )
-        print(f"{operation.name}: {exec_time:.4f} seconds")
+import numpy as np
+from concurrent_image_processing import apply_operation, process_images, ImageOperation
+from scheduler import ImageScheduler, percentile
+
+# Every operation runs with its default parameters (see DEFAULT_PARAMETERS in concurrent_image_processing.py).
+EXECUTORS = ["serial", "thread", "process", "pipeline", "batch"]
+
+# Metrics where a larger value is better; for every other compared metric, smaller is better.
+HIGHER_IS_BETTER = {"ops_per_s", "images_per_s"}
+COMPARED_METRICS = ["ops_per_s", "images_per_s", "p50_ms", "p99_ms", "peak_rss_mb"]
+
+
+def synthetic_image(width, height, channels, seed=0):
+    """
+    Generate a reproducible test image: a smooth gradient with noise, so that edge, threshold and equalization
+    operations have realistic work to do.
+
+    :param width: The image width in pixels.
+    :param height: The image height in pixels.
+    :param channels: The number of channels (1 or 3).
+    :param seed: The random seed.
+    :return: The image as a uint8 NumPy array.
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.add.outer(np.linspace(0, 127, height), np.linspace(0, 127, width))
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    noise = rng.normal(0, 20, shape)
+    if channels != 1:
+        gradient = gradient[:, :, None]
+    return np.clip(gradient + noise, 0, 255).astype(np.uint8)
+
+
+def peak_rss_mb():
+    """
+    Report the peak resident set size of this process and of the largest of its finished child processes.
+
+    :return: A dictionary with the peak RSS in megabytes.
+    """
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / divisor,
+    }
+
+
+def benchmark_operations(images, repeat):
+    """
+    Time every ImageOperation on every synthetic image.
+
+    :param images: A dictionary mapping (resolution, channels) to a synthetic image.
+    :param repeat: The number of timed calls per operation and image.
+    :return: A list of result records.
+    """
+    results = []
+    for (resolution, channels), image in images.items():
+        for operation in ImageOperation:
+            apply_operation(operation, image)
+            latencies = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                apply_operation(operation, image)
+                latencies.append(time.perf_counter() - start)
+            total = sum(latencies)
+            results.append({
+                "operation": operation.name.lower(),
+                "resolution": resolution,
+                "channels": channels,
+                "ops_per_s": repeat / total if total else 0.0,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+            })
+            print(f"{operation.name.lower():>24} {resolution:>10} x{channels}: "
+                  f"{results[-1]['ops_per_s']:9.1f} ops/s  p99 {results[-1]['p99_ms']:8.2f} ms", file=sys.stderr)
+    return results
+
+
+def _run_serial(paths, output_dir, operations):
+    latencies = []
+    for path in paths:
+        start = time.perf_counter()
+        input_image = cv2.imread(path)
+        for operation in operations:
+            result = apply_operation(operation, input_image)
+            for level, image in enumerate(result if isinstance(result, list) else [result]):
+                cv2.imwrite(os.path.join(output_dir, f"{operation.name.lower()}_{level}_image.jpg"), image)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _run_executor(executor, paths, output_dir, operations, workers):
+    """
+    Run a batch end to end through one executor.
+
+    :return: A tuple of the elapsed time and the per-image latencies, or the thread scheduler's (p50, p99) in
+             milliseconds; None when the executor does not report latency.
+    """
+    latency = None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if executor == "serial":
+            latency = _run_serial(paths, output_dir, operations)
+        elif executor == "thread":
+            scheduler = ImageScheduler(workers)
+            process_images(paths, output_dir, operations, scheduler=scheduler)
+            scheduler.shutdown()
+            stats = scheduler.stats()
+            latency = (stats["p50_latency_ms"], stats["p99_latency_ms"])
+        else:
+            process_images(paths, output_dir, operations, backend=executor, workers=workers)
+    return time.perf_counter() - start, latency
+
+
+def _measure_executor(connection, executor, paths, output_dir, operations, workers):
+    """
+    Child process entry point: run one executor and send back its timings and this process's peak RSS.
+    """
+    elapsed, latency = _run_executor(executor, paths, output_dir, operations, workers)
+    connection.send((elapsed, latency, peak_rss_mb()))
+    connection.close()
+
+
+def benchmark_executors(images, batch, executors, workers):
+    """
+    Run a batch of synthetic images end to end (decode, every operation with its default parameters, encode)
+    through each executor. Every run happens in a freshly spawned process, so its peak RSS (and, for the process
+    executor, that of its largest worker) belongs to that executor and run alone.
+
+    :param images: A dictionary mapping (resolution, channels) to a synthetic image.
+    :param batch: The number of images per batch.
+    :param executors: The executors to compare, from EXECUTORS.
+    :param workers: The number of workers for the thread, process and pipeline executors.
+    :return: A list of result records. Per-image latency is not available for the process, pipeline and batch
+             executors.
+    """
+    operations = list(ImageOperation)
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as workspace:
+        for (resolution, channels), image in images.items():
+            paths = []
+            for index in range(batch):
+                paths.append(os.path.join(workspace, f"input_{resolution}_{channels}_{index}.png"))
+                cv2.imwrite(paths[-1], image)
+            output_dir = os.path.join(workspace, "output")
+            os.makedirs(output_dir, exist_ok=True)
+
+            for executor in executors:
+                receiver, sender = context.Pipe(duplex=False)
+                child = context.Process(target=_measure_executor,
+                                        args=(sender, executor, paths, output_dir, operations, workers))
+                child.start()
+                sender.close()
+                try:
+                    elapsed, latency, rss = receiver.recv()
+                except EOFError:
+                    print(f"{executor:>8} {resolution:>10} x{channels}: failed", file=sys.stderr)
+                    continue
+                finally:
+                    child.join()
+
+                record = {
+                    "executor": executor,
+                    "resolution": resolution,
+                    "channels": channels,
+                    "images": batch,
+                    "images_per_s": batch / elapsed if elapsed else 0.0,
+                    "ops_per_s": batch * len(operations) / elapsed if elapsed else 0.0,
+                    "p50_ms": None,
+                    "p99_ms": None,
+                    "peak_rss_mb": rss["self"],
+                    "peak_worker_rss_mb": rss["children"] if executor == "process" else None,
+                }
+                if isinstance(latency, list):
+                    record["p50_ms"] = percentile(latency, 0.50) * 1000
+                    record["p99_ms"] = percentile(latency, 0.99) * 1000
+                elif latency is not None:
+                    record["p50_ms"], record["p99_ms"] = latency
+                results.append(record)
+                print(f"{executor:>8} {resolution:>10} x{channels}: {record['images_per_s']:8.1f} images/s  "
+                      f"peak RSS {record['peak_rss_mb']:7.1f} MB", file=sys.stderr)
+    return results
+
+
+def _record_key(record):
+    return (record.get("operation") or record.get("executor"), record["resolution"], record["channels"])
+
+
+def compare_results(baseline, current, tolerance):
+    """
+    Compare a benchmark run against a saved baseline.
+
+    :param baseline: The baseline results, as written by this script.
+    :param current: The current results.
+    :param tolerance: The relative slowdown that is tolerated (e.g. 0.1 for 10%).
+    :return: A list of regression descriptions; empty if nothing regressed.
+    """
+    regressions = []
+    for section in ("operations", "executors"):
+        previous = {_record_key(record): record for record in baseline.get(section, [])}
+        for record in current.get(section, []):
+            old = previous.get(_record_key(record))
+            if old is None:
+                continue
+            for metric in COMPARED_METRICS:
+                before, after = old.get(metric), record.get(metric)
+                if not before or after is None:
+                    continue
+                if metric in HIGHER_IS_BETTER:
+                    regressed = after < before * (1 - tolerance)
+                else:
+                    regressed = after > before * (1 + tolerance)
+                if regressed:
+                    name = "/".join(str(part) for part in _record_key(record))
+                    regressions.append(f"{section} {name} {metric}: {before:.2f} -> {after:.2f} "
+                                       f"({(after - before) / before:+.1%})")
+    return regressions
+
+
+def main():
+    """
+    Benchmark every image processing operation and executor on synthetic images and report the results as JSON.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the concurrent image processing toolbox.")
+    parser.add_argument("--resolutions", nargs="+", default=["640x480", "1920x1080"],
+                        help="Image sizes as WIDTHxHEIGHT.")
+    parser.add_argument("--channels", nargs="+", type=int, default=[1, 3], help="Channel counts to test.")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per operation and image.")
+    parser.add_argument("--batch", type=int, default=16, help="Images per batch for the executor comparison.")
+    parser.add_argument("--executors", nargs="+", choices=EXECUTORS, default=EXECUTORS,
+                        help="Executors to compare.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Workers for the thread, process and pipeline executors.")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of standard output.")
+    parser.add_argument("--compare", help="A baseline JSON file to check the results against.")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Relative slowdown tolerated before a result is flagged as a regression.")
+    args = parser.parse_args()
+
+    images = {}
+    for resolution in args.resolutions:
+        width, height = (int(value) for value in resolution.lower().split("x"))
+        for channels in args.channels:
+            images[(resolution, channels)] = synthetic_image(width, height, channels)
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "cpus": os.cpu_count(),
+            "platform": platform.platform(),
+        },
+        "operations": benchmark_operations(images, args.repeat),
+        "executors": benchmark_executors(images, args.batch, args.executors, args.workers) if args.executors else [],
+    }
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare_results(json.load(baseline), results, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
 
 if __name__ == '__main__':
-    benchmark_apply_operation()
\ No newline at end of file
+    main()
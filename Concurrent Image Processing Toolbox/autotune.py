@@ -0,0 +1,204 @@
+#Libraries used
+import json
+import os
+import platform
+import threading
+import time
+
+
+def host_key():
+    """
+    Identify this host for tuning profiles: its name, architecture and core count.
+
+    :return: The host key string.
+    """
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count() or 1}"
+
+
+def load_profile(path, workload):
+    """
+    Look up a tuned configuration for a workload on this host.
+
+    :param path: The path to the profile file.
+    :param workload: The workload key, e.g. the names of the operations.
+    :return: A dictionary with workers, opencv_threads and the measured outputs_per_s, or None if the profile
+             has no entry for this host and workload.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as profile:
+        return json.load(profile).get(host_key(), {}).get(workload)
+
+
+def save_profile(path, workload, config):
+    """
+    Store a tuned configuration for a workload on this host, keeping the entries of other hosts and workloads.
+
+    :param path: The path to the profile file; it is created if missing.
+    :param workload: The workload key.
+    :param config: A dictionary with workers, opencv_threads and outputs_per_s.
+    """
+    entries = {}
+    if os.path.exists(path):
+        with open(path) as profile:
+            entries = json.load(profile)
+    entries.setdefault(host_key(), {})[workload] = config
+    temporary = path + ".tmp"
+    with open(temporary, "w") as profile:
+        json.dump(entries, profile, indent=2)
+    os.replace(temporary, path)
+
+
+class HillClimber:
+    """
+    Searches (workers, OpenCV threads) configurations for the highest measured throughput.
+
+    From the current best configuration, neighbours with twice or half the workers or OpenCV threads, or trading
+    one for the other, are tried one at a time. A neighbour that beats the best by more than the tolerance becomes
+    the new best and the search continues from there; once no untried neighbour is left, or after max_trials
+    measurements, the search settles on the best configuration seen.
+    """
+
+    def __init__(self, start, cores=None, max_workers=None, tolerance=0.05, max_trials=12):
+        """
+        :param start: The first (workers, opencv_threads) configuration.
+        :param cores: The number of cores (defaults to the CPU count); OpenCV threads are capped at it.
+        :param max_workers: The largest worker count tried (defaults to twice the cores, since decode and encode
+                            partly wait on disk).
+        :param tolerance: The relative improvement needed to move to a new configuration.
+        :param max_trials: The maximum number of configurations measured.
+        """
+        self.cores = cores or os.cpu_count() or 1
+        self.max_workers = max_workers or 2 * self.cores
+        self.tolerance = tolerance
+        self.max_trials = max_trials
+        self.current = start
+        self.best = None
+        self.best_rate = 0.0
+        self.measured = {}
+        self.settled = False
+
+    def _neighbours(self, config):
+        workers, opencv_threads = config
+        candidates = [(workers * 2, opencv_threads), (workers // 2, opencv_threads),
+                      (workers, opencv_threads * 2), (workers, opencv_threads // 2),
+                      (workers // 2, opencv_threads * 2), (workers * 2, opencv_threads // 2)]
+        return [(w, o) for w, o in candidates
+                if 1 <= w <= self.max_workers and 1 <= o <= self.cores and (w, o) not in self.measured]
+
+    def record(self, rate):
+        """
+        Record the throughput of the current configuration and pick the next one to measure.
+
+        :param rate: The measured throughput (higher is better).
+        :return: The next configuration, or None once the search has settled (current is then the best).
+        """
+        self.measured[self.current] = rate
+        if self.best is None or rate > self.best_rate * (1 + self.tolerance):
+            self.best, self.best_rate = self.current, rate
+        neighbours = self._neighbours(self.best)
+        if not neighbours or len(self.measured) >= self.max_trials:
+            self.current, self.settled = self.best, True
+            return None
+        self.current = neighbours[0]
+        return self.current
+
+
+class Autotuner:
+    """
+    Tunes an ImageScheduler's worker count and OpenCV threads while it works through a batch.
+
+    A background thread measures the throughput (outputs written per second) over a window of work, feeds it to a
+    HillClimber, and applies the next configuration with ImageScheduler.set_concurrency, until the search settles on
+    the best configuration for the rest of the batch. Before every measurement, including the first, a warm-up
+    interval is discarded, so the rate is not skewed by the work queued or in flight under the previous
+    configuration, or by cold caches and thread start-up.
+    """
+
+    def __init__(self, window=16, min_seconds=0.5, tolerance=0.05, max_trials=12, warmup=8, warmup_seconds=0.1):
+        """
+        :param window: The minimum number of outputs written per measurement.
+        :param min_seconds: The minimum duration of a measurement.
+        :param tolerance: The relative improvement needed to move to a new configuration.
+        :param max_trials: The maximum number of configurations measured.
+        :param warmup: The minimum number of outputs written and discarded before each measurement.
+        :param warmup_seconds: The minimum duration of the warm-up.
+        """
+        self.window = window
+        self.min_seconds = min_seconds
+        self.warmup = warmup
+        self.warmup_seconds = warmup_seconds
+        self.tolerance = tolerance
+        self.max_trials = max_trials
+        self.climber = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._scheduler = None
+
+    def start(self, scheduler, outputs):
+        """
+        Start tuning a scheduler from its current configuration.
+        :param scheduler: The ImageScheduler to tune.
+        :param outputs: A callable returning the number of outputs written so far, e.g. lambda: sink.written. Written
+                        outputs, rather than the scheduler's completed tasks, include encoding on writer threads and
+                        do not depend on how the operations were planned.
+        """
+        self.climber = HillClimber((scheduler.workers, scheduler.opencv_threads), tolerance=self.tolerance,
+                                   max_trials=self.max_trials)
+        self._scheduler = scheduler
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(scheduler, outputs), daemon=True)
+        self._thread.start()
+
+    def _wait(self, outputs, count, seconds):
+        """
+        Wait until at least count outputs have been written and seconds have passed.
+        :param outputs: The callable counting the outputs written so far.
+        :param count: The minimum number of outputs.
+        :param seconds: The minimum duration.
+        :return: The number of outputs written and the elapsed time, or None if tuning was stopped first.
+        """
+        first = outputs()
+        started = time.perf_counter()
+        while True:
+            if self._stop.wait(0.05):
+                return None
+            done = outputs() - first
+            elapsed = time.perf_counter() - started
+            if done >= count and elapsed >= seconds:
+                return done, elapsed
+
+    def _run(self, scheduler, outputs):
+        while not self.climber.settled:
+            if self._wait(outputs, self.warmup, self.warmup_seconds) is None:
+                return
+            measured = self._wait(outputs, self.window, self.min_seconds)
+            if measured is None:
+                return
+            done, elapsed = measured
+            following = self.climber.record(done / elapsed)
+            workers, opencv_threads = following or self.climber.best
+            scheduler.set_concurrency(workers, opencv_threads)
+
+    def stop(self):
+        """
+        Stop tuning, e.g. because the batch is finished, and leave the scheduler on the best configuration found.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.climber is not None and not self.climber.settled and self.climber.best is not None:
+            self._scheduler.set_concurrency(*self.climber.best)
+
+    def result(self):
+        """
+        Report the best configuration measured so far.
+        :return: A dictionary with workers, opencv_threads, outputs_per_s and settled, or None if nothing was
+                 measured.
+        """
+        if self.climber is None or self.climber.best is None:
+            return None
+        workers, opencv_threads = self.climber.best
+        return {"workers": workers, "opencv_threads": opencv_threads,
+                "outputs_per_s": self.climber.best_rate, "settled": self.climber.settled}
@@ -0,0 +1,54 @@
+#Libraries used
+import itertools
+import numpy as np
+
+
+def iter_batches(items, batch_size):
+    """
+    Split an iterable into lists of at most batch_size items, consuming it lazily.
+
+    :param items: An iterable.
+    :param batch_size: The maximum number of items per batch.
+    :return: A generator of lists.
+    """
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def group_by_shape(arrays):
+    """
+    Group arrays that can be stacked together, i.e. that have the same shape and dtype.
+
+    :param arrays: A sequence of NumPy arrays.
+    :return: A list of index lists, one per (shape, dtype) group, in order of first appearance.
+    """
+    groups = {}
+    for index, array in enumerate(arrays):
+        groups.setdefault((array.shape, array.dtype.str), []).append(index)
+    return list(groups.values())
+
+
+def stack_group(arrays, indices):
+    """
+    Stack the arrays of one group into a single (N, H, W[, C]) array.
+
+    :param arrays: A sequence of NumPy arrays.
+    :param indices: The indices of the arrays to stack, as produced by group_by_shape.
+    :return: The stacked array.
+    """
+    return np.stack([arrays[index] for index in indices])
+
+
+def as_rows(stack):
+    """
+    View an (N, H, W[, C]) stack as one tall (N*H, W[, C]) image, so a per-pixel operation can process the whole
+    stack in a single call.
+
+    :param stack: A C-contiguous stack of images.
+    :return: A view of the stack.
+    """
+    return stack.reshape((stack.shape[0] * stack.shape[1],) + stack.shape[2:])
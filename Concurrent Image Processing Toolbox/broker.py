@@ -0,0 +1,333 @@
+#Libraries used
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+import uuid
+from toolbox_client import parse_address, send_request
+
+# Where the broker listens unless told otherwise; overridden by the IMAGE_TOOLBOX_BROKER environment variable.
+DEFAULT_BROKER = os.environ.get("IMAGE_TOOLBOX_BROKER", "127.0.0.1:7878")
+
+
+class JobQueue:
+    """
+    A persistent queue of image jobs handed out under leases, for spreading one batch over many worker machines.
+
+    Every job is one input image with the batch's operations and output settings. A worker leases a few jobs at a
+    time and must renew its leases with heartbeats while it works on them; jobs whose lease expires (because the
+    worker died or lost its connection) go back to the queue and are leased again, up to max_attempts times. Jobs
+    are stored in SQLite, so a restarted broker carries on where it stopped. The queue is thread-safe.
+    """
+
+    def __init__(self, path, lease_seconds=60.0, max_attempts=3):
+        """
+        :param path: The path to the queue database; it is created if missing. ":memory:" keeps it in memory.
+        :param lease_seconds: How long a lease lasts without a heartbeat.
+        :param max_attempts: How many times a job is leased before it is marked as failed.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS batches (id TEXT PRIMARY KEY, payload TEXT NOT NULL, created REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY, batch TEXT NOT NULL, input TEXT NOT NULL, prefix TEXT,
+                status TEXT NOT NULL DEFAULT 'pending', worker TEXT, expires REAL, attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT, outputs TEXT);
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+            CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (status, expires);
+            CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch, status);
+        """)
+        self._connection.commit()
+
+    def create_batch(self, payload):
+        """
+        Register a batch: the settings shared by its jobs.
+        :param payload: A JSON-serializable dictionary, e.g. the operations and output settings.
+        :return: The batch id.
+        """
+        batch = uuid.uuid4().hex
+        with self._lock:
+            self._connection.execute("INSERT INTO batches VALUES (?, ?, ?)", (batch, json.dumps(payload), time.time()))
+            self._connection.commit()
+        return batch
+
+    def submit(self, batch, inputs):
+        """
+        Queue jobs for a batch.
+        :param batch: The batch id, from create_batch.
+        :param inputs: A list of [input path, output name prefix] pairs; the prefix may be None.
+        :return: The number of jobs queued.
+        """
+        with self._lock:
+            if self._connection.execute("SELECT 1 FROM batches WHERE id = ?", (batch,)).fetchone() is None:
+                raise ValueError(f"Unknown batch: {batch}")
+            self._connection.executemany("INSERT INTO jobs (batch, input, prefix) VALUES (?, ?, ?)",
+                                         [(batch, path, prefix) for path, prefix in inputs])
+            self._connection.commit()
+        return len(inputs)
+
+    def _expire(self, now):
+        # Leases that ran out go back to the queue, or fail once they have used up their attempts.
+        self._connection.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, worker = NULL, "
+            "error = CASE WHEN attempts >= ? THEN 'lease expired' ELSE error END "
+            "WHERE status = 'leased' AND expires < ?", (self.max_attempts, self.max_attempts, now))
+
+    def lease(self, worker, count):
+        """
+        Lease pending jobs to a worker, oldest first.
+        :param worker: The worker id.
+        :param count: The maximum number of jobs.
+        :return: A list of job dictionaries: id, batch, input, prefix, attempts and the batch payload.
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            rows = self._connection.execute(
+                "SELECT jobs.id, jobs.batch, jobs.input, jobs.prefix, jobs.attempts, batches.payload FROM jobs "
+                "JOIN batches ON batches.id = jobs.batch WHERE jobs.status = 'pending' ORDER BY jobs.id LIMIT ?",
+                (count,)).fetchall()
+            self._connection.executemany(
+                "UPDATE jobs SET status = 'leased', worker = ?, expires = ?, attempts = attempts + 1 WHERE id = ?",
+                [(worker, now + self.lease_seconds, row[0]) for row in rows])
+            self._connection.commit()
+        return [{"id": job_id, "batch": batch, "input": path, "prefix": prefix, "attempts": attempts + 1,
+                 "payload": json.loads(payload)} for job_id, batch, path, prefix, attempts, payload in rows]
+
+    def heartbeat(self, worker, job_ids):
+        """
+        Renew a worker's leases.
+        :param worker: The worker id.
+        :param job_ids: The ids of the jobs it is still working on.
+        :return: The ids whose leases were renewed; the others have expired and been handed out again.
+        """
+        expires = time.time() + self.lease_seconds
+        renewed = []
+        with self._lock:
+            for job_id in job_ids:
+                cursor = self._connection.execute(
+                    "UPDATE jobs SET expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                    (expires, job_id, worker))
+                if cursor.rowcount:
+                    renewed.append(job_id)
+            self._connection.commit()
+        return renewed
+
+    def complete(self, job_id, outputs):
+        """
+        Record that a job succeeded. A late completion from a worker whose lease expired is still accepted, since
+        outputs are written atomically and the job produces the same outputs wherever it runs.
+        :param job_id: The job id.
+        :param outputs: The output paths written.
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'done', worker = NULL, error = NULL, outputs = ? WHERE id = ?",
+                (json.dumps(outputs), job_id))
+            self._connection.commit()
+
+    def fail(self, job_id, error):
+        """
+        Record that a job failed; it is queued again unless it has used up its attempts.
+        :param job_id: The job id.
+        :param error: A description of the failure.
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, worker = NULL, "
+                "error = ? WHERE id = ? AND status != 'done'", (self.max_attempts, error, job_id))
+            self._connection.commit()
+
+    def progress(self, batch):
+        """
+        Count the jobs of a batch by status, and list the failed ones.
+        :param batch: The batch id.
+        :return: A dictionary with pending, leased, done and failed counts, and errors: [input, error] pairs of the
+                 failed jobs.
+        """
+        with self._lock:
+            self._expire(time.time())
+            self._connection.commit()
+            counts = dict(self._connection.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE batch = ? GROUP BY status", (batch,)))
+            errors = self._connection.execute(
+                "SELECT input, error FROM jobs WHERE batch = ? AND status = 'failed' ORDER BY id", (batch,)).fetchall()
+        progress = {status: counts.get(status, 0) for status in ("pending", "leased", "done", "failed")}
+        progress["errors"] = [list(error) for error in errors]
+        return progress
+
+    def handle(self, request):
+        """
+        Answer one request from a coordinator or worker; the command names the method to call and the remaining
+        fields are its arguments.
+        :param request: The request dictionary.
+        :return: The response dictionary.
+        """
+        command = request.get("command")
+        try:
+            if command == "create_batch":
+                return {"status": "ok", "batch": self.create_batch(request["payload"])}
+            if command == "submit":
+                return {"status": "ok", "queued": self.submit(request["batch"], request["inputs"])}
+            if command == "lease":
+                return {"status": "ok", "jobs": self.lease(request["worker"], request.get("count", 1)),
+                        "lease_seconds": self.lease_seconds}
+            if command == "heartbeat":
+                return {"status": "ok", "renewed": self.heartbeat(request["worker"], request["jobs"])}
+            if command == "complete":
+                self.complete(request["job"], request.get("outputs", []))
+                return {"status": "ok"}
+            if command == "fail":
+                self.fail(request["job"], request.get("error", ""))
+                return {"status": "ok"}
+            if command == "progress":
+                return dict(self.progress(request["batch"]), status="ok")
+        except (KeyError, ValueError) as error:
+            return {"status": "error", "error": f"Invalid {command} request: {error}"}
+        return {"status": "error", "error": f"Unsupported command: {command}"}
+
+    def close(self):
+        """
+        Close the queue database.
+        """
+        with self._lock:
+            self._connection.close()
+
+
+class BrokerClient:
+    """
+    Talks to a broker over TCP (or a Unix domain socket) with the same methods as JobQueue.
+    """
+
+    def __init__(self, address=DEFAULT_BROKER):
+        """
+        :param address: The broker address, "host:port" or a socket path.
+        """
+        self.address = address
+        self.lease_seconds = None
+
+    def _call(self, command, **fields):
+        response = send_request(self.address, dict(fields, command=command))
+        if response.get("status") != "ok":
+            raise RuntimeError(response.get("error", "The broker returned an error"))
+        return response
+
+    def create_batch(self, payload):
+        return self._call("create_batch", payload=payload)["batch"]
+
+    def submit(self, batch, inputs):
+        return self._call("submit", batch=batch, inputs=inputs)["queued"]
+
+    def lease(self, worker, count):
+        response = self._call("lease", worker=worker, count=count)
+        self.lease_seconds = response["lease_seconds"]
+        return response["jobs"]
+
+    def heartbeat(self, worker, job_ids):
+        return self._call("heartbeat", worker=worker, jobs=job_ids)["renewed"]
+
+    def complete(self, job_id, outputs):
+        self._call("complete", job=job_id, outputs=outputs)
+
+    def fail(self, job_id, error):
+        self._call("fail", job=job_id, error=error)
+
+    def progress(self, batch):
+        response = self._call("progress", batch=batch)
+        del response["status"]
+        return response
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads newline-delimited JSON requests from one connection and writes one JSON response line per request.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {"status": "error", "error": "Malformed request"}
+            else:
+                if request.get("command") == "shutdown":
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    response = {"status": "ok"}
+                else:
+                    response = self.server.queue.handle(request)
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(address=DEFAULT_BROKER, queue=None, ready=None):
+    """
+    Serve a job queue until a shutdown request arrives.
+
+    :param address: "host:port" for TCP, or a socket path. The protocol is not authenticated, so to accept workers
+                    on other machines use an address on a private network only they can reach.
+    :param queue: The JobQueue (defaults to an in-memory one).
+    :param ready: An optional threading.Event set once the broker is listening.
+    """
+    queue = queue or JobQueue(":memory:")
+    family, target = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.remove(target)
+        server = _UnixServer(target, _RequestHandler)
+    else:
+        server = _TCPServer(target, _RequestHandler)
+    server.queue = queue
+    print(f"Broker listening on {address}")
+    if ready is not None:
+        ready.set()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        queue.close()
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.remove(target)
+
+
+def main():
+    """
+    Start a broker. Batches are submitted and worked on with distributed.py.
+    """
+    parser = argparse.ArgumentParser(description="Hand out image jobs to distributed workers under leases.")
+    parser.add_argument("--address", default=DEFAULT_BROKER,
+                        help="host:port to listen on, or a Unix domain socket path. There is no authentication: "
+                             "anyone who can connect can queue jobs and shut the broker down, so for workers on "
+                             "other machines listen on a private interface only they can reach, not 0.0.0.0.")
+    parser.add_argument("--db", default=":memory:",
+                        help="SQLite file keeping the queue across broker restarts (defaults to memory only).")
+    parser.add_argument("--lease-seconds", type=float, default=60.0,
+                        help="How long a worker may hold a job without a heartbeat before it is handed out again.")
+    parser.add_argument("--max-attempts", type=int, default=3, help="How many times a job is tried before it fails.")
+    args = parser.parse_args()
+    try:
+        serve(args.address, JobQueue(args.db, args.lease_seconds, args.max_attempts))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
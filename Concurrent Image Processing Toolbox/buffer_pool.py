@@ -0,0 +1,104 @@
+#Libraries used
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class BufferPool:
+    """
+    A pool of output arrays keyed by (shape, dtype), so operations on same-sized images write into buffers that were
+    already allocated (through OpenCV's dst= parameters) instead of allocating, page-faulting and freeing a fresh
+    array for every result.
+
+    Buffers are taken with acquire() and handed back with release() once their contents are no longer needed, e.g.
+    after the result has been encoded. Free buffers are bounded by max_bytes; when the limit is exceeded the buffers
+    of the least recently released shape are evicted first. The pool is thread-safe.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+        :param max_bytes: The maximum total size of the free buffers kept for reuse.
+        """
+        self.max_bytes = max_bytes
+        self.allocations = 0
+        self.reuses = 0
+        self.bytes_allocated = 0
+        self.bytes_reused = 0
+        self.evictions = 0
+        self._free = OrderedDict()
+        self._free_bytes = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype):
+        """
+        Take a buffer from the pool, allocating one if no free buffer has this shape and dtype. Its contents are
+        undefined.
+        :param shape: The shape of the buffer.
+        :param dtype: The NumPy dtype of the buffer.
+        :return: The buffer as a C-contiguous NumPy array.
+        """
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            buffers = self._free.get(key)
+            if buffers:
+                buffer = buffers.pop()
+                if not buffers:
+                    del self._free[key]
+                self._free_bytes -= buffer.nbytes
+                self.reuses += 1
+                self.bytes_reused += buffer.nbytes
+                return buffer
+        buffer = np.empty(key[0], key[1])
+        with self._lock:
+            self.allocations += 1
+            self.bytes_allocated += buffer.nbytes
+        return buffer
+
+    def release(self, buffer):
+        """
+        Hand a buffer back for reuse. Arrays that do not own their memory (views, memory maps) are ignored, so any
+        result may be released; the caller must not use the buffer afterwards.
+        :param buffer: The array, typically from acquire() or an operation that wrote into one.
+        """
+        if not isinstance(buffer, np.ndarray) or buffer.base is not None or not buffer.flags.c_contiguous:
+            return
+        if buffer.nbytes > self.max_bytes:
+            with self._lock:
+                self.evictions += 1
+            return
+        key = (buffer.shape, buffer.dtype)
+        with self._lock:
+            self._free.setdefault(key, []).append(buffer)
+            self._free.move_to_end(key)
+            self._free_bytes += buffer.nbytes
+            while self._free_bytes > self.max_bytes:
+                oldest, buffers = next(iter(self._free.items()))
+                self._free_bytes -= buffers.pop(0).nbytes
+                self.evictions += 1
+                if not buffers:
+                    del self._free[oldest]
+
+    def clear(self):
+        """
+        Drop every free buffer.
+        """
+        with self._lock:
+            self._free.clear()
+            self._free_bytes = 0
+
+    def stats(self):
+        """
+        Report the pool counters. Once a batch of same-sized images reaches a steady state, allocations stop growing
+        and every further buffer is a reuse.
+
+        :return: A dictionary with allocations, reuses, bytes allocated and reused, evictions and the free size.
+        """
+        with self._lock:
+            return {
+                "buffer_pool_allocations": self.allocations,
+                "buffer_pool_reuses": self.reuses,
+                "buffer_pool_mb_allocated": self.bytes_allocated / (1024 * 1024),
+                "buffer_pool_mb_reused": self.bytes_reused / (1024 * 1024),
+                "buffer_pool_evictions": self.evictions,
+                "buffer_pool_free_mb": self._free_bytes / (1024 * 1024),
+            }
@@ -2,10 +2,30 @@
 import cv2
 import numpy as np
 import concurrent.futures
+import contextlib
 import os
 import argparse
+import autotune
+import batching
+from buffer_pool import BufferPool
+import convolution
+import functools
+import image_header
+import threading
+import time
+from dataclasses import dataclass, field
 from enum import Enum
 from queue import Queue
+from manifest import Manifest
+from metrics import Metrics
+from output_sink import OutputSink
+import perceptual_hash
+import result_cache
+import shared_image
+import tiling
+import video
+from scheduler import ImageScheduler, ThroughputStats, claim_opencv_threads, get_scheduler, release_opencv_threads
+import streaming
 
 
 class ImageOperation(Enum):
@@ -19,13 +39,123 @@ class ImageOperation(Enum):
     THRESHOLD = 8
     EROSION = 9
     DILATION = 10
+    PYRAMID = 11
 
 
-def histogram_equalization(input_image):
+# Structuring element shapes accepted by erosion and dilation.
+MORPH_SHAPES = {
+    "rect": cv2.MORPH_RECT,
+    "ellipse": cv2.MORPH_ELLIPSE,
+    "cross": cv2.MORPH_CROSS,
+}
+
+# Downscaling methods accepted by the pyramid operation.
+PYRAMID_METHODS = ("area", "pyrdown")
+
+# Named kernels accepted by the filter operation in place of explicit rows.
+KERNEL_PRESETS = {
+    "sharpen": ((0, -1, 0), (-1, 5, -1), (0, -1, 0)),
+    "box3": ((1 / 9,) * 3,) * 3,
+    "laplacian": ((0, 1, 0), (1, -4, 1), (0, 1, 0)),
+    "emboss": ((-2, -1, 0), (-1, 1, 1), (0, 1, 2)),
+}
+
+
+# The objects below are derived from an operation's parameters (and, for rotation, the image size) only, so they
+# are built once per distinct key and shared by every image in a batch. They are read-only.
+
+@functools.lru_cache(maxsize=64)
+def _structuring_element(kernel_size, shape="rect"):
+    """
+    Build the structuring element for erosion and dilation.
+    :param kernel_size: The edge length of the element.
+    :param shape: The shape of the element (from MORPH_SHAPES).
+    :return: A read-only uint8 array.
+    """
+    if shape not in MORPH_SHAPES:
+        raise ValueError(f"Unsupported structuring element shape: {shape}")
+    element = cv2.getStructuringElement(MORPH_SHAPES[shape], (kernel_size, kernel_size))
+    element.flags.writeable = False
+    return element
+
+
+@functools.lru_cache(maxsize=64)
+def _rotation_matrix(size, angle):
+    """
+    Build the matrix rotating an image of the given size about its centre.
+    :param size: The (rows, cols) of the image.
+    :param angle: The rotation angle in degrees.
+    :return: A read-only 2x3 affine matrix.
+    """
+    rows, cols = size
+    matrix = cv2.getRotationMatrix2D((cols / 2, rows / 2), angle, 1)
+    matrix.flags.writeable = False
+    return matrix
+
+
+# Remap grids take 6 bytes per pixel, so only a few image sizes are kept.
+@functools.lru_cache(maxsize=4)
+def _rotation_maps(size, angle):
+    """
+    Build the fixed-point remap grid equivalent to rotating an image of the given size about its centre.
+    :param size: The (rows, cols) of the image.
+    :param angle: The rotation angle in degrees.
+    :return: A pair of read-only maps for cv2.remap.
+    """
+    rows, cols = size
+    inverse = cv2.invertAffineTransform(_rotation_matrix(size, angle))
+    x = np.arange(cols, dtype=np.float64)
+    y = np.arange(rows, dtype=np.float64)[:, None]
+    map_x = (inverse[0, 0] * x + inverse[0, 1] * y + inverse[0, 2]).astype(np.float32)
+    map_y = (inverse[1, 0] * x + inverse[1, 1] * y + inverse[1, 2]).astype(np.float32)
+    map1, map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+    map1.flags.writeable = False
+    map2.flags.writeable = False
+    return map1, map2
+
+
+@functools.lru_cache(maxsize=64)
+def _prepared_kernel(kernel):
+    """
+    Convert a kernel given as rows of numbers, or as a name from KERNEL_PRESETS, into an array for filter2D.
+    :param kernel: A tuple of rows, or a preset name.
+    :return: A read-only float32 array.
+    """
+    array = np.array(KERNEL_PRESETS.get(kernel, kernel), dtype=np.float32)
+    array.flags.writeable = False
+    return array
+
+
+def _filter_kernel(kernel):
+    """
+    Get the filter kernel as an array, using the cache for kernels that come from an operation spec.
+    :param kernel: A NumPy array, a tuple of rows, or a preset name.
+    :return: The kernel as a NumPy array.
+    """
+    if isinstance(kernel, np.ndarray):
+        return kernel
+    return _prepared_kernel(kernel)
+
+
+def derived_cache_stats():
+    """
+    Report how often the derived-object caches were hit.
+    :return: A dictionary of hit and miss counts per cache.
+    """
+    stats = {}
+    for name, cached in (("structuring_elements", _structuring_element), ("rotation_matrices", _rotation_matrix),
+                         ("rotation_maps", _rotation_maps), ("filter_kernels", _prepared_kernel)):
+        info = cached.cache_info()
+        stats[f"{name}_hits"], stats[f"{name}_misses"] = info.hits, info.misses
+    return stats
+
+
+def histogram_equalization(input_image, dst=None):
     """
     Apply histogram equalization to an image to improve its contrast.
     
     :param input_image: The input image as a NumPy array.
+    :param dst: An optional preallocated output array to write the result into.
     :return: The image with equalized histogram as a NumPy array.
     """
     if len(input_image.shape) == 3:
@@ -33,218 +163,2357 @@ def histogram_equalization(input_image):
         channels = cv2.split(ycrcb)
         cv2.equalizeHist(channels[0], channels[0])
         ycrcb = cv2.merge(channels)
-        return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR)
+        return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR, dst=dst)
     else:
-        return cv2.equalizeHist(input_image)
+        return cv2.equalizeHist(input_image, dst=dst)
 
 
-def filter_image(input_image, kernel):
+def filter_image(input_image, kernel, dst=None):
     """
     Apply a custom filter to an image using the given kernel.
+    Large kernels are applied with sepFilter2D when they are separable, or through the frequency domain when they
+    are above the calibrated size (see convolution.choose_path).
     
     :param input_image: The input image as a NumPy array.
     :param kernel: The custom kernel for the filter.
+    :param dst: An optional preallocated output array to write the result into.
     :return: The filtered image as a NumPy array.
     """
-    return cv2.filter2D(input_image, -1, kernel)
+    return convolution.convolve(input_image, kernel, dst=dst)
 
 
-def threshold_image(input_image, threshold_value):
+def threshold_image(input_image, threshold_value, dst=None):
     """
     Apply binary thresholding to an image using the given threshold value.
     
     :param input_image: The input image as a NumPy array.
     :param threshold_value: The threshold value for binary thresholding.
+    :param dst: An optional preallocated output array to write the result into.
     :return: The thresholded image as a NumPy array.
     """
-    _, thresh = cv2.threshold(input_image, threshold_value, 255, cv2.THRESH_BINARY)
+    _, thresh = cv2.threshold(input_image, threshold_value, 255, cv2.THRESH_BINARY, dst=dst)
     return thresh
 
 
-def erosion_image(input_image, kernel_size, iterations):
+def erosion_image(input_image, kernel_size, iterations, dst=None, shape="rect"):
     """
     Apply the erosion morphological operation to an image using the given kernel size and number of iterations.
     
     :param input_image: The input image as a NumPy array.
     :param kernel_size: The size of the structuring element for the erosion operation.
     :param iterations: The number of times the operation is applied.
+    :param dst: An optional preallocated output array to write the result into.
+    :param shape: The shape of the structuring element (from MORPH_SHAPES).
     :return: The eroded image as a NumPy array.
     """
-    kernel = np.ones((kernel_size, kernel_size), np.uint8)
-    return cv2.erode(input_image, kernel, iterations=iterations)
+    return cv2.erode(input_image, _structuring_element(kernel_size, shape), dst=dst, iterations=iterations)
 
 
-def dilation_image(input_image, kernel_size, iterations):
+def dilation_image(input_image, kernel_size, iterations, dst=None, shape="rect"):
     """
     Apply the dilation morphological operation to an image using the given kernel size and number of iterations.
     
     :param input_image: The input image as a NumPy array.
     :param kernel_size: The size of the structuring element for the dilation operation.
     :param iterations:param iterations: The number of times the operation is applied.
+    :param dst: An optional preallocated output array to write the result into.
+    :param shape: The shape of the structuring element (from MORPH_SHAPES).
     :return: The dilated image as a NumPy array.
     """
-    kernel = np.ones((kernel_size, kernel_size), np.uint8)
-    return cv2.dilate(input_image, kernel, iterations=iterations)
+    return cv2.dilate(input_image, _structuring_element(kernel_size, shape), dst=dst, iterations=iterations)
 
-def resize_image(input_image, scale_x, scale_y):
+def resize_image(input_image, scale_x, scale_y, dst=None, size=None):
     """
     Resize an image using the given scaling factors for x and y axes.
     
     :param input_image: The input image as a NumPy array.
     :param scale_x: The scaling factor for the x-axis.
     :param scale_y: The scaling factor for the y-axis.
+    :param dst: An optional preallocated output array to write the result into.
+    :param size: An optional (width, height) output size; when given, the scaling factors are ignored.
     :return: The resized image as a NumPy array.
     """
-    return cv2.resize(input_image, None, fx=scale_x, fy=scale_y, interpolation=cv2.INTER_LINEAR)
+    if size is not None:
+        return cv2.resize(input_image, size, dst=dst, interpolation=cv2.INTER_LINEAR)
+    return cv2.resize(input_image, None, dst=dst, fx=scale_x, fy=scale_y, interpolation=cv2.INTER_LINEAR)
 
 
-def rotate_image(input_image, angle):
+def rotate_image(input_image, angle, dst=None, remap=False):
     """
     Rotate an image by the given angle.
     
     :param input_image: The input image as a NumPy array.
     :param angle: The rotation angle in degrees.
+    :param dst: An optional preallocated output array to write the result into.
+    :param remap: Whether to use a cached fixed-point remap grid instead of warpAffine. This is faster for batches of
+                  same-sized images, but interpolates with less precision (pixels may differ by a few levels).
     :return: The rotated image as a NumPy array.
     """
     rows, cols = input_image.shape[:2]
-    center = (cols / 2, rows / 2)
-    rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1)
-    return cv2.warpAffine(input_image, rotation_matrix, (cols, rows))
+    if remap:
+        map1, map2 = _rotation_maps((rows, cols), angle)
+        return cv2.remap(input_image, map1, map2, cv2.INTER_LINEAR, dst=dst)
+    return cv2.warpAffine(input_image, _rotation_matrix((rows, cols), angle), (cols, rows), dst=dst)
 
 
-def blur_image(input_image, kernel_size):
+def blur_image(input_image, kernel_size, dst=None):
     """
     Apply a Gaussian blur to an image using the given kernel size.
     
     :param input_image: The input image as a NumPy array.
     :param kernel_size: The size of the Gaussian kernel.
+    :param dst: An optional preallocated output array to write the result into.
     :return: The blurred image as a NumPy array.
     """
-    return cv2.blur(input_image, (kernel_size, kernel_size))
+    return cv2.blur(input_image, (kernel_size, kernel_size), dst=dst)
 
 
-def canny_image(input_image, lower_threshold, upper_threshold):
+def canny_image(input_image, lower_threshold, upper_threshold, dst=None):
     """
     Apply the Canny edge detection algorithm to an image using the given threshold values.
     
     :param input_image: The input image as a NumPy array.
     :param lower_threshold: The lower threshold for edges.
     :param upper_threshold: The upper threshold for edges.
+    :param dst: An optional preallocated output array to write the result into.
     :return: The image with detected edges as a NumPy array.
     """
-    return cv2.Canny(input_image, lower_threshold, upper_threshold)
+    return cv2.Canny(input_image, lower_threshold, upper_threshold, edges=dst)
 
 
-def adjust_contrast_brightness(input_image, contrast, brightness):
+def adjust_contrast_brightness(input_image, contrast, brightness, dst=None):
     """
     Adjust the contrast and brightness of an image using the given factors.
     
     :param input_image: The input image as a NumPy array.
     :param contrast: The contrast adjustment factor.
     :param brightness: The brightness adjustment factor.
+    :param dst: An optional preallocated output array to write the result into.
     :return: The image with adjusted contrast and brightness as a NumPy array.
     """
-    return cv2.addWeighted(input_image, contrast, np.zeros(input_image.shape, input_image.dtype), 0, brightness)
+    # The second source gets a weight of 0, so passing the input again avoids allocating a zero image.
+    return cv2.addWeighted(input_image, contrast, input_image, 0, brightness, dst=dst)
+
+
+def pyramid_level_shape(image_shape, size):
+    """
+    Compute the shape of a pyramid level: the image scaled so that its longer edge is at most the given size,
+    keeping the aspect ratio. Images are never upscaled.
+    :param image_shape: The shape of the full-resolution image.
+    :param size: The maximum edge length of the level in pixels.
+    :return: The shape of the level.
+    """
+    rows, cols = image_shape[:2]
+    scale = min(1.0, size / max(rows, cols))
+    return (max(1, int(round(rows * scale))), max(1, int(round(cols * scale)))) + tuple(image_shape[2:])
+
+
+def pyramid_image(input_image, sizes, method="area"):
+    """
+    Downscale an image to several sizes in one pass, deriving each level from the previous (larger) one instead
+    of from the full-resolution image.
+    
+    :param input_image: The input image as a NumPy array.
+    :param sizes: The maximum edge lengths of the levels, largest first.
+    :param method: "area" to resize each level from the previous one with area interpolation, or "pyrdown" to
+                   halve with pyrDown as long as possible and resize the remainder with area interpolation.
+    :return: A list with one image per size; a level as large as the input is the input itself.
+    """
+    levels = []
+    current = input_image
+    for size in sizes:
+        rows, cols = pyramid_level_shape(input_image.shape, size)[:2]
+        if method == "pyrdown":
+            while (current.shape[0] + 1) // 2 >= rows and (current.shape[1] + 1) // 2 >= cols:
+                current = cv2.pyrDown(current)
+        if current.shape[:2] != (rows, cols):
+            current = cv2.resize(current, (cols, rows), interpolation=cv2.INTER_AREA)
+        levels.append(current)
+    return levels
+
+
+# The parameters every operation accepts, with the values used when they are not given.
+DEFAULT_PARAMETERS = {
+    ImageOperation.RESIZE: {"scale_x": 2.0, "scale_y": 2.0, "width": 0, "height": 0},
+    ImageOperation.ROTATE: {"angle": 45.0, "remap": False},
+    ImageOperation.BLUR: {"kernel_size": 5},
+    ImageOperation.CANNY: {"lower_threshold": 100.0, "upper_threshold": 200.0},
+    ImageOperation.CONTRAST_BRIGHTNESS: {"contrast": 1.5, "brightness": 50.0},
+    ImageOperation.HISTOGRAM_EQUALIZATION: {},
+    ImageOperation.FILTER: {"kernel": "sharpen"},
+    ImageOperation.THRESHOLD: {"threshold_value": 127.0},
+    ImageOperation.EROSION: {"kernel_size": 3, "iterations": 1, "shape": "rect"},
+    ImageOperation.DILATION: {"kernel_size": 3, "iterations": 1, "shape": "rect"},
+    ImageOperation.PYRAMID: {"sizes": (1024, 512, 256), "method": "area"},
+}
+
+
+@dataclass(frozen=True)
+class OperationSpec:
+    """
+    An operation together with the parameters it should run with, e.g. a rotation by 90 degrees.
+    Specs are hashable and picklable, and can be used anywhere an ImageOperation can, including inside chains.
+    """
+    operation: ImageOperation
+    params: tuple = ()
+
+    @property
+    def kwargs(self):
+        return dict(self.params)
+
+
+def make_spec(operation, **params):
+    """
+    Build an operation spec, checking the parameter names against DEFAULT_PARAMETERS.
+    :param operation: The image processing operation (from the ImageOperation enum).
+    :param params: The parameters, e.g. angle=90 for ImageOperation.ROTATE. A filter kernel may be a NumPy array,
+                   a sequence of rows or a name from KERNEL_PRESETS.
+    :return: An OperationSpec.
+    """
+    defaults = DEFAULT_PARAMETERS.get(operation, {})
+    for name in params:
+        if name not in defaults:
+            raise ValueError(f"Unknown parameter for {operation.name.lower()}: {name}")
+    if "kernel" in params and not isinstance(params["kernel"], str):
+        params["kernel"] = tuple(tuple(row) for row in np.asarray(params["kernel"], dtype=np.float64).tolist())
+    if "shape" in params and params["shape"] not in MORPH_SHAPES:
+        raise ValueError(f"Unsupported structuring element shape: {params['shape']}")
+    if "sizes" in params:
+        params["sizes"] = tuple(sorted({int(size) for size in params["sizes"]}, reverse=True))
+        if not params["sizes"] or params["sizes"][-1] < 1:
+            raise ValueError(f"Pyramid sizes must be positive: {params['sizes']}")
+    if "method" in params and params["method"] not in PYRAMID_METHODS:
+        raise ValueError(f"Unsupported pyramid method: {params['method']}")
+    return OperationSpec(operation, tuple(sorted(params.items())))
+
+
+def _parse_value(name, text, default):
+    """
+    Convert a parameter value from its text form to the type of its default.
+    :param name: The parameter name.
+    :param text: The value as written in the spec.
+    :param default: The default value of the parameter.
+    :return: The converted value.
+    """
+    if name == "kernel":
+        if text in KERNEL_PRESETS:
+            return text
+        rows = tuple(tuple(float(value) for value in row.split()) for row in text.split("/"))
+        if not rows[0] or any(len(row) != len(rows[0]) for row in rows):
+            raise ValueError(f"Kernel rows must be non-empty and of equal length: {text}")
+        return rows
+    if name == "sizes":
+        return tuple(int(size) for size in text.split("/"))
+    if isinstance(default, bool):
+        if text.lower() not in ("1", "0", "true", "false", "yes", "no", "on", "off"):
+            raise ValueError(f"Expected a boolean for {name}: {text}")
+        return text.lower() in ("1", "true", "yes", "on")
+    try:
+        return type(default)(text)
+    except ValueError:
+        raise ValueError(f"Expected {type(default).__name__} for {name}: {text}")
+
+
+def parse_operation_spec(text):
+    """
+    Parse an operation written as a name optionally followed by colon-separated parameters, e.g. "blur",
+    "rotate:angle=90" or "canny:lower_threshold=50:upper_threshold=150". Filter kernels are given as a preset
+    name or as rows separated by "/" with whitespace-separated values, e.g. "filter:kernel=0 -1 0/-1 5 -1/0 -1 0".
+    Pyramid sizes are separated by "/" as well, e.g. "pyramid:sizes=2048/512/128".
+    :param text: The operation spec.
+    :return: The operation (from the ImageOperation enum) if no parameters were given, otherwise an OperationSpec.
+    """
+    name, *assignments = text.strip().split(":")
+    try:
+        operation = ImageOperation[name.strip().upper()]
+    except KeyError:
+        raise ValueError(f"Unsupported operation: {name.strip()}")
+    if not assignments:
+        return operation
+    defaults = DEFAULT_PARAMETERS[operation]
+    params = {}
+    for assignment in assignments:
+        key, separator, value = assignment.partition("=")
+        key = key.strip()
+        if not separator or key not in defaults:
+            raise ValueError(f"Unknown parameter for {operation.name.lower()}: {assignment}")
+        params[key] = _parse_value(key, value.strip(), defaults[key])
+    return make_spec(operation, **params)
 
 
-def apply_operation(operation, image, **kwargs):
+def base_operation(operation):
+    """
+    Get the ImageOperation of an operation or operation spec.
+    :param operation: An ImageOperation or an OperationSpec.
+    :return: The ImageOperation.
+    """
+    return operation.operation if isinstance(operation, OperationSpec) else operation
+
+
+def resolve_operation(operation, kwargs):
+    """
+    Work out the operation to run and the full set of parameters to run it with: the defaults, overridden by the
+    keyword arguments, overridden by the spec's own parameters.
+    :param operation: An ImageOperation or an OperationSpec.
+    :param kwargs: Additional keyword arguments for the operation.
+    :return: A tuple of the ImageOperation and a dictionary of parameters.
+    """
+    params = {}
+    if isinstance(operation, OperationSpec):
+        operation, params = operation.operation, operation.kwargs
+    return operation, {**DEFAULT_PARAMETERS.get(operation, {}), **kwargs, **params}
+
+
+# Per-pixel operations that map every uint8 value independently, so they can be expressed as a 256-entry lookup table.
+POINT_OPERATIONS = {
+    ImageOperation.CONTRAST_BRIGHTNESS,
+    ImageOperation.THRESHOLD,
+}
+
+
+def _point_params(operation, kwargs):
+    """
+    Pick the parameters a point operation's lookup table depends on, as a hashable cache key.
+    :param operation: The point operation (from POINT_OPERATIONS), or a spec of one.
+    :param kwargs: The keyword arguments that would be passed to apply_operation.
+    :return: A tuple of the operation and a tuple of its parameters.
+    """
+    operation, params = resolve_operation(operation, kwargs)
+    if operation == ImageOperation.THRESHOLD:
+        return operation, (params['threshold_value'],)
+    return operation, (params['contrast'], params['brightness'])
+
+
+@functools.lru_cache(maxsize=256)
+def _point_lut(steps):
+    """
+    Build the lookup table of a sequence of point operations by running them on every uint8 value once.
+    :param steps: A tuple of (operation, params) pairs, as produced by _point_params.
+    :return: A read-only 1x256 uint8 lookup table.
+    """
+    lut = np.arange(256, dtype=np.uint8).reshape(1, 256)
+    for operation, params in steps:
+        if operation == ImageOperation.THRESHOLD:
+            lut = threshold_image(lut, *params)
+        elif operation == ImageOperation.CONTRAST_BRIGHTNESS:
+            lut = adjust_contrast_brightness(lut, *params)
+    lut.flags.writeable = False
+    return lut
+
+
+def compile_point_operations(operations, **kwargs):
+    """
+    Fuse a run of point operations into a single lookup table, cached by operations and parameters.
+    Applying the table with cv2.LUT gives exactly the same uint8 result as applying the operations one by one.
+    :param operations: A sequence of operations from POINT_OPERATIONS, or specs of them.
+    :param kwargs: Additional keyword arguments for specific operations.
+    :return: A read-only 1x256 uint8 lookup table.
+    """
+    return _point_lut(tuple(_point_params(operation, kwargs) for operation in operations))
+
+
+def estimate_output_shape(operation, image_shape, **kwargs):
+    """
+    Compute the shape of the image apply_operation would return, without running the operation.
+    :param operation: The image processing operation (from the ImageOperation enum), or an OperationSpec.
+    :param image_shape: The shape of the input image.
+    :param kwargs: The keyword arguments that would be passed to apply_operation.
+    :return: The shape of the output.
+    """
+    operation, params = resolve_operation(operation, kwargs)
+    if operation == ImageOperation.RESIZE:
+        return _resize_target(image_shape, params)[::-1] + tuple(image_shape[2:])
+    elif operation == ImageOperation.CANNY:
+        return tuple(image_shape[:2])
+    elif operation == ImageOperation.PYRAMID:
+        return pyramid_level_shape(image_shape, params['sizes'][0])
+    return tuple(image_shape)
+
+
+def _resize_target(image_shape, params):
+    """
+    Compute the output size of a resize. An explicit width and height win over the scaling factors; if only one of
+    them is given, the other follows the aspect ratio.
+    :param image_shape: The shape of the input image.
+    :param params: The resolved resize parameters.
+    :return: The (width, height) of the output.
+    """
+    rows, cols = image_shape[:2]
+    width, height = params['width'], params['height']
+    if width and not height:
+        height = max(1, int(round(rows * width / cols)))
+    elif height and not width:
+        width = max(1, int(round(cols * height / rows)))
+    elif not width:
+        width, height = int(round(cols * params['scale_x'])), int(round(rows * params['scale_y']))
+    return width, height
+
+
+def _estimate_step_bytes(operation, image_shape, itemsize, kwargs):
+    """
+    Estimate the size of the output of one operation; for a pyramid, the total size of all its levels.
+    :return: A tuple of the output shape (the largest level for a pyramid) and the size in bytes.
+    """
+    shape = estimate_output_shape(operation, image_shape, **kwargs)
+    operation, params = resolve_operation(operation, kwargs)
+    if operation == ImageOperation.PYRAMID:
+        return shape, sum(int(np.prod(pyramid_level_shape(image_shape, size))) for size in params['sizes']) * itemsize
+    return shape, int(np.prod(shape)) * itemsize
+
+
+def estimate_output_bytes(operation, image_shape, itemsize=1, **kwargs):
+    """
+    Estimate the size of the image apply_operation (or apply_chain, for a tuple of operations) would return,
+    without running the operation. For a chain this is the largest pair of consecutive intermediates, since two
+    buffers are alive at each step.
+    :param operation: The image processing operation (from the ImageOperation enum), or a tuple of operations.
+    :param image_shape: The shape of the input image.
+    :param itemsize: The size in bytes of one pixel channel.
+    :param kwargs: The keyword arguments that would be passed to apply_operation.
+    :return: The estimated size of the output in bytes.
+    """
+    if isinstance(operation, tuple):
+        peak, previous, shape = 0, 0, image_shape
+        for step in operation:
+            shape, current = _estimate_step_bytes(step, shape, itemsize, kwargs)
+            peak, previous = max(peak, previous + current), current
+        return peak
+    return _estimate_step_bytes(operation, image_shape, itemsize, kwargs)[1]
+
+
+def apply_operation(operation, image, dst=None, **kwargs):
     """
     Apply the specified image processing operation to the input image.
-    :param operation: The image processing operation to apply (from the ImageOperation enum).
+    :param operation: The image processing operation to apply (from the ImageOperation enum), or an OperationSpec.
     :param image: The input image as a NumPy array.
-    :param kwargs: Additional keyword arguments for specific operations.
-    :return: The processed image as a NumPy array, or None if the operation is not supported.
+    :param dst: An optional preallocated output array; it is used if it has the right shape and dtype.
+    :param kwargs: Additional keyword arguments for specific operations; parameters that are not given (here or in
+                   the spec) take their values from DEFAULT_PARAMETERS.
+    :return: The processed image as a NumPy array (a list of images for a pyramid), or None if the operation is not
+             supported.
     """
-    if operation == ImageOperation.HISTOGRAM_EQUALIZATION:
-        return histogram_equalization(image)
+    operation, params = resolve_operation(operation, kwargs)
+    if operation in POINT_OPERATIONS and image.dtype == np.uint8:
+        return cv2.LUT(image, compile_point_operations((operation,), **params), dst=dst)
+    elif operation == ImageOperation.HISTOGRAM_EQUALIZATION:
+        return histogram_equalization(image, dst=dst)
     elif operation == ImageOperation.FILTER:
-        return filter_image(image, kwargs['kernel'])
+        return filter_image(image, _filter_kernel(params['kernel']), dst=dst)
     elif operation == ImageOperation.THRESHOLD:
-        return threshold_image(image, kwargs['threshold_value'])
+        return threshold_image(image, params['threshold_value'], dst=dst)
     elif operation == ImageOperation.EROSION:
-        return erosion_image(image, kwargs['kernel_size'], kwargs['iterations'])
+        return erosion_image(image, params['kernel_size'], params['iterations'], dst=dst, shape=params['shape'])
     elif operation == ImageOperation.DILATION:
-        return dilation_image(image, kwargs['kernel_size'], kwargs['iterations'])
+        return dilation_image(image, params['kernel_size'], params['iterations'], dst=dst, shape=params['shape'])
     elif operation == ImageOperation.RESIZE:
-        return resize_image(image, 2.0, 2.0)
+        size = _resize_target(image.shape, params) if params['width'] or params['height'] else None
+        return resize_image(image, params['scale_x'], params['scale_y'], dst=dst, size=size)
     elif operation == ImageOperation.ROTATE:
-        return rotate_image(image, 45)
+        return rotate_image(image, params['angle'], dst=dst, remap=params['remap'])
     elif operation == ImageOperation.BLUR:
-        return blur_image(image, 5)
+        return blur_image(image, params['kernel_size'], dst=dst)
     elif operation == ImageOperation.CANNY:
-        return canny_image(image, 100, 200)
+        return canny_image(image, params['lower_threshold'], params['upper_threshold'], dst=dst)
     elif operation == ImageOperation.CONTRAST_BRIGHTNESS:
-        return adjust_contrast_brightness(image, 1.5, 50)
+        return adjust_contrast_brightness(image, params['contrast'], params['brightness'], dst=dst)
+    elif operation == ImageOperation.PYRAMID:
+        return pyramid_image(image, params['sizes'], params['method'])
     else:
         return None
 
 
-def process_image(input_image_path, output_dir, operations):
+# Neighbourhood and point operations that keep the image shape and can be split into tiles with a halo.
+TILEABLE_OPERATIONS = {
+    ImageOperation.BLUR,
+    ImageOperation.FILTER,
+    ImageOperation.THRESHOLD,
+    ImageOperation.EROSION,
+    ImageOperation.DILATION,
+}
+
+
+# Kernels this large go through sepFilter2D, the FFT path or OpenCV's own DFT-based filter2D, whose rounding depends
+# on the size of the array being filtered, so such kernels are never tiled.
+DFT_KERNEL_AREA = convolution.DIRECT_KERNEL_AREA
+
+
+def is_tileable(operation, **kwargs):
+    """
+    Check whether an operation can be tiled with a result identical to whole-image processing.
+    :param operation: The image processing operation (from the ImageOperation enum), or an OperationSpec.
+    :param kwargs: The keyword arguments that would be passed to apply_operation.
+    :return: True if apply_operation_tiled may be used for this operation.
+    """
+    operation, params = resolve_operation(operation, kwargs)
+    if operation == ImageOperation.FILTER:
+        return _filter_kernel(params['kernel']).size < DFT_KERNEL_AREA
+    return operation in TILEABLE_OPERATIONS
+
+
+def tile_halo(operation, **kwargs):
+    """
+    Compute how many pixels of overlap a tile needs so that a tiled operation matches the whole-image result.
+    :param operation: The image processing operation (from the ImageOperation enum), or an OperationSpec; must be
+                      tileable.
+    :param kwargs: The keyword arguments that would be passed to apply_operation.
+    :return: The halo size in pixels.
+    """
+    operation, params = resolve_operation(operation, kwargs)
+    if operation == ImageOperation.BLUR:
+        return params['kernel_size'] // 2
+    elif operation == ImageOperation.FILTER:
+        return max(_filter_kernel(params['kernel']).shape[:2]) // 2
+    elif operation == ImageOperation.THRESHOLD:
+        return 0
+    elif operation in (ImageOperation.EROSION, ImageOperation.DILATION):
+        return params['kernel_size'] // 2 * params['iterations']
+    raise ValueError(f"Operation cannot be tiled: {operation.name.lower()}")
+
+
+def apply_operation_tiled(operation, image, tile_size=1024, out=None, workers=None, **kwargs):
+    """
+    Apply a tileable image processing operation to the input image tile by tile, in parallel.
+    The result is identical to apply_operation(operation, image, **kwargs).
+    :param operation: The image processing operation to apply; is_tileable() must be true for it.
+    :param image: The input image as a NumPy array (may be a memory-mapped array).
+    :param tile_size: The edge length of each tile in pixels.
+    :param out: An optional preallocated or memory-mapped output array with the same shape as the image.
+    :param workers: The maximum number of tiles processed at once (defaults to the number of CPUs).
+    :param kwargs: Additional keyword arguments for specific operations.
+    :return: The processed image as a NumPy array.
+    """
+    if not is_tileable(operation, **kwargs):
+        raise ValueError(f"Operation cannot be tiled: {_operation_name(operation)}")
+    return tiling.tiled_apply(lambda tile: apply_operation(operation, tile, **kwargs), image,
+                              tile_halo(operation, **kwargs), tile_size, out, workers)
+
+
+def apply_chain(operations, image, tile_size=None, pool=None, **kwargs):
+    """
+    Apply a chain of image processing operations in order, each one to the result of the previous one.
+    Intermediates stay in memory, and a buffer freed by an earlier step is reused as the output of a later step
+    whenever its shape and dtype match, so a chain of shape-preserving operations ping-pongs between two buffers.
+    On uint8 images, each run of consecutive point operations is fused into one lookup table pass.
+    :param operations: The sequence of operations to apply (from the ImageOperation enum, or OperationSpecs). A
+                       pyramid may only be the last step, and then the chain returns its list of levels.
+    :param image: The input image as a NumPy array; it is never written to.
+    :param tile_size: The tile edge length for tileable operations, or None to process the whole image.
+    :param pool: An optional BufferPool; intermediates and the result are drawn from it when no freed buffer fits,
+                 and the intermediates are handed back to it at the end.
+    :param kwargs: Additional keyword arguments for specific operations.
+    :return: The processed image as a NumPy array, or None if an operation is not supported.
+    """
+    if any(base_operation(step) == ImageOperation.PYRAMID for step in operations[:-1]):
+        raise ValueError("A pyramid can only be the last step of a chain")
+    spare = []
+    current = image
+    index = 0
+    while index < len(operations):
+        operation = operations[index]
+        shape = estimate_output_shape(operation, current.shape, **kwargs)
+        dst = next((buffer for buffer in spare if buffer.shape == shape and buffer.dtype == current.dtype), None)
+        if dst is None and pool is not None and base_operation(operation) != ImageOperation.PYRAMID:
+            dst = pool.acquire(shape, current.dtype)
+            spare.append(dst)
+        run_length = 1
+        if base_operation(operation) in POINT_OPERATIONS and current.dtype == np.uint8:
+            while (index + run_length < len(operations)
+                   and base_operation(operations[index + run_length]) in POINT_OPERATIONS):
+                run_length += 1
+            lut = compile_point_operations(operations[index:index + run_length], **kwargs)
+            result = cv2.LUT(current, lut, dst=dst)
+        else:
+            result = _run_operation(operation, current, kwargs, tile_size, dst)
+        index += run_length
+        if result is None:
+            return None
+        spare = [buffer for buffer in spare if buffer is not result]
+        if current is not image:
+            spare.append(current)
+        current = result
+    if pool is not None:
+        for buffer in spare:
+            pool.release(buffer)
+    return current
+
+
+@dataclass
+class PlanNode:
+    """
+    A node of an operation plan: the steps applied to its parent's result (or to the image, for a root), the
+    requested operations whose result it is, and the nodes that continue from that result.
+    """
+    steps: tuple
+    outputs: list = field(default_factory=list)
+    children: list = field(default_factory=list)
+
+    @property
+    def operation(self):
+        return self.steps[0] if len(self.steps) == 1 else self.steps
+
+
+def _compress_plan(node, children):
+    """
+    Turn a prefix tree level into PlanNodes, merging every run of steps without a branch or output into one node.
+    """
+    node.children = [_compress_plan(child, grandchildren) for child, grandchildren in children.values()]
+    while not node.outputs and len(node.children) == 1:
+        child = node.children[0]
+        node = PlanNode(node.steps + child.steps, child.outputs, child.children)
+    return node
+
+
+def plan_operations(operations, **kwargs):
+    """
+    Plan the operations requested for one image so that work they share is done once. Operations and chains are
+    merged into a prefix tree of their steps: an operation that starts with the same steps as another (e.g. "blur"
+    and the chain "blur,canny", or the chains "resize,blur,threshold" and "resize,blur,canny") continues from the
+    shared intermediate instead of recomputing it, and identical operations are computed once. Runs of steps
+    without a branch stay in one node, so they still run as a chain with fused point operations and reused buffers.
+    :param operations: The list of operations; a tuple of operations is a chain.
+    :param kwargs: Additional keyword arguments for the operations; steps are matched on their resolved parameters.
+    :return: A list of root PlanNodes, independent of each other, in the order they were first requested.
+    """
+    roots = {}
+    for operation in operations:
+        level, node = roots, None
+        for step in operation if isinstance(operation, tuple) else (operation,):
+            base, params = resolve_operation(step, kwargs)
+            key = (base, tuple(sorted(params.items())))
+            if key not in level:
+                level[key] = (PlanNode((step,)), {})
+            node, level = level[key]
+        node.outputs.append(operation)
+    return [_compress_plan(node, children) for node, children in roots.values()]
+
+
+def _plan_outputs(node):
+    """
+    List the requested operations computed by a plan node and the nodes continuing from it.
+    """
+    return node.outputs + [output for child in node.children for output in _plan_outputs(child)]
+
+
+def parse_chain(text):
+    """
+    Parse a chain of operations written as comma-separated operation specs, e.g. "resize,blur,threshold" or
+    "resize:scale_x=0.5:scale_y=0.5,threshold:threshold_value=100".
+    :param text: The chain specification.
+    :return: A tuple of operations (from the ImageOperation enum, or OperationSpecs).
+    """
+    chain = tuple(parse_operation_spec(step) for step in text.split(",") if step.strip())
+    if any(base_operation(step) == ImageOperation.PYRAMID for step in chain[:-1]):
+        raise ValueError(f"A pyramid can only be the last step of a chain: {text.strip()}")
+    return chain
+
+
+def format_operation_spec(operation):
+    """
+    Write an operation back in the text form parse_operation_spec accepts, e.g. to send it to another process.
+    :param operation: The image processing operation (from the ImageOperation enum) or an OperationSpec.
+    :return: The operation spec, e.g. "rotate:angle=90".
+    """
+    if not isinstance(operation, OperationSpec):
+        return operation.name.lower()
+    parts = [operation.operation.name.lower()]
+    for name, value in operation.params:
+        if isinstance(value, bool):
+            value = int(value)
+        elif name == "kernel" and not isinstance(value, str):
+            value = "/".join(" ".join(repr(item) for item in row) for row in value)
+        elif name == "sizes":
+            value = "/".join(str(size) for size in value)
+        parts.append(f"{name}={value}")
+    return ":".join(parts)
+
+
+def load_chains(path):
+    """
+    Read chain specifications from a file, one chain per line in the format accepted by parse_chain.
+    Blank lines and lines starting with # are ignored.
+    :param path: The path to the spec file.
+    :return: A list of chains, each a tuple of operations.
+    """
+    with open(path) as spec:
+        return [parse_chain(line) for line in spec if line.strip() and not line.lstrip().startswith("#")]
+
+
+def _format_value(value):
+    """
+    Format a parameter value for an operation name: whole numbers without a decimal point, booleans as 1 or 0, and
+    explicit kernels as a short digest of their values.
+    """
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, tuple) and all(isinstance(item, int) for item in value):
+        return "-".join(str(item) for item in value)
+    if isinstance(value, tuple):
+        return "k" + result_cache.make_key(repr(value))[:12]
+    return str(value)
+
+
+def _operation_name(operation):
+    """
+    Name an operation, or a chain of operations joined with "+".
+    :param operation: The image processing operation (from the ImageOperation enum), an OperationSpec, or a tuple of
+                      operations.
+    :return: The name, e.g. "blur", "rotate_angle=90" or "resize+blur".
+    """
+    if isinstance(operation, tuple):
+        return "+".join(_operation_name(step) for step in operation)
+    if isinstance(operation, OperationSpec):
+        return "_".join([operation.operation.name.lower()]
+                        + [f"{name}={_format_value(value)}" for name, value in operation.params])
+    return operation.name.lower()
+
+
+def _pyramid_sizes(operation):
+    """
+    Get the level sizes if an operation is a pyramid, or a chain ending with one.
+    :param operation: The image processing operation, an OperationSpec, or a tuple of operations.
+    :return: The tuple of sizes, or None.
+    """
+    last = operation[-1] if isinstance(operation, tuple) else operation
+    if base_operation(last) != ImageOperation.PYRAMID:
+        return None
+    return resolve_operation(last, {})[1]['sizes']
+
+
+def _output_names(operation):
+    """
+    Name the outputs of an operation: one name, or one per level for a pyramid (named after the level size, e.g.
+    pyramid_512). The OutputSink turns each name into a file name for a given input.
+    :param operation: The image processing operation, an OperationSpec, or a tuple of operations.
+    :return: The list of output names.
+    """
+    sizes = _pyramid_sizes(operation)
+    if sizes is None:
+        return [_operation_name(operation)]
+    last = operation[-1] if isinstance(operation, tuple) else operation
+    if isinstance(last, OperationSpec):
+        last = OperationSpec(last.operation, tuple(param for param in last.params if param[0] != "sizes"))
+    prefix = _operation_name(operation[:-1] + (last,) if isinstance(operation, tuple) else last)
+    return [f"{prefix}_{size}" for size in sizes]
+
+
+def _run_operation(operation, image, kwargs, tile_size=None, dst=None, pool=None):
+    """
+    Apply an operation, or a chain of operations given as a tuple, using the tiled engine when a tile size is
+    given and the image is larger than one tile.
+    :param operation: The image processing operation to apply (from the ImageOperation enum), or a tuple of them.
+    :param image: The input image as a NumPy array.
+    :param kwargs: Additional keyword arguments for the operation.
+    :param tile_size: The tile edge length in pixels, or None to process the whole image at once.
+    :param dst: An optional preallocated output array of the right shape.
+    :param pool: An optional BufferPool to draw the output (and a chain's intermediates) from when no dst is given.
+    :return: The processed image as a NumPy array.
+    """
+    if isinstance(operation, tuple):
+        return apply_chain(operation, image, tile_size, pool=pool, **kwargs)
+    if pool is not None and dst is None and base_operation(operation) != ImageOperation.PYRAMID:
+        dst = pool.acquire(estimate_output_shape(operation, image.shape, **kwargs), image.dtype)
+        result = _run_operation(operation, image, kwargs, tile_size, dst)
+        if result is not dst:
+            pool.release(dst)
+        return result
+    if tile_size and max(image.shape[:2]) > tile_size and is_tileable(operation, **kwargs):
+        # Each scheduler worker gets its share of the cores for tiles, the same share OpenCV is given per call.
+        return apply_operation_tiled(operation, image, tile_size, out=dst, workers=cv2.getNumThreads(), **kwargs)
+    return apply_operation(operation, image, dst=dst, **kwargs)
+
+
+# Bump whenever an operation's output changes, so results cached by an older version are never reused.
+RESULT_FORMAT_VERSION = "2"
+
+
+def _cache_key(content_digest, operation, kwargs):
+    """
+    Build the result cache key for an operation applied to some content.
+    :param content_digest: The hash of the input file or array.
+    :param operation: The image processing operation (from the ImageOperation enum), or a tuple of operations.
+    :param kwargs: The keyword arguments passed to the operation.
+    :return: The cache key.
+    """
+    parts = [_operation_name(operation)]
+    for name, value in sorted(kwargs.items()):
+        if isinstance(value, np.ndarray):
+            value = result_cache.array_digest(value)
+        parts.append(f"{name}={value!r}")
+    return result_cache.make_key(content_digest, ",".join(parts), RESULT_FORMAT_VERSION, cv2.__version__,
+                                 np.__version__)
+
+
+def _output_cache_keys(content_digest, operation, kwargs):
+    """
+    Build one result cache key per output of an operation (several for a pyramid).
+    :param content_digest: The hash of the input file or array.
+    :param operation: The image processing operation, an OperationSpec, or a tuple of operations.
+    :param kwargs: The keyword arguments passed to the operation.
+    :return: The list of cache keys, in the order of _output_names.
+    """
+    key = _cache_key(content_digest, operation, kwargs)
+    names = _output_names(operation)
+    if len(names) == 1:
+        return [key]
+    return [result_cache.make_key(key, name) for name in names]
+
+
+def apply_operation_cached(cache, operation, image, **kwargs):
+    """
+    Apply an image processing operation (or a chain given as a tuple), reusing the result from the cache when the
+    same operation with the same parameters was already applied to identical pixels.
+    :param cache: The ResultCache to use.
+    :param operation: The image processing operation to apply (from the ImageOperation enum), or a tuple of them.
+    :param image: The input image as a NumPy array.
+    :param kwargs: Additional keyword arguments for specific operations.
+    :return: The processed image as a NumPy array (read-only when served from memory; a list of levels for a
+             pyramid), or None if the operation is not supported.
+    """
+    keys = _output_cache_keys(result_cache.array_digest(image), operation, kwargs)
+    results = [cache.fetch_array(key) for key in keys]
+    if any(result is None for result in results):
+        result = _run_operation(operation, image, kwargs)
+        if result is not None:
+            for key, level in zip(keys, result if isinstance(result, list) else [result]):
+                cache.store_array(key, level)
+        return result
+    return results if len(keys) > 1 else results[0]
+
+
+def _apply_stacked(operation, stack, kwargs, tile_size=None):
+    """
+    Apply an operation (or a chain given as a tuple) to every image of an (N, H, W[, C]) stack.
+    Point operations run over the whole stack in one call; other operations run image by image, writing into one
+    preallocated output stack.
+    :param operation: The image processing operation to apply, or a tuple of them.
+    :param stack: A C-contiguous stack of same-shaped images.
+    :param kwargs: Additional keyword arguments for the operation.
+    :param tile_size: The tile edge length for tileable operations, or None to process whole images.
+    :return: The stack of results (a list of level lists for a pyramid), or None if an operation is not supported.
+    """
+    if isinstance(operation, tuple):
+        for step in operation:
+            stack = _apply_stacked(step, stack, kwargs, tile_size)
+            if stack is None:
+                return None
+        return stack
+    if base_operation(operation) == ImageOperation.PYRAMID:
+        return [apply_operation(operation, image, **kwargs) for image in stack]
+    if base_operation(operation) in POINT_OPERATIONS:
+        result = apply_operation(operation, batching.as_rows(stack), **kwargs)
+        return result.reshape(stack.shape)
+    out = np.empty((len(stack),) + estimate_output_shape(operation, stack.shape[1:], **kwargs), stack.dtype)
+    for image, target in zip(stack, out):
+        result = _run_operation(operation, image, kwargs, tile_size, target)
+        if result is None:
+            return None
+        if result is not target:
+            target[...] = result
+    return out
+
+
+def apply_operation_batch(operation, images, tile_size=None, **kwargs):
+    """
+    Apply an image processing operation (or a chain given as a tuple) to many images at once.
+    The images are grouped by shape and dtype and each group is stacked, so point operations such as threshold
+    and contrast_brightness cost one call per group instead of one per image. Results are identical to calling
+    apply_operation on each image.
+    :param operation: The image processing operation to apply (from the ImageOperation enum), an OperationSpec, or a
+                      tuple of them.
+    :param images: A sequence of input images as NumPy arrays.
+    :param tile_size: The tile edge length for tileable operations, or None to process whole images.
+    :param kwargs: Additional keyword arguments for specific operations.
+    :return: A list with one result per input image (views into the stacked results), or None entries if the
+             operation is not supported.
+    """
+    results = [None] * len(images)
+    for indices in batching.group_by_shape(images):
+        stack = _apply_stacked(operation, batching.stack_group(images, indices), kwargs, tile_size)
+        if stack is not None:
+            for index, result in zip(indices, stack):
+                results[index] = result
+    return results
+
+
+# Operations whose result only depends on the brightness of the input, so a grayscale decode is enough.
+GRAYSCALE_OPERATIONS = {
+    ImageOperation.CANNY,
+    ImageOperation.THRESHOLD,
+}
+
+# Reduced-resolution decode flags by downscale factor, in color and in grayscale.
+REDUCED_DECODE_FLAGS = {
+    (1, False): cv2.IMREAD_COLOR,
+    (2, False): cv2.IMREAD_REDUCED_COLOR_2,
+    (4, False): cv2.IMREAD_REDUCED_COLOR_4,
+    (8, False): cv2.IMREAD_REDUCED_COLOR_8,
+    (1, True): cv2.IMREAD_GRAYSCALE,
+    (2, True): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (4, True): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (8, True): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def plan_decode(operations, **kwargs):
+    """
+    Work out the cheapest decode that still serves every operation. If every operation (or chain) starts with a
+    downscaling resize, the image can be decoded at 1/2, 1/4 or 1/8 resolution, as long as that is still at least
+    as large as every resize target. If every operation, after such a resize, starts with an operation that only
+    needs brightness (GRAYSCALE_OPERATIONS), the image can be decoded in grayscale.
+    :param operations: The list of operations to apply; a tuple of operations is a chain.
+    :param kwargs: Additional keyword arguments for the operations.
+    :return: A (factor, grayscale) decode plan.
+    """
+    factor, grayscale = 8, True
+    for operation in operations:
+        steps = operation if isinstance(operation, tuple) else (operation,)
+        first, params = resolve_operation(steps[0], kwargs)
+        allowed = 1
+        if first == ImageOperation.RESIZE and not params['width'] and not params['height']:
+            scale = max(params['scale_x'], params['scale_y'])
+            allowed = next((candidate for candidate in (8, 4, 2) if candidate * scale <= 1), 1)
+            if allowed > 1:
+                steps = steps[1:]
+        factor = min(factor, allowed)
+        if not steps or base_operation(steps[0]) not in GRAYSCALE_OPERATIONS:
+            grayscale = False
+    return factor if operations else 1, grayscale and bool(operations)
+
+
+def decode_image(input_image_path, decode_plan=None):
+    """
+    Decode an image, at reduced resolution or in grayscale if the decode plan allows it. Reduced-resolution decode
+    is only used for JPEG files whose size can be read from the header, since the full size is needed to resize
+    the reduced image to exactly the size the operations expect (see adapt_to_decode).
+    :param input_image_path: The path to the input image.
+    :param decode_plan: A (factor, grayscale) plan from plan_decode, or None for a full-resolution color decode.
+    :return: A tuple of the decoded image (None if it could not be read) and the (rows, cols) of the image at full
+             resolution.
+    """
+    factor, grayscale = decode_plan or (1, False)
+    full_size = image_header.jpeg_size(input_image_path) if factor > 1 else None
+    if full_size is None:
+        factor = 1
+    input_image = cv2.imread(input_image_path, REDUCED_DECODE_FLAGS[(factor, grayscale)])
+    if input_image is not None and full_size is None:
+        full_size = input_image.shape[:2]
+    return input_image, full_size
+
+
+def adapt_to_decode(operation, full_size, image_shape, **kwargs):
+    """
+    Rewrite an operation for an image decoded at reduced resolution: its leading resize becomes a resize to the
+    exact size it would have produced from the full-resolution image.
+    :param operation: The operation (or chain) to apply.
+    :param full_size: The (rows, cols) of the image at full resolution.
+    :param image_shape: The shape of the decoded image.
+    :param kwargs: Additional keyword arguments for the operation.
+    :return: The operation to apply to the decoded image.
+    """
+    if tuple(full_size) == tuple(image_shape[:2]):
+        return operation
+    steps = operation if isinstance(operation, tuple) else (operation,)
+    rows, cols = estimate_output_shape(steps[0], full_size, **kwargs)[:2]
+    resize = make_spec(ImageOperation.RESIZE, width=cols, height=rows)
+    return (resize,) + steps[1:] if isinstance(operation, tuple) else resize
+
+
+def _megabytes(megabytes):
+    """
+    Convert an optional size in megabytes to bytes.
+    :param megabytes: The size in megabytes, or None.
+    :return: The size in bytes, or None.
+    """
+    return None if megabytes is None else int(megabytes * 1024 * 1024)
+
+
+def _timed_imread(metrics, input_image_path, decode_plan=None):
+    """
+    Decode an image with decode_image, recording the decode time if a metrics collector is given.
+    :param metrics: The Metrics collector, or None.
+    :param input_image_path: The path to the input image.
+    :param decode_plan: A (factor, grayscale) plan from plan_decode, or None for a full-resolution color decode.
+    :return: A tuple of the decoded image (None if it could not be read) and its full-resolution (rows, cols).
+    """
+    if metrics is None:
+        return decode_image(input_image_path, decode_plan)
+    start = time.perf_counter()
+    input_image, full_size = decode_image(input_image_path, decode_plan)
+    metrics.observe("decode", time.perf_counter() - start, shape=None if input_image is None else input_image.shape,
+                    start=start, image=input_image_path)
+    return input_image, full_size
+
+
+def _timed_operation(metrics, operation, input_image, kwargs, tile_size, input_image_path, pool=None):
+    """
+    Apply an operation (or chain), recording its compute time if a metrics collector is given.
+    :param metrics: The Metrics collector, or None.
+    :param operation: The image processing operation to apply, or a tuple of them.
+    :param input_image: The input image as a NumPy array.
+    :param kwargs: Additional keyword arguments for the operation.
+    :param tile_size: The tile edge length for tileable operations, or None to process the whole image.
+    :param input_image_path: The path of the input image, used to label trace events.
+    :param pool: An optional BufferPool to draw the output from.
+    :return: The processed image as a NumPy array.
+    """
+    if metrics is None:
+        return _run_operation(operation, input_image, kwargs, tile_size, pool=pool)
+    with metrics.span("operation", _operation_name(operation), input_image.shape, input_image_path):
+        return _run_operation(operation, input_image, kwargs, tile_size, pool=pool)
+
+
+def _timed_imwrite(metrics, sink, output_path, result, operation, input_image_path):
+    """
+    Encode and save a result through the output sink, recording the encode time if a metrics collector is given.
+    :param metrics: The Metrics collector, or None.
+    :param sink: The OutputSink that encodes the result.
+    :param output_path: The path of the output file.
+    :param result: The image to save.
+    :param operation: The operation that produced the result, used to label the timing.
+    :param input_image_path: The path of the input image, used to label trace events.
+    :return: Whether the image was written.
+    """
+    if metrics is None:
+        return sink.write(output_path, result)
+    with metrics.span("encode", _operation_name(operation), result.shape, input_image_path):
+        return sink.write(output_path, result)
+
+
+def _write_outputs(metrics, sink, operation, result, input_image_path):
+    """
+    Save the result of an operation: one image, or every level of a pyramid.
+    :param metrics: The Metrics collector, or None.
+    :param sink: The OutputSink deciding the output paths and codec.
+    :param operation: The operation that produced the result.
+    :param result: The image to save, or a list of pyramid levels.
+    :param input_image_path: The path of the input image; output names are derived from it.
+    :return: The list of output paths written, in the order of _output_names.
+    """
+    written = []
+    for name, image in zip(_output_names(operation), result if isinstance(result, list) else [result]):
+        output_path = sink.path(input_image_path, name)
+        if _timed_imwrite(metrics, sink, output_path, image, operation, input_image_path):
+            written.append(output_path)
+    return written
+
+
+def _report_error(failed, input_image_path, message):
+    """
+    Report an input image that could not be fully processed: print the error and pass it on to the job.
+    :param failed: An optional callable failed(input_image_path, message), e.g. collecting a job's failed inputs.
+    :param input_image_path: The path of the input image.
+    :param message: The error message.
+    """
+    print(f"Error: {message}")
+    if failed is not None:
+        failed(input_image_path, message)
+
+
+def _report_failure(operation, input_image_path, error, failed=None):
+    """
+    Report an operation that raised on one image. Every backend carries on with the image's other operations and
+    with the other images, and does not record the image as completed.
+    :param operation: The operation (or chain) that failed.
+    :param input_image_path: The path of the input image.
+    :param error: The exception.
+    :param failed: An optional callable failed(input_image_path, message) the failure is passed on to.
+    """
+    _report_error(failed, input_image_path, f"{_operation_name(operation)} failed on {input_image_path}: {error}")
+
+
+def _evaluate_plan(node, image, kwargs, tile_size=None, metrics=None, input_image_path="", pool=None, adapt=None,
+                   failed=None):
+    """
+    Compute a plan node and, depth first, every node continuing from it. An intermediate that is not a requested
+    output is handed back to the buffer pool once the nodes depending on it are done. A node that raises is
+    reported, along with every output depending on it, and the rest of the plan still runs.
+    :param node: The PlanNode, from plan_operations.
+    :param image: The image the node's steps apply to.
+    :param kwargs: Additional keyword arguments for the operations.
+    :param tile_size: The tile edge length for tileable operations, or None to process whole images.
+    :param metrics: An optional Metrics collector timing every node.
+    :param input_image_path: The path of the input image, used to label trace events.
+    :param pool: An optional BufferPool to draw outputs from.
+    :param adapt: An optional callable adapt(operation, image) rewriting the node's operation, e.g. adapt_to_decode
+                  for a root after a reduced decode.
+    :param failed: An optional callable failed(input_image_path, message) that failures are passed on to.
+    :return: A generator of (operation, result, shared) tuples, one per requested operation, in plan order; shared
+             is True when the result array is also used by another output or node, so it must not be pooled.
+             The result is None for the operations that failed.
+    """
+    try:
+        operation = node.operation if adapt is None else adapt(node.operation, image)
+        result = _timed_operation(metrics, operation, image, kwargs, tile_size, input_image_path, pool)
+    except Exception as error:
+        for output in _plan_outputs(node):
+            _report_failure(output, input_image_path, error, failed)
+            yield output, None, False
+        return
+    shared = len(node.outputs) + len(node.children) > 1
+    for output in node.outputs:
+        yield output, result, shared
+    for child in node.children:
+        yield from _evaluate_plan(child, result, kwargs, tile_size, metrics, input_image_path, pool, failed=failed)
+    if pool is not None and not node.outputs:
+        pool.release(result)
+
+
+def _release_result(pool, result):
+    """
+    Hand a result back to a buffer pool once it has been written. Pyramid levels are not pooled, since they are
+    never drawn from the pool.
+    """
+    if pool is not None and not isinstance(result, list):
+        pool.release(result)
+
+
+def _submit_image(scheduler, input_image_path, sink, operations, tile_size=None, cache=None, completed=None,
+                  metrics=None, decode_plan=None, pool=None, job_stats=None, failed=None):
+    """
+    Schedule the decode of one input image and its operations on the given scheduler. The operations are planned
+    with plan_operations, so intermediates they share are computed once; each independent part of the plan is one
+    task. Results are handed to the sink's writer threads, if it has any, so encoding does not hold up the
+    scheduler's workers.
+    :param scheduler: The ImageScheduler that runs the tasks.
+    :param input_image_path: The path to the input image.
+    :param sink: The OutputSink that names and writes the outputs.
+    :param operations: The list of image processing operations to apply (from the ImageOperation enum); a tuple of
+                       operations is applied as a chain and saved as one output.
+    :param tile_size: The tile edge length for tileable operations, or None to process whole images.
+    :param cache: An optional ResultCache; outputs found in it are copied without decoding or computing.
+    :param completed: An optional callable completed(input_image_path) invoked once the image is fully processed
+                      and every output has been written.
+    :param metrics: An optional Metrics collector timing decode, every operation and encode.
+    :param decode_plan: An optional (factor, grayscale) plan from plan_decode for a cheaper decode.
+    :param pool: An optional BufferPool the results are drawn from and handed back to once written.
+    :param job_stats: An optional ThroughputStats the image is counted in, besides the scheduler's own counters.
+    :param failed: An optional callable failed(input_image_path, message) invoked for every error on the image.
+    :return: A Future that resolves once every operation has been applied; with writer threads, the outputs may
+             still be being written (see OutputSink.flush).
+    """
+    cache_keys = {}
+    full_size = None
+    # Outputs still being written, whether every operation has run, and whether a write failed; the image is
+    # complete once every operation has run and its last output has been written.
+    state = {"writes": 0, "computed": False, "failed": False}
+    lock = threading.Lock()
+
+    def decode():
+        nonlocal full_size
+        pending = operations
+        if cache is not None:
+            try:
+                digest = result_cache.file_digest(input_image_path)
+            except OSError:
+                _report_error(failed, input_image_path, f"Could not open the image file: {input_image_path}")
+                return None
+            pending = []
+            for operation in operations:
+                kwargs = {}
+                if decode_plan is not None:
+                    kwargs["decode"] = decode_plan
+                if sink.encoding != "jpg":
+                    kwargs = dict(kwargs, encoding=sink.encoding)
+                cache_keys[operation] = _output_cache_keys(digest, operation, kwargs)
+                hits = [cache.fetch_file(key, sink.path(input_image_path, name), sink.extension)
+                        for key, name in zip(cache_keys[operation], _output_names(operation))]
+                if not all(hits):
+                    pending.append(operation)
+            if not pending:
+                return None, pending
+
+        input_image, full_size = _timed_imread(metrics, input_image_path, decode_plan)
+        if input_image is None:
+            _report_error(failed, input_image_path, f"Could not open the image file: {input_image_path}")
+            return None
+        return input_image if cache is None else (input_image, plan_operations(pending))
+
+    def finish():
+        print(f"Image processing completed successfully for: {input_image_path}")
+        if completed is not None:
+            completed(input_image_path)
+
+    def write(operation, result, shared):
+        try:
+            written = _write_outputs(metrics, sink, operation, result, input_image_path)
+            if cache is not None and len(written) == len(cache_keys[operation]):
+                for key, output_path in zip(cache_keys[operation], written):
+                    cache.store_file(key, output_path, sink.extension)
+        except Exception as error:
+            _report_error(failed, input_image_path, f"Could not write the outputs of {input_image_path}: {error}")
+            state["failed"] = True
+        if not shared:
+            _release_result(pool, result)
+        with lock:
+            state["writes"] -= 1
+            last = state["writes"] == 0 and state["computed"]
+        if last and not state["failed"]:
+            finish()
+
+    def run(node, input_image):
+        def adapt(operation, image):
+            return adapt_to_decode(operation, full_size, image.shape)
+
+        for operation, result, shared in _evaluate_plan(node, input_image, {}, tile_size, metrics,
+                                                        input_image_path, pool, adapt, failed):
+            if result is None:
+                state["failed"] = True
+                continue
+            with lock:
+                state["writes"] += 1
+            sink.submit(write, operation, result, shared)
+
+    def done(decoded):
+        if not decoded:
+            return
+        with lock:
+            state["computed"] = True
+            last = state["writes"] == 0
+        if last and not state["failed"]:
+            finish()
+
+    def estimate(node, input_image):
+        return sum(estimate_output_bytes(adapt_to_decode(operation, full_size, input_image.shape),
+                                         input_image.shape, input_image.dtype.itemsize)
+                   for operation in _plan_outputs(node))
+
+    return scheduler.submit_image(decode, plan_operations(operations), run, done, estimate, job_stats)
+
+
+def _decode_array_item(item, metrics=None, label=""):
+    """
+    Turn an in-memory input into an image: decoded arrays are used as they are, encoded bytes are decoded.
+    :param item: A decoded NumPy array, or encoded image bytes (bytes, bytearray, memoryview or a 1-D uint8 array).
+    :param metrics: The Metrics collector timing the decode, or None.
+    :param label: The name of the input, used to label trace events.
+    :return: The image, or None if the bytes could not be decoded.
+    """
+    if isinstance(item, np.ndarray) and item.ndim > 1:
+        return item
+    data = np.frombuffer(item, dtype=np.uint8)
+    if metrics is None:
+        return cv2.imdecode(data, cv2.IMREAD_COLOR)
+    start = time.perf_counter()
+    image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    metrics.observe("decode", time.perf_counter() - start, shape=None if image is None else image.shape, start=start,
+                    image=label)
+    return image
+
+
+def process_arrays(items, operations, scheduler=None, tile_size=None, cache=None, metrics=None, max_pending=None):
+    """
+    Process images held in memory and yield the results as arrays as they complete, without touching the disk.
+
+    The images run on the same scheduler as process_images (the process-wide one by default), so library calls and
+    file batches share workers and the memory budget. With a cache, results are keyed by the content hash of the
+    input (of the encoded bytes, or of the pixels) and served without decoding or computing when found.
+    :param items: An iterable of inputs, consumed lazily: decoded NumPy images, or encoded image bytes such as the
+                  contents of a JPEG file (bytes, bytearray, memoryview or a 1-D uint8 array).
+    :param operations: The list of image processing operations to apply; a tuple of operations is applied as a chain.
+    :param scheduler: The ImageScheduler to run on (defaults to the process-wide scheduler).
+    :param tile_size: The tile edge length for tileable operations, or None to process whole images.
+    :param cache: An optional ResultCache shared with other callers.
+    :param metrics: An optional Metrics collector timing decode and every operation.
+    :param max_pending: The maximum number of inputs submitted but not yet finished (defaults to twice the
+                        scheduler's workers); further inputs are only taken from items as earlier ones finish.
+    :return: A generator of (index, operation, result) tuples in completion order, where index is the position of
+             the input in items, operation is one of operations, and result is the output array (a list of levels
+             for a pyramid). Cached results may be read-only. Inputs that cannot be decoded are reported and skipped.
+    """
+    scheduler = scheduler or get_scheduler()
+    max_pending = max_pending or 2 * scheduler.workers
+    ready = Queue()
+
+    def submit(index, item):
+        label = f"<array {index}>"
+        cache_keys = {}
+
+        def decode():
+            pending = operations
+            if cache is not None:
+                if isinstance(item, np.ndarray) and item.ndim > 1:
+                    digest = result_cache.array_digest(item)
+                else:
+                    digest = result_cache.bytes_digest(item)
+                pending = []
+                for operation in operations:
+                    cache_keys[operation] = _output_cache_keys(digest, operation, {})
+                    hits = [cache.fetch_array(key) for key in cache_keys[operation]]
+                    if any(hit is None for hit in hits):
+                        pending.append(operation)
+                    else:
+                        ready.put((index, operation, hits if _pyramid_sizes(operation) is not None else hits[0]))
+                if not pending:
+                    return None, pending
+
+            image = _decode_array_item(item, metrics, label)
+            if image is None:
+                print(f"Error: Could not decode the image at index {index}")
+                return None
+            return image if cache is None else (image, pending)
+
+        def run(operation, image):
+            result = _timed_operation(metrics, operation, image, {}, tile_size, label)
+            if cache is not None:
+                for key, level in zip(cache_keys[operation], result if isinstance(result, list) else [result]):
+                    cache.store_array(key, level)
+            ready.put((index, operation, result))
+
+        def estimate(operation, image):
+            return estimate_output_bytes(operation, image.shape, image.dtype.itemsize)
+
+        future = scheduler.submit_image(decode, operations, run, estimate=estimate)
+        future.add_done_callback(lambda finished: ready.put((index, None, finished)))
+
+    inputs = enumerate(items)
+    exhausted = False
+    in_flight = 0
+    while True:
+        while not exhausted and in_flight < max_pending:
+            entry = next(inputs, None)
+            if entry is None:
+                exhausted = True
+            else:
+                submit(*entry)
+                in_flight += 1
+        if in_flight == 0:
+            return
+        index, operation, result = ready.get()
+        if operation is None:
+            in_flight -= 1
+            if result.exception() is not None:
+                print(f"Error: Could not process the image at index {index}: {result.exception()}")
+            continue
+        yield index, operation, result
+
+
+def process_image(input_image_path, output_dir, operations, scheduler=None, tile_size=None, cache=None,
+                  reduced_decode=False, sink=None):
     """
     Process the input image using the specified operations and save the results to the output directory.
+    The operations run as separate tasks on a shared scheduler instead of a per-image thread pool, so this must not
+    be called from inside one of that scheduler's tasks.
     :param input_image_path: The path to the input image.
     :param output_dir: The path to the output directory.
-    :param operations: The list of image processing operations to apply (from the ImageOperation enum).
+    :param operations: The list of image processing operations to apply (from the ImageOperation enum); a tuple of
+                       operations is applied as a chain and saved as one output.
+    :param scheduler: The ImageScheduler to run on (defaults to the process-wide scheduler).
+    :param tile_size: The tile edge length for tileable operations, or None to process whole images.
+    :param cache: An optional ResultCache; outputs found in it are copied without decoding or computing.
+    :param reduced_decode: Whether to decode at reduced resolution and/or in grayscale when the operations allow it
+                           (see plan_decode). Results may differ slightly from a full-resolution decode.
+    :param sink: An optional OutputSink choosing output names and codec (defaults to JPEG files in output_dir named
+                 after the input and operation).
     """
-    input_image = cv2.imread(input_image_path)
+    sink = sink or OutputSink(output_dir)
+    decode_plan = plan_decode(operations) if reduced_decode else None
+    _submit_image(scheduler or get_scheduler(), input_image_path, sink, operations, tile_size, cache,
+                  decode_plan=decode_plan).result()
+    sink.flush()
+
+
+def _init_shared_worker(opencv_threads):
+    """
+    Initializer for the process backend's workers: size OpenCV's internal thread pool so that
+    workers * OpenCV threads does not exceed the number of cores.
+    :param opencv_threads: The number of threads OpenCV may use in this worker.
+    """
+    cv2.setNumThreads(opencv_threads)
 
+
+def _decode_shared(input_image_path):
+    """
+    Worker-side decode for the process backend: read an image and publish it in shared memory.
+    :param input_image_path: The path to the input image.
+    :return: The shared memory descriptor of the decoded image, or None if it could not be read.
+    """
+    input_image = cv2.imread(input_image_path)
     if input_image is None:
-        print(f"Error: Could not open the image file: {input_image_path}")
-        return
+        return None
+    block, ref = shared_image.share_array(input_image, hand_off=True)
+    shared_image.release_array(block)
+    return ref
+
+
+def _apply_operation_shared(operation, image_ref, kwargs, tile_size=None):
+    """
+    Worker-side compute for the process backend: attach to a shared input image, apply one operation and publish the
+    result in a new shared memory block.
+    :param operation: The image processing operation to apply (from the ImageOperation enum).
+    :param image_ref: The shared memory descriptor of the input image.
+    :param kwargs: Additional keyword arguments for the operation.
+    :param tile_size: The tile edge length for tileable operations, or None to process the whole image.
+    :return: A list with the shared memory descriptor of the result (one per level for a pyramid), or None if the
+             operation is not supported.
+    """
+    image, block = shared_image.attach_array(image_ref)
+    result = None
+    result_refs = []
+    try:
+        result = _run_operation(operation, image, kwargs, tile_size)
+        if result is None:
+            return None
+        # Results are copied out before the input block is released: a result may be the input itself (e.g. a
+        # pyramid level as large as the image) or a view of it.
+        for level in result if isinstance(result, list) else [result]:
+            result_block, result_ref = shared_image.share_array(level, hand_off=True)
+            shared_image.release_array(result_block)
+            result_refs.append(result_ref)
+    except BaseException:
+        for result_ref in result_refs:
+            shared_image.unlink_array(result_ref)
+        raise
+    finally:
+        del image, result
+        shared_image.release_array(block)
+    return result_refs
+
+
+def _write_shared_result(sink, result_ref, output_path):
+    """
+    Encode a result published by a worker process and free its shared memory block.
+    :param sink: The OutputSink that encodes the result.
+    :param result_ref: The shared memory descriptor of the result.
+    :param output_path: The path of the output file.
+    :return: Whether the result was written.
+    """
+    result, block = shared_image.attach_array(result_ref, take_ownership=True)
+    try:
+        return sink.write(output_path, result)
+    finally:
+        del result
+        shared_image.release_array(block, unlink=True)
+
+
+def make_process_pool(workers=None):
+    """
+    Start a pool of worker processes for the process backend, with OpenCV's internal thread pool sized so that
+    workers * OpenCV threads does not exceed the number of cores.
+    :param workers: The number of worker processes (defaults to the number of CPUs).
+    :return: The ProcessPoolExecutor.
+    """
+    workers = workers or os.cpu_count() or 1
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_shared_worker,
+                                                  initargs=(max(1, (os.cpu_count() or 1) // workers),))
+
+
+def _process_images_shared(images, sink, operations, workers=None, tile_size=None, completed=None, pool=None,
+                           failed=None):
+    """
+    Process multiple input images with a pool of worker processes, handing decoded images and results between
+    processes through shared memory instead of pickling them.
+
+    Decoding and every (image, operation) pair run in the process pool, so pure-Python and NumPy work is not
+    serialized by the GIL. Encoding happens on a thread pool in the parent since OpenCV's encoders release the GIL.
+    At most 2 * workers images are decoded and held in shared memory at any time. An operation that raises is
+    reported and the image's other operations still run; an image counts as completed once every output has been
+    written.
+    :param images: A list of paths to the input images.
+    :param sink: The OutputSink that names and writes the outputs.
+    :param operations: The list of image processing operations to apply (from the ImageOperation enum); a tuple of
+                       operations is applied as a chain and saved as one output.
+    :param workers: The number of worker processes (defaults to the number of CPUs).
+    :param tile_size: The tile edge length for tileable operations, or None to process whole images.
+    :param completed: An optional callable completed(input_image_path) invoked once every output of an image has
+                      been written without errors.
+    :param pool: An optional ProcessPoolExecutor to reuse, e.g. one kept warm across jobs; by default a pool of workers
+                 processes is started for the call and shut down afterwards.
+    :param failed: An optional callable failed(input_image_path, message) invoked for every error on an image.
+    """
+    workers = workers or os.cpu_count() or 1
+    pending_images = iter(enumerate(images))
+    # Every future in flight maps to (image index, operation, output path): a decode has no operation, a compute
+    # has no output path, and a write has both.
+    in_flight = {}
+    image_states = {}
 
-    futures = []
-    with concurrent.futures.ThreadPoolExecutor() as executor:
+    if pool is not None:
+        executor_context = contextlib.nullcontext(pool)
+    else:
+        executor_context = make_process_pool(workers)
+    with executor_context as executor, concurrent.futures.ThreadPoolExecutor(max_workers=workers) as writer:
+
+        def admit_images():
+            while len(image_states) < 2 * workers:
+                index, image = next(pending_images, (None, None))
+                if index is None:
+                    return
+                # The input path, its shared decoded image, the computes and writes still pending, and whether
+                # any of them failed.
+                image_states[index] = {"path": image, "ref": None, "pending": 0, "failed": False}
+                in_flight[executor.submit(_decode_shared, image)] = (index, None, None)
+
+        def finish(index):
+            state = image_states.pop(index)
+            shared_image.unlink_array(state["ref"])
+            if state["failed"]:
+                return
+            print(f"Image processing completed successfully for: {state['path']}")
+            if completed is not None:
+                completed(state["path"])
+
+        try:
+            admit_images()
+            while in_flight:
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    index, operation, output_path = in_flight.pop(future)
+                    state = image_states[index]
+
+                    if operation is None:
+                        try:
+                            state["ref"] = future.result()
+                            if state["ref"] is None:
+                                _report_error(failed, state["path"], f"Could not open the image file: {state['path']}")
+                        except Exception as error:
+                            _report_error(failed, state["path"],
+                                          f"Could not decode the image file {state['path']}: {error}")
+                        if state["ref"] is None:
+                            del image_states[index]
+                            continue
+                        for operation in operations:
+                            in_flight[executor.submit(_apply_operation_shared, operation, state["ref"], {},
+                                                      tile_size)] = (index, operation, None)
+                        state["pending"] = len(operations)
+                    elif output_path is None:
+                        state["pending"] -= 1
+                        try:
+                            result_refs = future.result()
+                        except Exception as error:
+                            _report_failure(operation, state["path"], error, failed)
+                            state["failed"] = True
+                            result_refs = None
+                        for result_ref, name in zip(result_refs or [], _output_names(operation)):
+                            output_path = sink.path(state["path"], name)
+                            in_flight[writer.submit(_write_shared_result, sink, result_ref, output_path)] = (
+                                index, operation, output_path)
+                            state["pending"] += 1
+                    else:
+                        state["pending"] -= 1
+                        try:
+                            if not future.result():
+                                raise ValueError(f"could not encode {output_path}")
+                        except Exception as error:
+                            _report_error(failed, state["path"],
+                                          f"Could not write the outputs of {state['path']}: {error}")
+                            state["failed"] = True
+
+                    if state["pending"] == 0:
+                        finish(index)
+                admit_images()
+        finally:
+            # Segments handed off to this process are not cleaned up by the resource tracker, so an interrupted
+            # batch frees the decoded images and the results that will not be written here. Writes in flight free
+            # their own result.
+            for future, (index, operation, output_path) in in_flight.items():
+                if output_path is not None or future.cancel():
+                    continue
+                try:
+                    refs = future.result()
+                except Exception:
+                    continue
+                for ref in ([refs] if operation is None else refs) or []:
+                    if ref is not None:
+                        shared_image.unlink_array(ref)
+            for state in image_states.values():
+                if state["ref"] is not None:
+                    shared_image.unlink_array(state["ref"])
+
+
+def _process_images_pipeline(images, sink, operations, workers=None, tile_size=None, completed=None,
+                             metrics=None, decode_plan=None, readers=2, writers=2, queue_size=16, pool=None,
+                             failed=None):
+    """
+    Process input images with a streaming decode -> compute -> encode pipeline so disk I/O overlaps with compute.
+
+    Each stage has its own worker threads and the stages are connected by bounded queues, so at most a few
+    queue_size batches of decoded images and results are held in memory no matter how many inputs there are.
+    An operation that raises is reported and the image's other outputs are still written.
+    :param images: An iterable of paths to the input images; it is consumed lazily.
+    :param sink: The OutputSink that names and writes the outputs.
+    :param operations: The list of image processing operations to apply (from the ImageOperation enum); a tuple of
+                       operations is applied as a chain and saved as one output.
+    :param workers: The number of compute threads (defaults to the number of CPUs).
+    :param tile_size: The tile edge length for tileable operations, or None to process whole images.
+    :param completed: An optional callable completed(input_image_path) invoked once every output of an image has
+                      been written without errors.
+    :param metrics: An optional Metrics collector timing each stage and the time items wait between stages.
+    :param decode_plan: An optional (factor, grayscale) plan from plan_decode for a cheaper decode.
+    :param readers: The number of decode threads.
+    :param writers: The number of encode threads.
+    :param queue_size: The capacity of the queues between stages.
+    :param pool: An optional BufferPool the results are drawn from and handed back to once written.
+    :param failed: An optional callable failed(input_image_path, message) invoked for every error on an image.
+    """
+    workers = workers or os.cpu_count() or 1
+    lock = threading.Lock()
+
+    def read(input_image_path):
+        input_image, full_size = _timed_imread(metrics, input_image_path, decode_plan)
+        if input_image is None:
+            _report_error(failed, input_image_path, f"Could not open the image file: {input_image_path}")
+            return ()
+        # The outputs of the image still to be written, and whether any operation or write failed.
+        return [(input_image_path, input_image, full_size, {"pending": len(operations), "failed": False})]
+
+    plan = plan_operations(operations)
+
+    def compute(item):
+        input_image_path, input_image, full_size, state = item
+
+        def adapt(operation, image):
+            return adapt_to_decode(operation, full_size, image.shape)
+
+        for node in plan:
+            for operation, result, shared in _evaluate_plan(node, input_image, {}, tile_size, metrics,
+                                                            input_image_path, pool, adapt, failed):
+                yield input_image_path, operation, result, state, shared
+
+    def write(item):
+        input_image_path, operation, result, state, shared = item
+        if result is None:
+            state["failed"] = True
+        else:
+            try:
+                _write_outputs(metrics, sink, operation, result, input_image_path)
+            except Exception as error:
+                _report_error(failed, input_image_path, f"Could not write the outputs of {input_image_path}: {error}")
+                state["failed"] = True
+            if not shared:
+                _release_result(pool, result)
+        with lock:
+            state["pending"] -= 1
+            finished = state["pending"] == 0 and not state["failed"]
+        if finished:
+            print(f"Image processing completed successfully for: {input_image_path}")
+            if completed is not None:
+                completed(input_image_path)
+
+    def waited(stage, seconds, enqueued):
+        metrics.observe("queue_wait", seconds, stage, start=enqueued)
+
+    claim_opencv_threads(lock, workers)
+    try:
+        streaming.run_stages(images, [("decode", read, readers), ("compute", compute, workers),
+                                      ("encode", write, writers)], queue_size, waited if metrics is not None else None)
+    finally:
+        release_opencv_threads(lock)
+
+
+def _process_images_batched(images, sink, operations, tile_size=None, completed=None, metrics=None,
+                            decode_plan=None, batch_size=32, readers=2, writers=2, failed=None):
+    """
+    Process input images in batches: decode a batch, apply every operation to each group of same-shaped images at
+    once with apply_operation_batch, and encode the results while the next batch is decoded and computed.
+    At most two batches of images and results are in memory at a time. An operation that raises on a group is
+    reported for each of its images, and the other groups and operations still run.
+    :param images: An iterable of paths to the input images; it is consumed lazily.
+    :param sink: The OutputSink that names and writes the outputs.
+    :param operations: The list of image processing operations to apply (from the ImageOperation enum); a tuple of
+                       operations is applied as a chain and saved as one output.
+    :param tile_size: The tile edge length for tileable operations, or None to process whole images.
+    :param completed: An optional callable completed(input_image_path) invoked once every output of an image has
+                      been written without errors.
+    :param metrics: An optional Metrics collector; each image is charged an equal share of its batch's time.
+    :param decode_plan: An optional (factor, grayscale) plan from plan_decode for a cheaper decode.
+    :param batch_size: The number of images decoded and processed together.
+    :param readers: The number of decode threads.
+    :param writers: The number of encode threads.
+    :param failed: An optional callable failed(input_image_path, message) invoked for every error on an image.
+    """
+    lock = threading.Lock()
+
+    def write(input_image_path, operation, result, state):
+        if result is None:
+            state["failed"] = True
+        else:
+            try:
+                _write_outputs(metrics, sink, operation, result, input_image_path)
+            except Exception as error:
+                _report_error(failed, input_image_path, f"Could not write the outputs of {input_image_path}: {error}")
+                state["failed"] = True
+        with lock:
+            state["pending"] -= 1
+            finished = state["pending"] == 0 and not state["failed"]
+        if finished:
+            print(f"Image processing completed successfully for: {input_image_path}")
+            if completed is not None:
+                completed(input_image_path)
+
+    with concurrent.futures.ThreadPoolExecutor(readers) as decoder, \
+            concurrent.futures.ThreadPoolExecutor(writers) as encoder:
+        writes = []
+        for paths in batching.iter_batches(images, batch_size):
+            loaded = []
+            decoded = decoder.map(lambda path: _timed_imread(metrics, path, decode_plan), paths)
+            for input_image_path, (input_image, full_size) in zip(paths, decoded):
+                if input_image is None:
+                    _report_error(failed, input_image_path, f"Could not open the image file: {input_image_path}")
+                else:
+                    # The outputs of the image still to be written, and whether any operation or write failed.
+                    loaded.append((input_image_path, input_image, full_size,
+                                   {"pending": len(operations), "failed": False}))
+            if not loaded:
+                continue
+
+            concurrent.futures.wait(writes)
+            writes = []
+            for operation in operations:
+                # Images decoded at reduced resolution may need different resize targets, so they are batched
+                # separately per adapted operation.
+                groups = {}
+                for index, (input_image_path, input_image, full_size, _) in enumerate(loaded):
+                    try:
+                        adapted = adapt_to_decode(operation, full_size, input_image.shape)
+                    except Exception as error:
+                        _report_failure(operation, input_image_path, error, failed)
+                        continue
+                    groups.setdefault(adapted, []).append(index)
+                start = time.perf_counter()
+                results = [None] * len(loaded)
+                for adapted, indices in groups.items():
+                    try:
+                        group_results = apply_operation_batch(adapted, [loaded[index][1] for index in indices],
+                                                              tile_size)
+                    except Exception as error:
+                        for index in indices:
+                            _report_failure(operation, loaded[index][0], error, failed)
+                        continue
+                    for index, result in zip(indices, group_results):
+                        results[index] = result
+                if metrics is not None:
+                    share = (time.perf_counter() - start) / len(loaded)
+                    for input_image_path, input_image, _, _ in loaded:
+                        metrics.observe("operation", share, _operation_name(operation), input_image.shape, start,
+                                        input_image_path)
+                for (input_image_path, _, _, state), result in zip(loaded, results):
+                    writes.append(encoder.submit(write, input_image_path, operation, result, state))
+        concurrent.futures.wait(writes)
+
+
+def _process_video(source, sink, operations, workers=None, tile_size=None, metrics=None, video_output="mp4",
+                   fps=None, window=None, failed=None):
+    """
+    Process a video file or numbered frame sequence (e.g. frames/frame_%05d.png) frame by frame.
+
+    The calling thread decodes frames with cv2.VideoCapture and streams them to a pool of compute threads, so frames
+    are processed in parallel. A reorder buffer puts the results back into frame order for a single writer thread,
+    which appends them to one video per operation output, or saves them as numbered frame files through the sink.
+    At most window frames are decoded but not yet written at any time.
+    :param source: The path of the video or the frame-sequence pattern.
+    :param sink: The OutputSink that names the outputs (and encodes frame files).
+    :param operations: The list of image processing operations to apply to every frame; a tuple of operations is
+                       applied as a chain.
+    :param workers: The number of compute threads (defaults to the number of CPUs).
+    :param tile_size: The tile edge length for tileable operations, or None to process whole frames.
+    :param metrics: An optional Metrics collector timing every operation and encode.
+    :param video_output: "mp4" or "avi" to write videos, or "frames" to write one file per frame.
+    :param fps: The frame rate of the output videos (defaults to the source's, or 25 for frame sequences).
+    :param window: The maximum number of frames in flight (defaults to 4 * workers).
+    :param failed: An optional callable failed(source, message) invoked for every error on the video.
+    :return: The number of frames processed, or None if the source could not be opened.
+    """
+    workers = workers or os.cpu_count() or 1
+    window = window or 4 * workers
+    capture, fps = video.open_capture(source, fps)
+    if capture is None:
+        _report_error(failed, source, f"Could not open the video: {source}")
+        return None
+    name = video.source_name(source)
+    outputs = {}
+    slots = threading.Semaphore(window)
+
+    def compute(item):
+        index, frame = item
+        results = []
         for operation in operations:
-            kwargs = {}  # Add any operation-specific arguments here
-            future = executor.submit(apply_operation, operation, input_image, **kwargs)
-            futures.append((future, operation))
+            try:
+                results.append(_timed_operation(metrics, operation, frame, {}, tile_size, source))
+            except Exception as error:
+                _report_error(failed, source,
+                              f"{_operation_name(operation)} failed on frame {index} of {source}: {error}")
+                results.append(None)
+        return [(index, results)]
+
+    def write_frame(path, frame, operation):
+        if video_output == "frames":
+            return _timed_imwrite(metrics, sink, path, frame, operation, source)
+        output = outputs.get(path)
+        if output is None:
+            output = outputs[path] = video.VideoOutput(path, fps)
+        if metrics is None:
+            return output.write(frame)
+        with metrics.span("encode", _operation_name(operation), frame.shape, source):
+            return output.write(frame)
+
+    def release(index, results):
+        try:
+            for operation, result in zip(operations, results):
+                if result is None:
+                    continue
+                for output_name, frame in zip(_output_names(operation), result if isinstance(result, list) else [result]):
+                    if video_output == "frames":
+                        path = sink.path(name, f"{output_name}_{index:06d}")
+                    else:
+                        path = sink.path(name, output_name, "." + video_output)
+                    if write_frame(path, frame, operation):
+                        continue
+                    output = outputs.get(path)
+                    if output is not None and output.failed:
+                        # A writer that failed to open fails every frame; report it once.
+                        if path not in unopened:
+                            unopened.add(path)
+                            _report_error(failed, source, f"Could not open the video writer for: {path}")
+                    else:
+                        _report_error(failed, source, f"Could not write frame {index} to: {path}")
+        except Exception as error:
+            _report_error(failed, source, f"Could not write frame {index} of {source}: {error}")
+        finally:
+            slots.release()
+
+    unopened = set()
+    buffer = video.ReorderBuffer(release)
+    claim_opencv_threads(buffer, workers)
+    try:
+        streaming.run_stages(video.iter_frames(capture, slots),
+                             [("compute", compute, workers), ("encode", lambda item: buffer.push(*item), 1)], window)
+    finally:
+        release_opencv_threads(buffer)
+    for output in outputs.values():
+        output.close()
+    if not unopened:
+        print(f"Video processing completed successfully for: {source} ({buffer.next_index} frames)")
+    return buffer.next_index
+
+
+def _collect_finished(futures, failed, return_when):
+    """
+    Wait for submitted images to finish, and report the ones whose Future failed.
+    :param futures: A dict of the Futures of submitted images to their paths; finished ones are removed.
+    :param failed: An optional callable failed(input_image_path, message) invoked for every failed image.
+    :param return_when: concurrent.futures.FIRST_COMPLETED or ALL_COMPLETED.
+    """
+    done, _ = concurrent.futures.wait(futures, return_when=return_when)
+    for future in done:
+        image = futures.pop(future)
+        if future.exception() is not None:
+            _report_error(failed, image, f"Could not process {image}: {future.exception()}")
+
+
+def _split_videos(images, videos):
+    """
+    Lazily set aside the inputs that are videos or frame sequences.
+    :param images: An iterable of input paths.
+    :param videos: A list that video inputs are appended to.
+    :return: A generator of the remaining (still image) paths.
+    """
+    for image in images:
+        if video.is_video(image):
+            videos.append(image)
+        else:
+            yield image
+
+
+def _skip_processed(images, manifest, operations, outputs, seen, skipped):
+    """
+    Lazily drop the inputs a manifest records as already processed with the same operations and unchanged since.
+    :param images: An iterable of paths to the input images.
+    :param manifest: The Manifest of earlier runs.
+    :param operations: The names of the operations to apply.
+    :param outputs: A callable outputs(input_image_path) returning the output paths the operations write.
+    :param seen: A list that every input path is appended to, skipped or not.
+    :param skipped: A list that the skipped input paths are appended to.
+    :return: A generator of the paths that still need processing.
+    """
+    for image in images:
+        seen.append(image)
+        if manifest.is_current(image, operations, outputs(image)):
+            skipped.append(image)
+        else:
+            yield image
+
+
+def decode_for_hash(input_image_path):
+    """
+    Decode an image just well enough to hash it: in grayscale and, for a large enough JPEG, at 1/2, 1/4 or 1/8
+    resolution, since the perceptual hashes only look at a 32x32 thumbnail.
+    :param input_image_path: The path to the input image.
+    :return: The grayscale image, or None if it could not be read.
+    """
+    full_size = image_header.jpeg_size(input_image_path)
+    factor = 1
+    if full_size is not None:
+        factor = next((candidate for candidate in (8, 4, 2) if min(full_size) // candidate >= 64), 1)
+    return cv2.imread(input_image_path, REDUCED_DECODE_FLAGS[(factor, True)])
 
-        for future, operation in futures:
-            result = future.result()
-            cv2.imwrite(os.path.join(output_dir, f"{operation.name.lower()}_image.jpg"), result)
 
-    print(f"Image processing completed successfully for: {input_image_path}")
+def _skip_duplicates(images, index, workload, outputs, duplicates, workers=None):
+    """
+    Lazily set aside the inputs that are near-duplicates of an image already in a hash index with the same workload.
+    Inputs are hashed in parallel but checked in input order; every input that is not a duplicate is added to the
+    index with the outputs it is about to get, so duplicates within the same batch are found too.
+    :param images: An iterable of paths to the input images.
+    :param index: The perceptual_hash.HashIndex.
+    :param workload: The workload key: the operation names and output encoding.
+    :param outputs: A callable outputs(input_image_path) returning the output paths the operations write.
+    :param duplicates: A list that (input path, hash, HashEntry of the earlier image) tuples are appended to.
+    :param workers: The number of hashing threads.
+    :return: A generator of the paths that still need processing.
+    """
+    def hash_image(input_image_path):
+        image = decode_for_hash(input_image_path)
+        return None if image is None else index.hash(image)
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        for batch in batching.iter_batches(images, 64):
+            for image, image_hash in zip(batch, executor.map(hash_image, batch)):
+                if image_hash is None:
+                    yield image
+                    continue
+                original = index.nearest(image_hash, workload)
+                if original is None:
+                    index.add(image_hash, workload, os.path.abspath(image), outputs(image))
+                    yield image
+                else:
+                    duplicates.append((image, image_hash, original))
+
+
+def _link_duplicates(duplicates, sink, index, workload, outputs, completed=None):
+    """
+    Give every near-duplicate input the outputs of the earlier image it matched, as hard links (or copies). When
+    those outputs no longer exist, the stale index entry is removed and the input is left to be processed.
+    :param duplicates: The (input path, hash, HashEntry) tuples from _skip_duplicates.
+    :param sink: The OutputSink.
+    :param index: The perceptual_hash.HashIndex.
+    :param workload: The workload key.
+    :param outputs: A callable outputs(input_image_path) returning the output paths.
+    :param completed: An optional callable completed(input_image_path) called for every linked input.
+    :return: A list of (input path, hash) tuples that still need processing.
+    """
+    leftovers = []
+    for image, image_hash, original in duplicates:
+        targets = outputs(image)
+        if len(targets) == len(original.outputs) and all(sink.link(source, target) for source, target
+                                                         in zip(original.outputs, targets)):
+            if completed is not None:
+                completed(image)
+        else:
+            index.discard(original.id)
+            leftovers.append((image, image_hash))
+    return leftovers
 
 
-def process_images(images, output_dir, operations):
+def process_images(images, output_dir, operations, backend="thread", workers=None, scheduler=None, max_inflight_mb=None,
+                   tile_size=None, cache=None, manifest=None, prune=False, metrics=None, reduced_decode=False,
+                   sink=None, tuner=None, video_options=None, dedupe=None, buffer_pool=None, job_stats=None,
+                   failed=None, **backend_options):
     """
     Process multiple input images concurrently using the specified operations and save the results to the output directory.
-    :param images: A list of paths to the input images.
+    :param images: An iterable of paths to the input images, consumed lazily. With the thread backend at most twice
+                   the scheduler's workers images are submitted but not yet finished at a time.
     :param output_dir: The path to the output directory.
-    :param operations: The list of image processing operations to apply (from the ImageOperation enum).
+    :param operations: The list of image processing operations to apply (from the ImageOperation enum); a tuple of
+                       operations is applied as a chain and saved as one output.
+    :param backend: "thread" to use a thread scheduler, "process" to use a process pool with shared memory hand-off,
+                    "pipeline" to stream images through separate decode, compute and encode stages, or "batch" to
+                    apply each operation to batches of same-shaped images at once.
+    :param workers: The number of workers. With the thread backend a dedicated scheduler of this size is created
+                    for the call; otherwise the process-wide scheduler is used.
+    :param scheduler: An ImageScheduler to run on with the thread backend, e.g. to read its stats() afterwards.
+    :param max_inflight_mb: With the thread backend, the memory budget in megabytes for decoded images and their
+                            pending results; new images are only admitted as the budget frees up.
+    :param tile_size: When set, blur, filter, threshold, erosion and dilation are split into tiles of this edge
+                      length and processed in parallel, so a single huge image uses every core.
+    :param cache: With the thread backend, an optional ResultCache; outputs found in it are copied without
+                  decoding or computing.
+    :param manifest: An optional Manifest (or path to one). Inputs it records as already processed with the same
+                     operations, and unchanged since, are skipped; every completed input is recorded, so an
+                     interrupted batch resumes where it stopped.
+    :param prune: With a manifest, forget inputs that are not part of this batch any more and delete their outputs.
+    :param metrics: With the thread, pipeline or batch backend, an optional Metrics collector timing decode, every
+                    operation, encode and queue waits. Pass the same collector to the scheduler to include its
+                    queue waits.
+    :param reduced_decode: With the thread, pipeline or batch backend, decode at reduced resolution when every
+                           operation starts with a large enough downscale, and in grayscale when every operation only
+                           needs brightness (see plan_decode). Results may differ slightly from a full decode.
+    :param sink: An optional OutputSink choosing output names, codec and (with the thread backend) writer threads.
+                 By default results are saved as JPEG files in output_dir named after the input and operation, e.g.
+                 photo_blur.jpg. Output names are assigned in input order, so inputs sharing a file name get distinct
+                 outputs.
+    :param video_options: Options for video and frame-sequence inputs, passed to _process_video: video_output
+                          ("mp4", "avi" or "frames"), fps and window. Such inputs are processed after the still
+                          images, one at a time with their frames in parallel, whatever the backend; they are not
+                          recorded in the manifest.
+    :param tuner: With the thread backend, an optional Autotuner that adjusts the scheduler's worker and OpenCV
+                  threads while the batch runs and settles on the fastest configuration.
+    :param dedupe: An optional perceptual_hash.HashIndex. Inputs within its radius of an image processed earlier
+                   with the same operations and output encoding (in this batch or an earlier run) are not processed;
+                   their outputs are hard links to (or copies of) that image's outputs. Other inputs are added to it.
+    :param buffer_pool: With the thread or pipeline backend, an optional BufferPool that operation outputs are
+                        drawn from and returned to once encoded, so same-sized images stop allocating new results.
+    :param job_stats: With the thread backend, an optional ThroughputStats that counts this batch's images on their
+                      own, e.g. when the scheduler is shared with other batches (see ImageScheduler.stats).
+    :param failed: An optional callable failed(input_path, message) invoked for every error that keeps an input
+                   (image or video) from being fully processed, e.g. to report a job's failed inputs to its caller.
+    :param backend_options: readers, writers and queue_size for the "pipeline" backend; readers, writers and
+                            batch_size for the "batch" backend; a warm pool (see make_process_pool) for the "process"
+                            backend.
     """
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(process_image, image, output_dir, operations) for image in images]
-        concurrent.futures.wait(futures)
+    sink = sink or OutputSink(output_dir)
+    videos = []
+    images = sink.claim_all(_split_videos(images, videos))
+    completed = None
+    seen, skipped = [], []
+    names = [_operation_name(operation) for operation in operations]
+
+    def outputs(input_image_path):
+        return [os.path.abspath(sink.path(input_image_path, name)) for operation in operations
+                for name in _output_names(operation)]
+
+    if manifest is not None:
+        if not isinstance(manifest, Manifest):
+            manifest = Manifest(manifest)
+        images = _skip_processed(images, manifest, names, outputs, seen, skipped)
+
+        def completed(input_image_path):
+            manifest.record(input_image_path, names, outputs(input_image_path))
+
+    decode_plan = plan_decode(operations) if reduced_decode else None
+
+    def run_backend(images):
+        if backend == "pipeline":
+            _process_images_pipeline(images, sink, operations, workers, tile_size, completed, metrics, decode_plan,
+                                     pool=buffer_pool, failed=failed, **backend_options)
+        elif backend == "batch":
+            _process_images_batched(images, sink, operations, tile_size, completed, metrics, decode_plan,
+                                    failed=failed, **backend_options)
+        elif backend == "process":
+            if reduced_decode:
+                raise ValueError("Reduced decode is not supported by the process backend")
+            _process_images_shared(images, sink, operations, workers, tile_size, completed, failed=failed,
+                                   **backend_options)
+        elif backend == "thread":
+            runner = scheduler
+            owned = runner is None and (workers is not None or max_inflight_mb is not None)
+            if owned:
+                runner = ImageScheduler(workers, max_inflight_bytes=_megabytes(max_inflight_mb), metrics=metrics)
+            runner = runner or get_scheduler()
+            if tuner is not None:
+                tuner.start(runner, lambda: sink.written)
+            try:
+                # Submit lazily, so a long input stream is not read (and claimed by the sink) all at once.
+                futures = {}
+                for image in images:
+                    while len(futures) >= 2 * runner.workers:
+                        _collect_finished(futures, failed, concurrent.futures.FIRST_COMPLETED)
+                    futures[_submit_image(runner, image, sink, operations, tile_size, cache, completed, metrics,
+                                          decode_plan, buffer_pool, job_stats, failed)] = image
+                _collect_finished(futures, failed, concurrent.futures.ALL_COMPLETED)
+                sink.flush()
+            finally:
+                if tuner is not None:
+                    tuner.stop()
+                if owned:
+                    runner.shutdown()
+        else:
+            raise ValueError(f"Unsupported backend: {backend}")
+
+    duplicates = []
+    if dedupe is not None:
+        workload = ",".join(names) + "|" + sink.encoding
+        images = _skip_duplicates(images, dedupe, workload, outputs, duplicates, workers)
+    run_backend(images)
+    if dedupe is not None:
+        leftovers = _link_duplicates(duplicates, sink, dedupe, workload, outputs, completed)
+        if leftovers:
+            run_backend(image for image, _ in leftovers)
+            for image, image_hash in leftovers:
+                dedupe.add(image_hash, workload, os.path.abspath(image), outputs(image))
+        dedupe.commit()
+        print(f"Linked {len(duplicates) - len(leftovers)} near-duplicate inputs to earlier results.")
 
+    for source in videos:
+        _process_video(source, sink, operations, workers, tile_size, metrics, failed=failed, **(video_options or {}))
+
+    if manifest is not None:
+        print(f"Skipped {len(skipped)} inputs already processed.")
+        if prune:
+            pruned = manifest.prune(seen)
+            print(f"Pruned {len(pruned)} inputs that are no longer present.")
     print("All image processing tasks completed successfully.")
 
 
-def main():
+def build_parser(parser_class=argparse.ArgumentParser):
     """
-    The main entry point of the script.
-    Parses command-line arguments, processes the input images with the specified operations, and saves the results to the output directory.
+    Build the command-line parser, shared by the script and the daemon (see toolbox_daemon.py).
+    :param parser_class: The ArgumentParser class to instantiate, e.g. one that raises instead of exiting on errors.
+    :return: The parser.
     """
-    parser = argparse.ArgumentParser(description="Multithreaded image processing in Python.")
-    parser.add_argument("inputs", nargs="+", help="Paths to the input images.")
+    parser = parser_class(description="Multithreaded image processing in Python.")
+    parser.add_argument("inputs", nargs="+",
+                        help="Paths to the input images. Directories, glob patterns and '-' (read paths from stdin) "
+                             "are expanded lazily. Videos (e.g. .mp4, .avi) and numbered frame sequences (e.g. "
+                             "'frames/frame_%%05d.png') are processed frame by frame.")
     parser.add_argument("output", help="Path to the output directory.")
     parser.add_argument(
         "-o",
         "--operations",
         nargs="+",
-        choices=[operation.name.lower() for operation in ImageOperation],
-        help="List of image processing operations to apply. Supported operations: resize, rotate, blur, canny, contrast_brightness, histogram_equalization, filter, threshold, erosion, dilation",
+        help="List of image processing operations to apply. Supported operations: resize, rotate, blur, canny, contrast_brightness, histogram_equalization, filter, threshold, erosion, dilation, pyramid. "
+             "Parameters follow the name after colons, e.g. 'rotate:angle=90' or 'canny:lower_threshold=50:upper_threshold=150'.",
     )
+    parser.add_argument(
+        "--chain",
+        action="append",
+        default=[],
+        help="A chain of operations applied in order and saved as one output, e.g. 'resize,blur,threshold'. "
+             "Can be given several times.",
+    )
+    parser.add_argument("--chain-file", help="A file with one chain of operations per line, in the --chain format.")
+    parser.add_argument(
+        "--backend",
+        choices=["thread", "process", "pipeline", "batch"],
+        default="thread",
+        help="Executor used to process the images. 'process' runs decode and operations in worker processes and "
+             "hands images between them through shared memory. 'pipeline' streams images through separate decode, "
+             "compute and encode stages connected by bounded queues. 'batch' stacks same-shaped images and applies "
+             "each operation to the whole stack (best for many small images of the same size).",
+    )
+    parser.add_argument("--readers", type=int, default=2, help="Decode threads for the pipeline and batch backends.")
+    parser.add_argument("--writers", type=int, default=2,
+                        help="Encode threads for the thread, pipeline and batch backends (0 encodes on the compute "
+                             "threads with the thread backend).")
+    parser.add_argument("--queue-size", type=int, default=16, help="Capacity of each queue in the pipeline backend.")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per batch for the batch backend.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker threads or processes.")
+    parser.add_argument("--opencv-threads", type=int, default=None,
+                        help="Threads OpenCV may use inside each call (defaults to cores divided by workers).")
+    parser.add_argument("--max-inflight-mb", type=float, default=None,
+                        help="Memory budget for decoded images and pending results in flight (thread backend).")
+    parser.add_argument("--video-output", choices=["mp4", "avi", "frames"], default="mp4",
+                        help="How to save the results of video and frame-sequence inputs: one video per operation, "
+                             "or numbered frame files in --format.")
+    parser.add_argument("--fps", type=float, default=None,
+                        help="Frame rate of output videos (defaults to the input's, or 25 for frame sequences).")
+    parser.add_argument("--autotune", action="store_true",
+                        help="Tune the number of worker threads and OpenCV threads while the batch runs (thread "
+                             "backend); with --profile, save the result.")
+    parser.add_argument("--profile",
+                        help="Tuning profile file: use the configuration tuned earlier on this host for the same "
+                             "operations, or tune now and save it if there is none.")
+    parser.add_argument("--tile-size", type=int, default=None,
+                        help="Split blur, filter, threshold, erosion and dilation into tiles of this size and "
+                             "process them in parallel (for very large images).")
+    parser.add_argument("--format", choices=["jpg", "png", "webp", "npy"], default="jpg",
+                        help="Output format. 'npy' saves raw arrays that NumPy can memory-map without decoding.")
+    parser.add_argument("--quality", type=int, default=None,
+                        help="JPEG quality (0-100), WebP quality (1-100) or PNG compression level (0-9).")
+    parser.add_argument("--name-template", default="{input}_{operation}",
+                        help="Output file name without extension; {input} is the input file stem and {operation} "
+                             "the operation name.")
+    parser.add_argument("--reduced-decode", action="store_true",
+                        help="Decode JPEGs at 1/2, 1/4 or 1/8 resolution when every operation starts with a large "
+                             "enough downscale, and in grayscale when every operation only needs brightness (canny, "
+                             "threshold). Output sizes are unchanged; pixels may differ slightly.")
+    parser.add_argument("--buffer-pool-mb", type=float, default=0,
+                        help="Reuse operation output buffers of the same shape across images, keeping at most this "
+                             "many megabytes of free buffers (thread and pipeline backends; 0 disables the pool).")
+    parser.add_argument("--cache-dir", help="Directory of a content-addressed result cache (thread backend).")
+    parser.add_argument("--cache-max-mb", type=float, default=1024, help="Maximum size of the result cache on disk.")
+    parser.add_argument("--cache-memory-mb", type=float, default=0,
+                        help="Size of an in-memory tier in front of the on-disk result cache.")
+    parser.add_argument("--manifest",
+                        help="Manifest file recording processed inputs; unchanged inputs are skipped and interrupted "
+                             "batches resume where they stopped.")
+    parser.add_argument("--prune", action="store_true",
+                        help="With --manifest, forget inputs no longer present and delete their outputs.")
+    parser.add_argument("--dedupe-index",
+                        help="Perceptual-hash index file: inputs that are near-duplicates of an image processed earlier "
+                             "with the same operations get hard links to its outputs instead of being processed.")
+    parser.add_argument("--dedupe-hash", choices=["ahash", "dhash", "phash"], default="phash",
+                        help="Hash used by --dedupe-index; an existing index keeps the hash it was created with.")
+    parser.add_argument("--dedupe-radius", type=int, default=4,
+                        help="Largest number of differing hash bits (out of 64) that still counts as a duplicate.")
+    parser.add_argument("--metrics-prometheus", help="Write per-stage timing histograms in Prometheus text format.")
+    parser.add_argument("--metrics-json", help="Write a JSON summary of the per-stage timings.")
+    parser.add_argument("--trace", help="Write a Chrome trace-event file of every decode, operation and encode.")
+    parser.add_argument("--stats", action="store_true", help="Print throughput and p50/p99 per-image latency.")
+    return parser
+
+
+def operations_from_args(args, parser):
+    """
+    Collect the operations of a job from its -o/--operations, --chain and --chain-file arguments. Invalid or missing
+    operations are reported through parser.error.
+    :param args: The arguments, as parsed by the parser from build_parser.
+    :param parser: The parser that produced them.
+    :return: The list of operations; chains are tuples.
+    """
+    try:
+        operations = [parse_operation_spec(operation) for operation in args.operations or []]
+        operations += [parse_chain(chain) for chain in args.chain]
+        if args.chain_file:
+            operations += load_chains(args.chain_file)
+    except ValueError as error:
+        parser.error(str(error))
+    if not operations:
+        parser.error("at least one of -o/--operations, --chain or --chain-file is required")
+    return operations
 
-    args = parser.parse_args()
 
+def run_job(args, parser, scheduler=None, cache=None, metrics=None, pool=None, stdin=None, buffer_pool=None,
+            failed=None):
+    """
+    Run one job described by parsed command-line arguments. Invalid argument combinations are reported through
+    parser.error. Long-lived callers such as the daemon pass in warm executors and caches; anything not passed in
+    is created for the job and released afterwards.
+    :param args: The arguments, as parsed by the parser from build_parser.
+    :param parser: The parser that produced them.
+    :param scheduler: An ImageScheduler to run the thread backend on.
+    :param cache: The ResultCache for args.cache_dir, if one is already open.
+    :param metrics: A Metrics collector to time the job with, whether or not the arguments ask for an export; it
+                    must keep trace events if args.trace is set.
+    :param pool: A process pool (see make_process_pool) to run the process backend on.
+    :param stdin: The stream an input of "-" reads paths from (defaults to sys.stdin).
+    :param buffer_pool: The BufferPool for args.buffer_pool_mb, if one is already warm.
+    :param failed: An optional callable failed(input_path, message) invoked for every error on an input (see
+                   process_images).
+    :return: A dictionary of statistics (the job's throughput and latency, cache, buffer pool and derived-object
+             counters) for the thread backend, or an empty dictionary.
+    """
     # Create the output directory if it doesn't exist
     if not os.path.exists(args.output):
         os.makedirs(args.output)
 
-    operations = [ImageOperation[operation.upper()] for operation in args.operations]
+    operations = operations_from_args(args, parser)
+
+    if args.max_inflight_mb is not None and args.backend != "thread":
+        parser.error("--max-inflight-mb is only supported by the thread backend")
+    if args.reduced_decode and args.backend == "process":
+        parser.error("--reduced-decode is not supported by the process backend")
+    if args.prune and not args.manifest:
+        parser.error("--prune requires --manifest")
+    if args.cache_dir and args.backend != "thread":
+        parser.error("--cache-dir is only supported by the thread backend")
+    if args.buffer_pool_mb and args.backend not in ("thread", "pipeline"):
+        parser.error("--buffer-pool-mb is only supported by the thread and pipeline backends")
+
+    try:
+        sink = OutputSink(args.output, args.format, args.quality, args.name_template,
+                          args.writers if args.backend == "thread" else 0)
+    except ValueError as error:
+        parser.error(str(error))
+
+    dedupe = None
+    if args.dedupe_index:
+        try:
+            dedupe = perceptual_hash.HashIndex(args.dedupe_index, args.dedupe_radius, args.dedupe_hash)
+        except ValueError as error:
+            parser.error(str(error))
+
+    if not args.buffer_pool_mb:
+        buffer_pool = None
+    elif buffer_pool is None:
+        buffer_pool = BufferPool(_megabytes(args.buffer_pool_mb))
+
+    if not args.cache_dir:
+        cache = None
+    elif cache is None:
+        cache = result_cache.ResultCache(args.cache_dir, _megabytes(args.cache_max_mb),
+                                         _megabytes(args.cache_memory_mb))
+
+    if args.metrics_prometheus or args.metrics_json or args.trace:
+        if args.backend == "process":
+            parser.error("metrics export is only supported by the thread, pipeline and batch backends")
+        if metrics is None:
+            metrics = Metrics(trace=bool(args.trace))
+
+    tuner = None
+    workers, opencv_threads = args.workers, args.opencv_threads
+    if args.autotune or args.profile:
+        if args.backend != "thread":
+            parser.error("--autotune and --profile are only supported by the thread backend")
+        workload = ",".join(_operation_name(operation) for operation in operations)
+        tuned = None if args.autotune else autotune.load_profile(args.profile, workload)
+        if tuned is None:
+            tuner = autotune.Autotuner()
+        else:
+            workers = workers or tuned["workers"]
+            opencv_threads = opencv_threads or tuned["opencv_threads"]
+
+    owned = scheduler is None and args.backend == "thread"
+    if owned:
+        scheduler = ImageScheduler(workers, opencv_threads, _megabytes(args.max_inflight_mb), metrics)
+
+    # The scheduler may be a warm one shared with other jobs, so this job's images are counted on their own.
+    job_stats = ThroughputStats() if args.backend == "thread" else None
+    backend_options = {}
+    if args.backend == "pipeline":
+        backend_options = {"readers": args.readers, "writers": args.writers, "queue_size": args.queue_size}
+    elif args.backend == "batch":
+        backend_options = {"readers": args.readers, "writers": args.writers, "batch_size": args.batch_size}
+    elif args.backend == "process" and pool is not None:
+        backend_options = {"pool": pool}
+
+    process_images(streaming.iter_inputs(args.inputs, stdin), args.output, operations, backend=args.backend,
+                   workers=args.workers, scheduler=scheduler, tile_size=args.tile_size, cache=cache,
+                   manifest=args.manifest, prune=args.prune, metrics=metrics, reduced_decode=args.reduced_decode,
+                   sink=sink, tuner=tuner, video_options={"video_output": args.video_output, "fps": args.fps},
+                   dedupe=dedupe, buffer_pool=buffer_pool, job_stats=job_stats, failed=failed, **backend_options)
+    sink.close()
+    if dedupe is not None:
+        dedupe.close()
+
+    if tuner is not None and tuner.result() is not None:
+        tuned = tuner.result()
+        print(f"Autotuned to {tuned['workers']} workers x {tuned['opencv_threads']} OpenCV threads "
+              f"({tuned['outputs_per_s']:.1f} outputs/s{'' if tuned['settled'] else ', search not finished'}).")
+        if args.profile:
+            autotune.save_profile(args.profile, workload, tuned)
 
-    process_images(args.inputs, args.output, operations)
+    if metrics is not None:
+        if args.metrics_prometheus:
+            metrics.write_prometheus(args.metrics_prometheus)
+        if args.metrics_json:
+            metrics.write_summary(args.metrics_json)
+        if args.trace:
+            metrics.write_chrome_trace(args.trace)
+
+    stats = {}
+    if args.backend == "thread":
+        if owned:
+            scheduler.shutdown()
+        stats = scheduler.stats(job_stats)
+        if cache is not None:
+            stats.update(cache.stats())
+        if buffer_pool is not None:
+            stats.update(buffer_pool.stats())
+        stats.update(derived_cache_stats())
+        stats.update(convolution.path_counts())
+    return stats
+
+
+def print_stats(stats):
+    """
+    Print statistics one per line, floats with two decimals.
+    :param stats: A dictionary of statistics.
+    """
+    for name, value in stats.items():
+        print(f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}")
+
+
+def main():
+    """
+    The main entry point of the script.
+    Parses command-line arguments, processes the input images with the specified operations, and saves the results to the output directory.
+    """
+    parser = build_parser()
+    args = parser.parse_args()
+    stats = run_job(args, parser)
+    if args.stats:
+        print_stats(stats)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+#Libraries used
+import functools
+import threading
+import time
+import cv2
+import numpy as np
+
+# Kernels smaller than this (in elements) always go through filter2D's spatial path: it is fast for them, and its
+# result does not depend on the size of the array being filtered, so those filters can also be tiled.
+DIRECT_KERNEL_AREA = 50
+
+# A kernel is treated as separable when its second singular value is this small relative to the first.
+SEPARABLE_TOLERANCE = 1e-6
+
+# Kernel edge lengths tried when calibrating the FFT threshold, and the size of the calibration image.
+CALIBRATION_SIZES = (15, 31, 63, 127)
+CALIBRATION_IMAGE = 768
+
+_lock = threading.Lock()
+_path_counts = {"direct": 0, "separable": 0, "fft": 0}
+_fft_threshold = None
+_calibrated = False
+
+
+@functools.lru_cache(maxsize=64)
+def _separable_factors(kernel_bytes, shape):
+    """
+    Split a kernel into a column and a row vector whose outer product is the kernel, if it has rank 1.
+    :param kernel_bytes: The float64 kernel as bytes (so the result can be cached).
+    :param shape: The shape of the kernel.
+    :return: A (column, row) pair of float32 vectors, or None if the kernel is not separable.
+    """
+    kernel = np.frombuffer(kernel_bytes, dtype=np.float64).reshape(shape)
+    if min(shape) < 2:
+        return None
+    u, s, vt = np.linalg.svd(kernel)
+    if s[0] == 0 or s[1] > SEPARABLE_TOLERANCE * s[0]:
+        return None
+    scale = np.sqrt(s[0])
+    return (u[:, 0] * scale).astype(np.float32), (vt[0] * scale).astype(np.float32)
+
+
+@functools.lru_cache(maxsize=8)
+def _kernel_spectrum(kernel_bytes, shape, dft_shape):
+    """
+    Compute the DFT of a kernel zero-padded to the transform size.
+    :param kernel_bytes: The float64 kernel as bytes.
+    :param shape: The shape of the kernel.
+    :param dft_shape: The transform size.
+    :return: The complex spectrum as a read-only two-channel float32 array.
+    """
+    padded = np.zeros(dft_shape, np.float32)
+    padded[:shape[0], :shape[1]] = np.frombuffer(kernel_bytes, dtype=np.float64).reshape(shape)
+    spectrum = cv2.dft(padded, flags=cv2.DFT_COMPLEX_OUTPUT)
+    spectrum.flags.writeable = False
+    return spectrum
+
+
+def fft_filter(image, kernel, dst=None):
+    """
+    Correlate an image with a kernel through the frequency domain, with the same anchor and border handling
+    (reflect-101) as cv2.filter2D. Results match filter2D to within one level of rounding.
+    :param image: The input image as a NumPy array.
+    :param kernel: The kernel as a 2D array.
+    :param dst: An optional preallocated output array to write the result into.
+    :return: The filtered image, with the dtype of the input.
+    """
+    kernel = np.asarray(kernel, dtype=np.float64)
+    rows, cols = image.shape[:2]
+    kernel_rows, kernel_cols = kernel.shape
+    padded = cv2.copyMakeBorder(image, kernel_rows // 2, kernel_rows - 1 - kernel_rows // 2,
+                                kernel_cols // 2, kernel_cols - 1 - kernel_cols // 2, cv2.BORDER_REFLECT_101)
+    dft_shape = (cv2.getOptimalDFTSize(padded.shape[0]), cv2.getOptimalDFTSize(padded.shape[1]))
+    spectrum = _kernel_spectrum(np.ascontiguousarray(kernel).tobytes(), kernel.shape, dft_shape)
+
+    planes = []
+    buffer = np.zeros(dft_shape, np.float32)
+    for plane in cv2.split(padded):
+        buffer[:plane.shape[0], :plane.shape[1]] = plane
+        transformed = cv2.dft(buffer, flags=cv2.DFT_COMPLEX_OUTPUT, nonzeroRows=plane.shape[0])
+        cv2.mulSpectrums(transformed, spectrum, 0, transformed, conjB=True)
+        result = cv2.idft(transformed, flags=cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT, nonzeroRows=rows)
+        planes.append(result[:rows, :cols])
+    result = cv2.merge(planes) if len(planes) > 1 else planes[0]
+
+    if np.issubdtype(image.dtype, np.integer):
+        limits = np.iinfo(image.dtype)
+        np.rint(result, out=result)
+        np.clip(result, limits.min, limits.max, out=result)
+    result = result.astype(image.dtype, copy=False)
+    if dst is not None and dst.shape == result.shape and dst.dtype == result.dtype:
+        np.copyto(dst, result)
+        return dst
+    return result
+
+
+def _time_calls(function, repeat):
+    function()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return time.perf_counter() - start
+
+
+def calibrate_fft_threshold(sizes=CALIBRATION_SIZES, image_size=CALIBRATION_IMAGE, repeat=2):
+    """
+    Time filter2D against the FFT path on a synthetic image for increasing kernel sizes.
+    :param sizes: The kernel edge lengths to try, in increasing order.
+    :param image_size: The edge length of the synthetic single-channel image.
+    :param repeat: The number of timed calls per path and size.
+    :return: The smallest kernel edge length from which the FFT path is faster for every larger size tried, or None
+             if filter2D is always at least as fast.
+    """
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (image_size, image_size), dtype=np.uint8)
+    threshold = None
+    for size in reversed(sizes):
+        kernel = rng.normal(0, 1, (size, size)).astype(np.float32)
+        direct = _time_calls(lambda: cv2.filter2D(image, -1, kernel), repeat)
+        fft = _time_calls(lambda: fft_filter(image, kernel), repeat)
+        if fft >= direct:
+            break
+        threshold = size
+    return threshold
+
+
+def set_fft_threshold(edge):
+    """
+    Set the kernel edge length from which non-separable kernels use the FFT path, skipping calibration.
+    :param edge: The edge length, or None to never use the FFT path.
+    """
+    global _fft_threshold, _calibrated
+    with _lock:
+        _fft_threshold, _calibrated = edge, True
+
+
+def fft_threshold():
+    """
+    Get the kernel edge length from which the FFT path is used, calibrating it on first use.
+    :return: The edge length, or None if the FFT path is never used.
+    """
+    global _fft_threshold, _calibrated
+    with _lock:
+        if not _calibrated:
+            _fft_threshold, _calibrated = calibrate_fft_threshold(), True
+        return _fft_threshold
+
+
+def choose_path(kernel):
+    """
+    Choose how a kernel should be applied: "direct" (filter2D) for small kernels, "separable" (sepFilter2D) for
+    rank-1 kernels, "fft" for kernels at or above the calibrated size, and "direct" otherwise.
+    :param kernel: The kernel as a 2D array.
+    :return: The path name.
+    """
+    kernel = np.asarray(kernel)
+    if kernel.size < DIRECT_KERNEL_AREA:
+        return "direct"
+    if _separable_factors(np.ascontiguousarray(kernel, dtype=np.float64).tobytes(), kernel.shape) is not None:
+        return "separable"
+    threshold = fft_threshold()
+    if threshold is not None and max(kernel.shape) >= threshold:
+        return "fft"
+    return "direct"
+
+
+def convolve(image, kernel, dst=None):
+    """
+    Apply a kernel to an image like cv2.filter2D(image, -1, kernel), using the fastest path for the kernel.
+    The path taken is counted (see path_counts).
+    :param image: The input image as a NumPy array.
+    :param kernel: The kernel as a 2D array.
+    :param dst: An optional preallocated output array to write the result into.
+    :return: The filtered image as a NumPy array.
+    """
+    path = choose_path(kernel)
+    with _lock:
+        _path_counts[path] += 1
+    if path == "separable":
+        kernel = np.asarray(kernel)
+        column, row = _separable_factors(np.ascontiguousarray(kernel, dtype=np.float64).tobytes(), kernel.shape)
+        return cv2.sepFilter2D(image, -1, row, column, dst=dst)
+    if path == "fft":
+        return fft_filter(image, kernel, dst=dst)
+    return cv2.filter2D(image, -1, kernel, dst=dst)
+
+
+def path_counts():
+    """
+    Report how many filter calls took each path.
+    :return: A dictionary with the number of direct, separable and FFT calls.
+    """
+    with _lock:
+        return {f"filter_{path}": count for path, count in _path_counts.items()}
@@ -0,0 +1,342 @@
+#Libraries used
+import argparse
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+import batching
+import concurrent_image_processing
+from broker import DEFAULT_BROKER, BrokerClient
+from buffer_pool import BufferPool
+from output_sink import OutputSink
+from scheduler import ImageScheduler, get_scheduler
+import streaming
+
+# Job options that only make sense on a single host.
+UNSUPPORTED_OPTIONS = {"cache_dir": "--cache-dir", "manifest": "--manifest", "dedupe_index": "--dedupe-index",
+                       "autotune": "--autotune", "profile": "--profile", "metrics_prometheus": "--metrics-prometheus",
+                       "metrics_json": "--metrics-json", "trace": "--trace"}
+
+# Job options that size the executor; in distributed mode each worker sets them for itself.
+WORKER_OPTIONS = {"workers": "--workers", "opencv_threads": "--opencv-threads", "max_inflight_mb": "--max-inflight-mb",
+                  "buffer_pool_mb": "--buffer-pool-mb"}
+
+
+def encode_operations(operations):
+    """
+    Write operations in a JSON-serializable form: each operation as its spec text, each chain as a list of them.
+
+    :param operations: The list of operations; chains are tuples.
+    :return: The list of spec texts and lists of spec texts.
+    """
+    return [[concurrent_image_processing.format_operation_spec(step) for step in operation]
+            if isinstance(operation, tuple) else concurrent_image_processing.format_operation_spec(operation)
+            for operation in operations]
+
+
+def decode_operations(encoded):
+    """
+    Read operations written by encode_operations.
+
+    :param encoded: The list of spec texts and lists of spec texts.
+    :return: The list of operations; chains are tuples.
+    """
+    return [tuple(concurrent_image_processing.parse_operation_spec(step) for step in operation)
+            if isinstance(operation, list) else concurrent_image_processing.parse_operation_spec(operation)
+            for operation in encoded]
+
+
+def submit_batch(broker, images, output_dir, operations, sink=None, tile_size=None, reduced_decode=False,
+                 chunk_size=1000):
+    """
+    Shard a batch into one job per input image on a broker. Output names are assigned here, in input order, so they
+    are the same as for a local run however the jobs are spread over workers. Input and output paths are sent as
+    absolute paths, so every worker must see them at the same place (e.g. on shared storage).
+
+    :param broker: A BrokerClient, or a JobQueue in the same process.
+    :param images: An iterable of paths to the input images; it is consumed lazily, chunk_size at a time.
+    :param output_dir: The path to the output directory.
+    :param operations: The list of operations; a tuple of operations is applied as a chain and saved as one output.
+    :param sink: An optional OutputSink whose format, quality and name template the workers use.
+    :param tile_size: The tile edge length for tileable operations, or None to process whole images.
+    :param reduced_decode: Whether workers may decode at reduced resolution or in grayscale (see plan_decode).
+    :param chunk_size: The number of jobs sent per request.
+    :return: A tuple of the batch id and the number of jobs queued.
+    """
+    sink = sink or OutputSink(output_dir)
+    payload = {"operations": encode_operations(operations), "output_dir": os.path.abspath(sink.output_dir),
+               "format": sink.format, "quality": sink.quality, "template": sink.template, "tile_size": tile_size,
+               "reduced_decode": reduced_decode}
+    batch = broker.create_batch(payload)
+    videos = []
+    queued = 0
+    images = sink.claim_all(concurrent_image_processing._split_videos(images, videos))
+    for chunk in batching.iter_batches(images, chunk_size):
+        queued += broker.submit(batch, [[os.path.abspath(image), sink.prefix(image)] for image in chunk])
+    for source in videos:
+        print(f"Error: Videos are not supported in distributed mode: {source}")
+    return batch, queued
+
+
+def wait_for_batch(broker, batch, poll_interval=1.0, report=None):
+    """
+    Wait until every job of a batch has completed or failed.
+
+    :param broker: A BrokerClient, or a JobQueue in the same process.
+    :param batch: The batch id.
+    :param poll_interval: The time in seconds between progress checks.
+    :param report: An optional callable report(progress) called after every check.
+    :return: The final progress dictionary (see JobQueue.progress).
+    """
+    while True:
+        progress = broker.progress(batch)
+        if report is not None:
+            report(progress)
+        if not progress["pending"] and not progress["leased"]:
+            return progress
+        time.sleep(poll_interval)
+
+
+class Worker:
+    """
+    Pulls image jobs from a broker and processes them on an ImageScheduler, through the same decode, operation and
+    write path as process_images.
+
+    The worker keeps up to lease_size jobs in flight, leasing more as jobs finish, and renews its leases from a
+    background thread every third of the lease time. Each job is reported back as completed, with its output paths,
+    or failed, with the error; a job whose report is lost is handed out again once its lease expires.
+    """
+
+    def __init__(self, broker, worker_id=None, scheduler=None, lease_size=None, lease_seconds=60.0,
+                 buffer_pool=None):
+        """
+        :param broker: A BrokerClient, or a JobQueue in the same process.
+        :param worker_id: The name the worker leases under (defaults to the host name and process id).
+        :param scheduler: The ImageScheduler to run on (defaults to the process-wide scheduler).
+        :param lease_size: The maximum number of jobs in flight (defaults to twice the scheduler's workers).
+        :param lease_seconds: The lease time assumed until the broker reports its own.
+        :param buffer_pool: An optional BufferPool the results of every job are drawn from.
+        """
+        self.broker = broker
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.scheduler = scheduler
+        self.lease_size = lease_size
+        self.lease_seconds = lease_seconds
+        self.buffer_pool = buffer_pool
+        self.completed = 0
+        self.failed = 0
+        self._held = {}
+        self._lock = threading.Lock()
+        self._sinks = {}
+        self._operations = {}
+        # The jobs in flight per (sink, input), so an input's name prefix is forgotten once its last job is done.
+        self._inputs = {}
+
+    def _sink(self, payload):
+        key = (payload["output_dir"], payload["format"], payload["quality"], payload["template"])
+        if key not in self._sinks:
+            os.makedirs(payload["output_dir"], exist_ok=True)
+            # Writes stay on the compute threads, so a job is finished once its future resolves.
+            self._sinks[key] = OutputSink(*key, writers=0)
+        return self._sinks[key]
+
+    def _decode(self, payload):
+        key = repr(payload["operations"])
+        if key not in self._operations:
+            self._operations[key] = decode_operations(payload["operations"])
+        return self._operations[key]
+
+    def _start(self, scheduler, job, finished):
+        payload = job["payload"]
+        try:
+            sink = self._sink(payload)
+            operations = self._decode(payload)
+        except (OSError, ValueError) as error:
+            finished.put((job, None, str(error)))
+            return
+        key = (id(sink), job["input"])
+        with self._lock:
+            self._inputs[key] = self._inputs.get(key, 0) + 1
+        if job["prefix"] is not None:
+            sink.assign(job["input"], job["prefix"])
+        decode_plan = concurrent_image_processing.plan_decode(operations) if payload["reduced_decode"] else None
+        succeeded = []
+        future = concurrent_image_processing._submit_image(scheduler, job["input"], sink, operations,
+                                                           payload["tile_size"], completed=succeeded.append,
+                                                           decode_plan=decode_plan, pool=self.buffer_pool)
+
+        def report(future):
+            if succeeded:
+                outputs = [sink.path(job["input"], name) for operation in operations
+                           for name in concurrent_image_processing._output_names(operation)]
+                result = (job, outputs, None)
+            else:
+                error = future.exception()
+                result = (job, None, str(error) if error else f"Could not process {job['input']}")
+            # The prefix is forgotten before the job is reported, so a retry leased afterwards keeps its own.
+            with self._lock:
+                self._inputs[key] -= 1
+                if not self._inputs[key]:
+                    del self._inputs[key]
+                    sink.forget(job["input"])
+            finished.put(result)
+
+        future.add_done_callback(report)
+
+    def _report(self, job, outputs, error):
+        with self._lock:
+            self._held.pop(job["id"], None)
+        try:
+            if outputs is not None:
+                self.broker.complete(job["id"], outputs)
+                self.completed += 1
+            else:
+                self.broker.fail(job["id"], error)
+                self.failed += 1
+        except (OSError, RuntimeError) as failure:
+            print(f"Error: Could not report job {job['id']} to the broker: {failure}")
+
+    def _heartbeat(self, stop):
+        last = time.perf_counter()
+        while not stop.wait(0.1):
+            # The broker's lease time is only known once the first jobs have been leased.
+            interval = (getattr(self.broker, "lease_seconds", None) or self.lease_seconds) / 3
+            if time.perf_counter() - last < interval:
+                continue
+            last = time.perf_counter()
+            with self._lock:
+                job_ids = list(self._held)
+            if not job_ids:
+                continue
+            try:
+                renewed = set(self.broker.heartbeat(self.worker_id, job_ids))
+            except (OSError, RuntimeError) as error:
+                print(f"Error: Could not renew leases: {error}")
+                continue
+            for job_id in job_ids:
+                if job_id not in renewed:
+                    print(f"Error: Lost the lease on job {job_id}; it will be retried elsewhere")
+
+    def run(self, stop=None, exit_when_idle=False, idle_wait=1.0):
+        """
+        Process jobs until stopped.
+        :param stop: An optional threading.Event that stops the worker once set; jobs in flight are then left to
+                     expire and be retried.
+        :param exit_when_idle: Return as soon as the broker has no pending jobs and nothing is in flight.
+        :param idle_wait: The time in seconds to wait before asking an idle broker again.
+        """
+        stop = stop or threading.Event()
+        scheduler = self.scheduler or get_scheduler()
+        lease_size = self.lease_size or 2 * scheduler.workers
+        finished = queue.Queue()
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(stop_heartbeat,), daemon=True)
+        heartbeat.start()
+        try:
+            while not stop.is_set():
+                with self._lock:
+                    in_flight = len(self._held)
+                jobs = []
+                if in_flight < lease_size:
+                    try:
+                        jobs = self.broker.lease(self.worker_id, lease_size - in_flight)
+                    except (OSError, RuntimeError) as error:
+                        print(f"Error: Could not lease jobs from the broker: {error}")
+                for job in jobs:
+                    with self._lock:
+                        self._held[job["id"]] = job
+                    self._start(scheduler, job, finished)
+                if not jobs and not in_flight:
+                    if exit_when_idle:
+                        return
+                    stop.wait(idle_wait)
+                    continue
+                try:
+                    self._report(*finished.get(timeout=idle_wait))
+                except queue.Empty:
+                    continue
+                while not finished.empty():
+                    self._report(*finished.get())
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+
+
+def main():
+    """
+    Submit a batch to a broker, or run a worker. Start the broker itself with broker.py.
+    """
+    parser = argparse.ArgumentParser(description="Spread image processing over several machines through a broker.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit = commands.add_parser("submit", help="Queue a batch and wait for it. Takes the arguments of "
+                                                "concurrent_image_processing.py after the options below.")
+    submit.add_argument("--broker", default=DEFAULT_BROKER, help="Broker address, host:port or a socket path.")
+    submit.add_argument("--no-wait", action="store_true", help="Return once the batch is queued.")
+    submit.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between progress checks.")
+    worker = commands.add_parser("worker", help="Process jobs from the broker.")
+    worker.add_argument("--broker", default=DEFAULT_BROKER, help="Broker address, host:port or a socket path.")
+    worker.add_argument("--workers", type=int, default=None, help="Number of worker threads.")
+    worker.add_argument("--opencv-threads", type=int, default=None,
+                        help="Threads OpenCV may use inside each call (defaults to cores divided by workers).")
+    worker.add_argument("--max-inflight-mb", type=float, default=None,
+                        help="Memory budget for decoded images and pending results in flight.")
+    worker.add_argument("--buffer-pool-mb", type=float, default=0,
+                        help="Reuse operation output buffers of the same shape across jobs, keeping at most this many "
+                             "megabytes of free buffers (0 disables the pool).")
+    worker.add_argument("--lease-size", type=int, default=None,
+                        help="Maximum number of jobs in flight (defaults to twice the worker threads).")
+    worker.add_argument("--worker-id", default=None, help="Name to lease jobs under (defaults to host and pid).")
+    worker.add_argument("--exit-when-idle", action="store_true", help="Exit once the broker has no pending jobs.")
+    args, rest = parser.parse_known_args()
+    broker = BrokerClient(args.broker)
+
+    if args.command == "worker":
+        if rest:
+            parser.error(f"unrecognized arguments: {' '.join(rest)}")
+        megabytes = concurrent_image_processing._megabytes
+        scheduler = ImageScheduler(args.workers, args.opencv_threads, megabytes(args.max_inflight_mb))
+        buffer_pool = BufferPool(megabytes(args.buffer_pool_mb)) if args.buffer_pool_mb else None
+        runner = Worker(broker, args.worker_id, scheduler, args.lease_size, buffer_pool=buffer_pool)
+        try:
+            runner.run(exit_when_idle=args.exit_when_idle)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            scheduler.shutdown()
+        print(f"Completed {runner.completed} jobs, {runner.failed} failed.")
+        return
+
+    job_parser = concurrent_image_processing.build_parser()
+    job_parser.prog = "distributed.py submit"
+    job = job_parser.parse_args(rest)
+    for name, option in UNSUPPORTED_OPTIONS.items():
+        if getattr(job, name):
+            job_parser.error(f"{option} is not supported in distributed mode")
+    if job.backend != "thread":
+        job_parser.error("--backend is not supported in distributed mode; workers always use the thread backend")
+    for name, option in WORKER_OPTIONS.items():
+        if getattr(job, name):
+            job_parser.error(f"{option} is set per worker in distributed mode; pass it to distributed.py worker")
+    operations = concurrent_image_processing.operations_from_args(job, job_parser)
+    try:
+        sink = OutputSink(job.output, job.format, job.quality, job.name_template)
+    except ValueError as error:
+        job_parser.error(str(error))
+
+    batch, queued = submit_batch(broker, streaming.iter_inputs(job.inputs), job.output, operations, sink,
+                                 job.tile_size, job.reduced_decode)
+    print(f"Queued {queued} jobs as batch {batch}.")
+    if args.no_wait:
+        return
+    progress = wait_for_batch(broker, batch, args.poll_interval)
+    for path, error in progress["errors"]:
+        print(f"Error: Could not process {path}: {error}")
+    print(f"Processed {progress['done']} inputs, {progress['failed']} failed.")
+    if progress["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#Libraries used
+import struct
+
+# JPEG start-of-frame markers, which carry the image size (DHT, JPG and DAC share the range but are not frames).
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# EXIF orientations that rotate the image by 90 or 270 degrees, swapping its width and height.
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def _exif_orientation(segment):
+    """
+    Read the orientation tag from the payload of an APP1 Exif segment.
+
+    :param segment: The segment payload, starting with "Exif\\0\\0".
+    :return: The orientation (1-8), or 1 if it is missing or cannot be read.
+    """
+    tiff = segment[6:]
+    if len(tiff) < 8 or tiff[:2] not in (b"II", b"MM"):
+        return 1
+    order = "<" if tiff[:2] == b"II" else ">"
+    offset = struct.unpack(order + "I", tiff[4:8])[0]
+    if offset + 2 > len(tiff):
+        return 1
+    count = struct.unpack(order + "H", tiff[offset:offset + 2])[0]
+    for index in range(count):
+        entry = offset + 2 + index * 12
+        if entry + 12 > len(tiff):
+            break
+        tag, _, _ = struct.unpack(order + "HHI", tiff[entry:entry + 8])
+        if tag == 0x0112:
+            return struct.unpack(order + "H", tiff[entry + 8:entry + 10])[0]
+    return 1
+
+
+def jpeg_size(path):
+    """
+    Read the size of a JPEG image from its header, without decoding it, as cv2.imread would return it (that is,
+    with the EXIF orientation applied).
+
+    :param path: The path to the image.
+    :return: A (rows, cols) tuple, or None if the file is not a JPEG or its header cannot be read.
+    """
+    try:
+        with open(path, "rb") as image:
+            if image.read(2) != b"\xff\xd8":
+                return None
+            orientation = 1
+            while True:
+                marker = image.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                if marker[1] == 0xFF:
+                    image.seek(-1, 1)
+                    continue
+                if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+                    continue
+                length = struct.unpack(">H", image.read(2))[0]
+                if marker[1] in _SOF_MARKERS:
+                    rows, cols = struct.unpack(">xHH", image.read(5))
+                    if orientation in _TRANSPOSED_ORIENTATIONS:
+                        rows, cols = cols, rows
+                    return rows, cols
+                if marker[1] == 0xE1:
+                    segment = image.read(length - 2)
+                    if segment.startswith(b"Exif\x00\x00"):
+                        orientation = _exif_orientation(segment)
+                    continue
+                if marker[1] == 0xDA:
+                    return None
+                image.seek(length - 2, 1)
+    except (OSError, struct.error):
+        return None
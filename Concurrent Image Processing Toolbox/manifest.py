@@ -0,0 +1,113 @@
+#Libraries used
+import json
+import os
+import threading
+from result_cache import file_digest
+
+
+class Manifest:
+    """
+    A record of every input that has been processed: its path, size, modification time and content hash, along
+    with the operations applied and the outputs they produced.
+
+    Records are appended to a JSON Lines file as soon as each image completes, so a run that crashes halfway
+    leaves a manifest of everything finished so far and the next run resumes from there. The last record for a
+    path wins, and a partially written final line is ignored. The manifest is thread-safe.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path to the manifest file; it is created on the first record.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path) as manifest:
+                for line in manifest:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._entries[entry["path"]] = entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _append(self, entry):
+        with open(self.path, "a") as manifest:
+            manifest.write(json.dumps(entry) + "\n")
+
+    def is_current(self, input_path, operations, outputs):
+        """
+        Check whether an input was already processed with the same operations into outputs that still exist.
+
+        The size and modification time are compared first; only if they changed is the file hashed, so touched
+        but unchanged files are not reprocessed either.
+        :param input_path: The path to the input image.
+        :param operations: The names of the operations that would be applied.
+        :param outputs: The output paths that would be written.
+        :return: True if the input can be skipped.
+        """
+        key = os.path.abspath(input_path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry["operations"] != list(operations) or entry["outputs"] != list(outputs):
+            return False
+        if not all(os.path.exists(output) for output in outputs):
+            return False
+        try:
+            info = os.stat(input_path)
+        except OSError:
+            return False
+        if info.st_size == entry["size"] and info.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        if info.st_size != entry["size"] or file_digest(input_path) != entry["hash"]:
+            return False
+        self.record(input_path, operations, outputs, entry["hash"])
+        return True
+
+    def record(self, input_path, operations, outputs, digest=None):
+        """
+        Record that an input has been processed.
+        :param input_path: The path to the input image.
+        :param operations: The names of the operations that were applied.
+        :param outputs: The output paths that were written.
+        :param digest: The content hash of the input, if already known.
+        """
+        info = os.stat(input_path)
+        entry = {
+            "path": os.path.abspath(input_path),
+            "size": info.st_size,
+            "mtime_ns": info.st_mtime_ns,
+            "hash": digest or file_digest(input_path),
+            "operations": list(operations),
+            "outputs": list(outputs),
+        }
+        with self._lock:
+            self._entries[entry["path"]] = entry
+            self._append(entry)
+
+    def prune(self, live_paths):
+        """
+        Forget inputs that are no longer part of the batch and delete their outputs, except outputs still
+        recorded for a remaining input. The manifest file is then compacted.
+        :param live_paths: The input paths of the current batch.
+        :return: The list of pruned input paths.
+        """
+        live = {os.path.abspath(path) for path in live_paths}
+        with self._lock:
+            pruned = [path for path in self._entries if path not in live or not os.path.exists(path)]
+            removed = [self._entries.pop(path) for path in pruned]
+            kept_outputs = {output for entry in self._entries.values() for output in entry["outputs"]}
+            for entry in removed:
+                for output in entry["outputs"]:
+                    if output not in kept_outputs and os.path.exists(output):
+                        os.remove(output)
+
+            temporary = self.path + ".tmp"
+            with open(temporary, "w") as manifest:
+                for entry in self._entries.values():
+                    manifest.write(json.dumps(entry) + "\n")
+            os.replace(temporary, self.path)
+        return pruned
@@ -0,0 +1,190 @@
+#Libraries used
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from half a millisecond to a minute.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Image size classes in megapixels: (upper bound, label).
+SIZE_CLASSES = ((0.5, "<0.5MP"), (2, "0.5-2MP"), (8, "2-8MP"), (32, "8-32MP"), (float("inf"), ">=32MP"))
+
+
+def size_class(shape):
+    """
+    Label an image shape with its size class, so timings of similar images are aggregated together.
+
+    :param shape: The shape of the image, or None if unknown.
+    :return: The size class label, or "" if the shape is unknown.
+    """
+    if shape is None:
+        return ""
+    megapixels = shape[0] * shape[1] / 1e6
+    return next(label for bound, label in SIZE_CLASSES if megapixels < bound)
+
+
+class Histogram:
+    """
+    A cumulative latency histogram with fixed buckets, in the style of Prometheus.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        index = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, fraction):
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in.
+
+        :param fraction: The quantile as a fraction between 0 and 1.
+        :return: The estimated value in seconds (the largest bound for the overflow bucket).
+        """
+        target = fraction * self.count
+        running = 0
+        for index, count in enumerate(self.counts):
+            running += count
+            if running >= target and count:
+                return BUCKETS[min(index, len(BUCKETS) - 1)]
+        return 0.0
+
+
+class Metrics:
+    """
+    Collects per-stage timings (decode, operation, encode and queue wait) as histograms labelled by stage,
+    operation and image size class, and optionally records every timing as a Chrome trace event.
+
+    Metrics can be exported as Prometheus text, as a JSON summary, or as a Chrome trace-event file that can be
+    opened in chrome://tracing or Perfetto. The collector is thread-safe.
+    """
+
+    def __init__(self, trace=False, max_trace_events=1000000):
+        """
+        :param trace: Whether to keep individual events for write_chrome_trace.
+        :param max_trace_events: The maximum number of trace events kept; later events are dropped.
+        """
+        self.trace = trace
+        self.max_trace_events = max_trace_events
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._events = []
+        self._origin = time.perf_counter()
+
+    def observe(self, stage, seconds, operation="", shape=None, start=None, image=""):
+        """
+        Record one timing.
+
+        :param stage: The stage name, e.g. "decode", "operation", "encode" or "queue_wait".
+        :param seconds: The duration in seconds.
+        :param operation: The operation name, if the timing belongs to one.
+        :param shape: The shape of the image being processed, if known.
+        :param start: The perf_counter() value at which the timed section started (for tracing).
+        :param image: The input image path (for tracing).
+        """
+        key = (stage, operation, size_class(shape))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+            if self.trace and len(self._events) < self.max_trace_events:
+                begin = start if start is not None else time.perf_counter() - seconds
+                self._events.append({
+                    "name": f"{stage}:{operation}" if operation else stage,
+                    "cat": stage,
+                    "ph": "X",
+                    "ts": (begin - self._origin) * 1e6,
+                    "dur": seconds * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": {"image": image, "size": key[2]},
+                })
+
+    @contextmanager
+    def span(self, stage, operation="", shape=None, image=""):
+        """
+        Time a block of code and record it with observe().
+
+        :param stage: The stage name.
+        :param operation: The operation name, if any.
+        :param shape: The shape of the image being processed, if known before the block runs.
+        :param image: The input image path (for tracing).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, operation, shape, start, image)
+
+    def to_prometheus(self, prefix="image_toolbox"):
+        """
+        Render the histograms in the Prometheus text exposition format.
+
+        :param prefix: The metric name prefix.
+        :return: The exposition text.
+        """
+        name = f"{prefix}_stage_seconds"
+        lines = [f"# HELP {name} Time spent per processing stage.", f"# TYPE {name} histogram"]
+        with self._lock:
+            for (stage, operation, size), histogram in sorted(self._histograms.items()):
+                labels = f'stage="{stage}",operation="{operation}",size="{size}"'
+                running = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                    running += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {running}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Summarize the histograms.
+
+        :return: A list of dictionaries with the labels, count, total and mean seconds, and bucket-estimated
+                 p50/p99 for every (stage, operation, size) combination.
+        """
+        with self._lock:
+            return [{
+                "stage": stage,
+                "operation": operation,
+                "size": size,
+                "count": histogram.count,
+                "total_s": histogram.sum,
+                "mean_ms": histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+                "p50_ms": histogram.quantile(0.50) * 1000,
+                "p99_ms": histogram.quantile(0.99) * 1000,
+            } for (stage, operation, size), histogram in sorted(self._histograms.items())]
+
+    def write_prometheus(self, path):
+        """
+        Write the histograms to a file in the Prometheus text format, e.g. for the node exporter's textfile collector.
+        :param path: The output path.
+        """
+        with open(path, "w") as output:
+            output.write(self.to_prometheus())
+
+    def write_summary(self, path):
+        """
+        Write the JSON summary to a file.
+        :param path: The output path.
+        """
+        with open(path, "w") as output:
+            json.dump(self.summary(), output, indent=2)
+
+    def write_chrome_trace(self, path):
+        """
+        Write the recorded events as a Chrome trace-event file.
+        :param path: The output path.
+        """
+        with self._lock:
+            events = list(self._events)
+        with open(path, "w") as output:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, output)
@@ -0,0 +1,235 @@
+#Libraries used
+import concurrent.futures
+import os
+import shutil
+import threading
+import cv2
+import numpy as np
+from result_cache import make_key
+
+# Output formats: file extension and the OpenCV parameter that the quality setting maps to (None for raw arrays).
+FORMATS = {
+    "jpg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "png": (".png", cv2.IMWRITE_PNG_COMPRESSION),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+    "npy": (".npy", None),
+}
+
+# Accepted quality range per format: JPEG and WebP quality, and the PNG compression level.
+QUALITY_RANGES = {"jpg": (0, 100), "png": (0, 9), "webp": (1, 100)}
+
+# The default name template: input file stem, then operation name, so every input gets its own outputs.
+DEFAULT_TEMPLATE = "{input}_{operation}"
+
+
+def load_output(path):
+    """
+    Open an output written by an OutputSink. Raw .npy outputs are memory-mapped read-only, so they are not copied or
+    decoded; other formats are decoded with OpenCV.
+
+    :param path: The path of the output file.
+    :return: The image as a NumPy array (a read-only memmap for .npy files), or None if it could not be read.
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    return cv2.imread(path, cv2.IMREAD_UNCHANGED)
+
+
+class OutputSink:
+    """
+    Decides where and how results are written: collision-free file names derived from the input and operation, the
+    output codec and its quality setting, and an optional pool of writer threads so encoding overlaps with compute.
+
+    Every output is written to a temporary file and renamed into place, so readers never see a partially written
+    file. The sink is thread-safe, and counts the outputs it has written in written.
+    """
+
+    def __init__(self, output_dir, format="jpg", quality=None, template=DEFAULT_TEMPLATE, writers=0):
+        """
+        :param output_dir: The directory the outputs are written to.
+        :param format: The output format: "jpg", "png", "webp" or "npy" (raw arrays that can be memory-mapped).
+        :param quality: The JPEG or WebP quality, or the PNG compression level; None keeps OpenCV's default.
+        :param template: The output name (without extension) as a format string with {input}, the input file stem,
+                         and {operation}, the operation name. Names only stay unique if {input} is part of it.
+        :param writers: The number of writer threads used by submit(); 0 writes on the calling thread.
+        """
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported output format: {format}")
+        if quality is not None:
+            if format not in QUALITY_RANGES:
+                raise ValueError(f"The {format} format has no quality setting")
+            low, high = QUALITY_RANGES[format]
+            if not low <= quality <= high:
+                raise ValueError(f"Quality for {format} must be between {low} and {high}")
+        try:
+            template.format(input="", operation="")
+        except (KeyError, IndexError, ValueError):
+            raise ValueError(f"Invalid name template: {template}")
+        self.output_dir = output_dir
+        self.format = format
+        self.quality = quality
+        self.template = template
+        self.extension, parameter = FORMATS[format]
+        self._params = [parameter, quality] if quality is not None else []
+        self.written = 0
+        self._lock = threading.Lock()
+        self._prefixes = {}
+        self._claimed = set()
+        self._pending = set()
+        self._executor = concurrent.futures.ThreadPoolExecutor(writers) if writers else None
+
+    @property
+    def encoding(self):
+        """
+        Identify the codec settings, e.g. to key cached outputs on them.
+        :return: A string such as "jpg" or "webp:quality=80".
+        """
+        return self.format if self.quality is None else f"{self.format}:quality={self.quality}"
+
+    def prefix(self, input_path):
+        """
+        Get the name prefix for an input: its file stem, or the stem plus a short hash of its absolute path if an
+        earlier input already took that stem (e.g. a/photo.jpg and b/photo.png). Prefixes are assigned in the order
+        inputs are first seen, so claim inputs in a stable order (see claim_all) to get the same names on every run.
+        :param input_path: The path of the input image.
+        :return: The prefix.
+        """
+        key = os.path.abspath(input_path)
+        with self._lock:
+            prefix = self._prefixes.get(key)
+            if prefix is None:
+                prefix = os.path.splitext(os.path.basename(input_path))[0]
+                if prefix in self._claimed:
+                    prefix = f"{prefix}-{make_key(key)[:8]}"
+                self._prefixes[key] = prefix
+                self._claimed.add(prefix)
+            return prefix
+
+    def assign(self, input_path, prefix):
+        """
+        Use a name prefix assigned elsewhere for an input, e.g. by a coordinator that saw the whole batch while this
+        process only sees part of it.
+        :param input_path: The path of the input image.
+        :param prefix: The prefix, from prefix() in the other process.
+        """
+        with self._lock:
+            self._prefixes[os.path.abspath(input_path)] = prefix
+            self._claimed.add(prefix)
+
+    def forget(self, input_path):
+        """
+        Drop the name prefix of an input and release it, e.g. once a long-lived worker has finished the input's job,
+        so the prefixes do not accumulate. A later prefix() call for the input assigns one afresh.
+        :param input_path: The path of the input image.
+        """
+        with self._lock:
+            prefix = self._prefixes.pop(os.path.abspath(input_path), None)
+            self._claimed.discard(prefix)
+
+    def claim_all(self, images):
+        """
+        Assign name prefixes to inputs lazily, in input order, before they are handed to concurrent workers.
+        :param images: An iterable of input paths.
+        :return: A generator of the same paths.
+        """
+        for image in images:
+            self.prefix(image)
+            yield image
+
+    def path(self, input_path, name, extension=None):
+        """
+        Build the output path of one result.
+        :param input_path: The path of the input image.
+        :param name: The operation name of the result.
+        :param extension: The file extension, if not the sink's own (e.g. ".mp4" for a video).
+        :return: The output path.
+        """
+        filename = self.template.format(input=self.prefix(input_path), operation=name) + (extension or self.extension)
+        return os.path.join(self.output_dir, filename)
+
+    def write(self, path, image):
+        """
+        Encode an image and save it atomically, on the calling thread.
+        :param path: The output path, from path().
+        :param image: The image as a NumPy array.
+        :return: Whether the image was written.
+        """
+        directory, filename = os.path.split(path)
+        temporary = os.path.join(directory, f".{filename}.{threading.get_ident()}.tmp")
+        if self.format == "npy":
+            with open(temporary, "wb") as output:
+                np.save(output, image)
+        else:
+            encoded, data = cv2.imencode(self.extension, image, self._params)
+            if not encoded:
+                return False
+            with open(temporary, "wb") as output:
+                output.write(data)
+        os.replace(temporary, path)
+        with self._lock:
+            self.written += 1
+        return True
+
+    def link(self, source, path):
+        """
+        Make an output share an existing file instead of writing it again: a hard link where the file system allows
+        it, a copy otherwise. The link also goes through a temporary name, so it replaces an old output atomically.
+        :param source: The existing file, e.g. the output of a duplicate input.
+        :param path: The output path, from path().
+        :return: Whether the output was linked or copied (False if the source does not exist).
+        """
+        if not os.path.exists(source):
+            return False
+        if os.path.exists(path) and os.path.samefile(source, path):
+            return True
+        directory, filename = os.path.split(path)
+        temporary = os.path.join(directory, f".{filename}.{threading.get_ident()}.tmp")
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        try:
+            os.link(source, temporary)
+        except OSError:
+            shutil.copyfile(source, temporary)
+        os.replace(temporary, path)
+        with self._lock:
+            self.written += 1
+        return True
+
+    def submit(self, function, *args):
+        """
+        Run a write on the writer threads, or immediately when the sink has none.
+        :param function: The callable doing the write, typically wrapping write().
+        :param args: Its arguments.
+        :return: A Future with the callable's result.
+        """
+        if self._executor is not None:
+            future = self._executor.submit(function, *args)
+            with self._lock:
+                self._pending.add(future)
+            future.add_done_callback(self._discard)
+            return future
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+    def _discard(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def flush(self):
+        """
+        Wait for every write submitted so far to finish.
+        """
+        with self._lock:
+            pending = list(self._pending)
+        concurrent.futures.wait(pending)
+
+    def close(self):
+        """
+        Wait for every submitted write to finish and stop the writer threads.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
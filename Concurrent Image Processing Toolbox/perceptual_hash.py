@@ -0,0 +1,255 @@
+#Libraries used
+import functools
+import json
+import sqlite3
+import threading
+from dataclasses import dataclass
+import cv2
+import numpy as np
+
+# Every hash is 64 bits: an 8x8 grid of brightness comparisons.
+HASH_BITS = 64
+
+
+def _grayscale(image):
+    if image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def _pack(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def average_hash(image):
+    """
+    Compute the average hash (aHash): the image shrunk to 8x8, each pixel compared with the mean brightness.
+
+    :param image: The image as a NumPy array, in color (BGR) or grayscale.
+    :return: The 64-bit hash as an int.
+    """
+    small = cv2.resize(_grayscale(image), (8, 8), interpolation=cv2.INTER_AREA).astype(np.float32)
+    return _pack(small > small.mean())
+
+
+def difference_hash(image):
+    """
+    Compute the difference hash (dHash): the image shrunk to 9x8, each pixel compared with its right neighbour.
+
+    :param image: The image as a NumPy array, in color (BGR) or grayscale.
+    :return: The 64-bit hash as an int.
+    """
+    small = cv2.resize(_grayscale(image), (9, 8), interpolation=cv2.INTER_AREA).astype(np.float32)
+    return _pack(small[:, 1:] > small[:, :-1])
+
+
+@functools.lru_cache(maxsize=None)
+def _dct_matrix(size):
+    """
+    The orthonormal DCT-II matrix, so that matrix @ block @ matrix.T is the 2-D DCT of a square block.
+    """
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+def perceptual_hash(image):
+    """
+    Compute the perceptual hash (pHash): the image shrunk to 32x32, transformed with a 2-D DCT, and the 8x8 lowest
+    frequencies compared with their median. It is the most robust of the three to recompression, resizing and
+    small brightness changes.
+
+    :param image: The image as a NumPy array, in color (BGR) or grayscale.
+    :return: The 64-bit hash as an int.
+    """
+    small = cv2.resize(_grayscale(image), (32, 32), interpolation=cv2.INTER_AREA).astype(np.float64)
+    matrix = _dct_matrix(32)
+    low = (matrix @ small @ matrix.T)[:8, :8]
+    return _pack(low > np.median(low.ravel()[1:]))
+
+
+# Hash functions by name.
+HASHES = {"ahash": average_hash, "dhash": difference_hash, "phash": perceptual_hash}
+
+
+def hamming_distance(first, second):
+    """
+    Count the bits in which two hashes differ.
+
+    :param first: A hash.
+    :param second: Another hash.
+    :return: The Hamming distance.
+    """
+    return (first ^ second).bit_count()
+
+
+def _split(value, widths):
+    """
+    Split a hash into consecutive bit fields of the given widths, most significant first.
+    """
+    fields = []
+    shift = HASH_BITS
+    for width in widths:
+        shift -= width
+        fields.append((value >> shift) & ((1 << width) - 1))
+    return fields
+
+
+def _signed(value):
+    # SQLite integers are signed 64-bit.
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+@dataclass
+class HashEntry:
+    """
+    An indexed image: its hash, its path and the outputs processing it produced, with its distance from a query.
+    """
+    id: int
+    hash: int
+    path: str
+    outputs: list
+    distance: int = 0
+
+
+class HashIndex:
+    """
+    A persistent index of image hashes with fast Hamming-radius queries, for finding near-duplicates among millions
+    of images.
+
+    It is a multi-index hash table: each hash is split into radius + 1 bit fields, each stored in its own indexed
+    column of an SQLite table. By the pigeonhole principle, two hashes that differ in at most radius bits agree
+    exactly on at least one field, so a query only fetches the rows sharing a field with it and checks their full
+    distance instead of scanning the table. Entries are grouped by workload (the operations and output encoding),
+    so only results of the same processing are matched. The index is thread-safe; additions are committed in
+    batches and on commit() or close().
+    """
+
+    def __init__(self, path, radius=4, algorithm="phash", commit_every=1000):
+        """
+        :param path: The path to the index file; it is created if missing.
+        :param radius: The largest Hamming distance that counts as a duplicate. A new index is built for it; an
+                       existing index accepts any radius up to the one it was built for.
+        :param algorithm: The hash function, "ahash", "dhash" or "phash"; it must match an existing index's.
+        :param commit_every: The number of additions committed at once.
+        """
+        if algorithm not in HASHES:
+            raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+        if not 0 <= radius < HASH_BITS // 4:
+            raise ValueError(f"The radius must be between 0 and {HASH_BITS // 4 - 1}")
+        self.path = path
+        self.radius = radius
+        self.algorithm = algorithm
+        self.hash = HASHES[algorithm]
+        self.commit_every = commit_every
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        meta = dict(self._connection.execute("SELECT key, value FROM meta"))
+        if not meta:
+            meta = {"algorithm": algorithm, "fields": str(radius + 1)}
+            self._connection.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+        if meta["algorithm"] != algorithm:
+            raise ValueError(f"The index at {path} holds {meta['algorithm']} hashes, not {algorithm}")
+        fields = int(meta["fields"])
+        if radius >= fields:
+            raise ValueError(f"The index at {path} supports a radius of at most {fields - 1}")
+        self._widths = [HASH_BITS // fields + (1 if i < HASH_BITS % fields else 0) for i in range(fields)]
+        self._columns = [f"f{i}" for i in range(fields)]
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS hashes (id INTEGER PRIMARY KEY, hash INTEGER NOT NULL, workload TEXT NOT NULL, "
+            f"path TEXT NOT NULL, outputs TEXT NOT NULL, {', '.join(f'{c} INTEGER NOT NULL' for c in self._columns)})")
+        for column in self._columns:
+            self._connection.execute(f"CREATE INDEX IF NOT EXISTS hashes_{column} ON hashes (workload, {column})")
+        self._connection.commit()
+        self._query = " UNION ".join(
+            f"SELECT id, hash, path, outputs FROM hashes WHERE workload = ? AND {column} = ?"
+            for column in self._columns)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def query(self, image_hash, workload, radius=None):
+        """
+        Find the indexed images within a Hamming radius of a hash.
+        :param image_hash: The hash to look up.
+        :param workload: The workload key the entries must have been added with.
+        :param radius: The largest distance returned (defaults to the index's radius).
+        :return: A list of HashEntry, nearest first.
+        """
+        radius = self.radius if radius is None else radius
+        if radius >= len(self._columns):
+            raise ValueError(f"The index supports a radius of at most {len(self._columns) - 1}")
+        parameters = []
+        for field in _split(image_hash, self._widths):
+            parameters += [workload, field]
+        with self._lock:
+            rows = self._connection.execute(self._query, parameters).fetchall()
+        matches = []
+        for entry_id, stored, path, outputs in rows:
+            distance = hamming_distance(image_hash, stored & ((1 << HASH_BITS) - 1))
+            if distance <= radius:
+                matches.append(HashEntry(entry_id, stored & ((1 << HASH_BITS) - 1), path, json.loads(outputs),
+                                         distance))
+        return sorted(matches, key=lambda match: match.distance)
+
+    def nearest(self, image_hash, workload):
+        """
+        Find the nearest indexed image within the index's radius.
+        :param image_hash: The hash to look up.
+        :param workload: The workload key.
+        :return: The nearest HashEntry, or None if there is none within the radius.
+        """
+        matches = self.query(image_hash, workload)
+        return matches[0] if matches else None
+
+    def add(self, image_hash, workload, path, outputs):
+        """
+        Add an image.
+        :param image_hash: Its hash.
+        :param workload: The workload key, e.g. the operation names and output encoding.
+        :param path: The path of the image.
+        :param outputs: The paths of the outputs processing it produces.
+        :return: The id of the new entry.
+        """
+        fields = _split(image_hash, self._widths)
+        with self._lock:
+            cursor = self._connection.execute(
+                f"INSERT INTO hashes (hash, workload, path, outputs, {', '.join(self._columns)}) "
+                f"VALUES (?, ?, ?, ?{', ?' * len(fields)})",
+                [_signed(image_hash), workload, path, json.dumps(outputs)] + fields)
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._connection.commit()
+                self._uncommitted = 0
+            return cursor.lastrowid
+
+    def discard(self, entry_id):
+        """
+        Remove an entry, e.g. because its outputs no longer exist.
+        :param entry_id: The id of the entry.
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM hashes WHERE id = ?", (entry_id,))
+            self._uncommitted += 1
+
+    def commit(self):
+        """
+        Save every pending addition and removal.
+        """
+        with self._lock:
+            self._connection.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        """
+        Save pending changes and close the index file.
+        """
+        self.commit()
+        self._connection.close()
@@ -0,0 +1,255 @@
+#Libraries used
+import hashlib
+import io
+import os
+import shutil
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """
+    Hash the contents of a file without decoding it.
+
+    :param path: The path to the file.
+    :param chunk_size: The number of bytes read at a time.
+    :return: The hex digest of the file contents.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_digest(data):
+    """
+    Hash encoded image bytes held in memory; the digest is the same as file_digest of a file with these contents.
+
+    :param data: A bytes-like object.
+    :return: The hex digest of the bytes.
+    """
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def array_digest(array):
+    """
+    Hash the shape, dtype and pixels of a NumPy array.
+
+    :param array: The array to hash.
+    :return: The hex digest of the array.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((array.shape, array.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+def make_key(*parts):
+    """
+    Combine the parts identifying a result (content hash, operation, parameters, versions) into a cache key.
+
+    :param parts: Strings identifying the result.
+    :return: The cache key as a hex string.
+    """
+    return hashlib.blake2b("\0".join(parts).encode(), digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """
+    A content-addressed store of processing results, bounded in size with least-recently-used eviction.
+
+    Results live in a directory on disk, one file per key, with an optional in-memory tier in front of it for the
+    most recently used entries. The disk index is rebuilt from file modification times on start-up, and every hit
+    refreshes the entry's modification time, so the LRU order survives restarts. The cache is thread-safe.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, memory_bytes=0, link_outputs=False):
+        """
+        :param directory: The directory holding the cached files; it is created if missing.
+        :param max_bytes: The maximum total size of the files on disk.
+        :param memory_bytes: The maximum total size of the in-memory tier (0 disables it).
+        :param link_outputs: Whether hits are hard-linked to their destination instead of copied. Only safe when
+                             nothing writes to the output files afterwards, since they share the cached data.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.link_outputs = link_outputs
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = self.misses = self.evictions = self.memory_hits = 0
+
+        files = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                info = entry.stat()
+                files.append((info.st_mtime, entry.name, info.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._size += size
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _lookup(self, name):
+        with self._lock:
+            if name in self._memory:
+                self._memory.move_to_end(name)
+                self.hits += 1
+                self.memory_hits += 1
+                return self._memory[name], True
+            if name not in self._entries:
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(name)
+            self.hits += 1
+        try:
+            os.utime(self._path(name))
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._entries.pop(name, 0)
+                self.hits -= 1
+                self.misses += 1
+            return None, False
+        return self._path(name), False
+
+    def _remember(self, name, value, size):
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if name in self._memory:
+                self._memory_size -= self._memory.pop(name)[1]
+            self._memory[name] = (value, size)
+            self._memory_size += size
+            while self._memory_size > self.memory_bytes:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_size -= evicted_size
+
+    def _store(self, name, write):
+        temporary = self._path(f".{name}.{threading.get_ident()}.tmp")
+        write(temporary)
+        os.replace(temporary, self._path(name))
+        size = os.path.getsize(self._path(name))
+
+        evicted = []
+        with self._lock:
+            self._size += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                evicted_name, evicted_size = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+                evicted.append(evicted_name)
+                if evicted_name in self._memory:
+                    self._memory_size -= self._memory.pop(evicted_name)[1]
+        for evicted_name in evicted:
+            try:
+                os.remove(self._path(evicted_name))
+            except FileNotFoundError:
+                pass
+
+    def fetch_file(self, key, destination, extension=""):
+        """
+        Materialize a cached file at the destination path if it is in the cache. The file is written (or linked) to a
+        temporary name next to the destination and renamed into place, so readers never see a partial output.
+
+        :param key: The cache key.
+        :param destination: The path to copy (or link) the cached file to.
+        :param extension: The file extension the entry was stored with.
+        :return: True on a hit, False on a miss.
+        """
+        value, in_memory = self._lookup(key + extension)
+        if value is None:
+            return False
+        directory, filename = os.path.split(destination)
+        temporary = os.path.join(directory, f".{filename}.{threading.get_ident()}.tmp")
+        if os.path.lexists(temporary):
+            os.remove(temporary)
+        if in_memory:
+            with open(temporary, "wb") as output:
+                output.write(value[0])
+        elif not (self.link_outputs and self._link(value, temporary)):
+            shutil.copyfile(value, temporary)
+        os.replace(temporary, destination)
+        return True
+
+    @staticmethod
+    def _link(source, destination):
+        try:
+            os.link(source, destination)
+            return True
+        except OSError:
+            return False
+
+    def store_file(self, key, source, extension=""):
+        """
+        Copy a produced file into the cache.
+
+        :param key: The cache key.
+        :param source: The path of the file to cache.
+        :param extension: The file extension to store the entry with.
+        """
+        self._store(key + extension, lambda temporary: shutil.copyfile(source, temporary))
+        if self.memory_bytes:
+            with open(source, "rb") as cached:
+                data = cached.read()
+            self._remember(key + extension, data, len(data))
+
+    def fetch_array(self, key):
+        """
+        Look up a cached NumPy array.
+
+        :param key: The cache key.
+        :return: The cached array (read-only when it comes from memory), or None on a miss.
+        """
+        value, in_memory = self._lookup(key + ".npy")
+        if value is None:
+            return None
+        if in_memory:
+            return value[0]
+        array = np.load(value)
+        self._remember(key + ".npy", array, array.nbytes)
+        return array
+
+    def store_array(self, key, array):
+        """
+        Store a NumPy array in the cache.
+
+        :param key: The cache key.
+        :param array: The array to cache.
+        """
+        buffer = io.BytesIO()
+        np.save(buffer, array)
+
+        def write(temporary):
+            with open(temporary, "wb") as output:
+                output.write(buffer.getbuffer())
+
+        self._store(key + ".npy", write)
+        if self.memory_bytes:
+            cached = array.copy()
+            cached.flags.writeable = False
+            self._remember(key + ".npy", cached, cached.nbytes)
+
+    def stats(self):
+        """
+        Report the cache counters.
+
+        :return: A dictionary with hits, misses, evictions, memory hits, entry count and size on disk.
+        """
+        with self._lock:
+            return {
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "cache_evictions": self.evictions,
+                "cache_memory_hits": self.memory_hits,
+                "cache_entries": len(self._entries),
+                "cache_mb": self._size / (1024 * 1024),
+            }
@@ -0,0 +1,438 @@
+#Libraries used
+import concurrent.futures
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from queue import PriorityQueue
+import cv2
+
+# Operation tasks are always picked before new images are decoded, so images already in memory are finished
+# before more are admitted.
+OPERATION_PRIORITY = 0
+DECODE_PRIORITY = 1
+
+
+def percentile(values, fraction):
+    """
+    Compute a nearest-rank percentile of a list of numbers.
+
+    :param values: The samples.
+    :param fraction: The percentile as a fraction between 0 and 1 (e.g. 0.99).
+    :return: The percentile value, or 0.0 if there are no samples.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+# The worker threads of every live scheduler or thread pool running OpenCV calls, by owner: (workers, requested
+# OpenCV threads or None). OpenCV's thread pool is process-wide, so it is sized from all of them together.
+_opencv_claims = {}
+_opencv_claims_lock = threading.Lock()
+
+
+def claim_opencv_threads(owner, workers, opencv_threads=None):
+    """
+    Register (or update) the worker threads of a scheduler or pool that runs OpenCV calls, and resize OpenCV's
+    process-wide thread pool so that the total number of workers * OpenCV threads does not exceed the number of
+    cores. An explicit opencv_threads is used as it is while its owner is the only one; alongside other owners it is
+    only an upper bound.
+
+    :param owner: Any hashable object identifying the claim, e.g. the scheduler.
+    :param workers: The number of threads of the owner that call into OpenCV.
+    :param opencv_threads: The number of OpenCV threads the owner asked for, or None for cores // workers.
+    :return: The number of OpenCV threads now in use.
+    """
+    with _opencv_claims_lock:
+        _opencv_claims[owner] = (workers, opencv_threads)
+        return _resize_opencv_threads()
+
+
+def release_opencv_threads(owner):
+    """
+    Drop the claim of a scheduler or pool that has stopped, and resize OpenCV's thread pool for the others.
+
+    :param owner: The object passed to claim_opencv_threads.
+    """
+    with _opencv_claims_lock:
+        if _opencv_claims.pop(owner, None) is not None:
+            _resize_opencv_threads()
+
+
+def _resize_opencv_threads():
+    cores = os.cpu_count() or 1
+    total = sum(workers for workers, _ in _opencv_claims.values())
+    requested = [threads for _, threads in _opencv_claims.values() if threads]
+    if len(_opencv_claims) == 1 and requested:
+        threads = requested[0]
+    else:
+        threads = min([max(1, cores // total) if total else cores] + requested)
+    cv2.setNumThreads(threads)
+    return threads
+
+
+class ThroughputStats:
+    """
+    Throughput and per-image latency counters for a set of images: everything a scheduler has run, or the images of
+    one job sharing a scheduler with others. The counters are thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = None
+        self._finished = None
+        self._images = 0
+        self._operations = 0
+        self._latencies = []
+
+    def submitted(self, when):
+        """
+        Record that an image was submitted.
+        :param when: The time.perf_counter() time of the submission.
+        """
+        with self._lock:
+            if self._started is None:
+                self._started = when
+
+    def operation_done(self):
+        """
+        Record that an operation has run.
+        """
+        with self._lock:
+            self._operations += 1
+
+    def image_done(self, submitted):
+        """
+        Record that an image has been fully processed.
+        :param submitted: The time.perf_counter() time the image was submitted.
+        """
+        with self._lock:
+            self._images += 1
+            self._finished = time.perf_counter()
+            self._latencies.append(self._finished - submitted)
+
+    def progress(self):
+        """
+        Report how much work has completed, without computing the latency statistics.
+        :return: A tuple of the number of images and the number of operations completed.
+        """
+        with self._lock:
+            return self._images, self._operations
+
+    def summary(self):
+        """
+        Summarize throughput, measured from the first submission to the last completed image, and per-image latency,
+        measured from submission to the completion of the image's last operation.
+        :return: A dictionary of statistics.
+        """
+        with self._lock:
+            elapsed = self._finished - self._started if self._finished is not None else 0.0
+            latencies = list(self._latencies)
+            images, operations = self._images, self._operations
+        return {
+            "images": images,
+            "operations": operations,
+            "elapsed_s": elapsed,
+            "images_per_s": images / elapsed if elapsed else 0.0,
+            "operations_per_s": operations / elapsed if elapsed else 0.0,
+            "p50_latency_ms": percentile(latencies, 0.50) * 1000,
+            "p99_latency_ms": percentile(latencies, 0.99) * 1000,
+        }
+
+
+class ImageScheduler:
+    """
+    A bounded pool of worker threads that runs (image, operation) tasks.
+
+    Each submitted image is decoded by one task, which then fans out one task per operation onto the same workers.
+    No task ever waits for another, so a single fixed set of threads serves every image. OpenCV's own thread pool
+    is process-wide, so it is sized from the workers of every live scheduler together (see claim_opencv_threads):
+    creating a scheduler does not reset it for the others, and the workers of all schedulers * OpenCV threads does
+    not exceed the number of cores. A scheduler releases its share on shutdown().
+
+    With a memory budget, images are only admitted for decoding while the bytes of decoded pixels plus the estimated
+    size of their pending operation outputs stay within the budget. Since an image's size is unknown until it is
+    decoded, admission reserves the largest charge seen so far and corrects it after decoding. One image is always
+    admitted when nothing else is in flight, so an image larger than the budget still gets processed.
+    """
+
+    def __init__(self, workers=None, opencv_threads=None, max_inflight_bytes=None, metrics=None):
+        """
+        :param workers: The number of worker threads (defaults to the number of CPUs).
+        :param opencv_threads: The number of threads OpenCV may use inside each call (defaults to cores // workers);
+                               while other schedulers are live it is only an upper bound.
+        :param max_inflight_bytes: The memory budget for images in flight, or None for no limit.
+        :param metrics: An optional Metrics collector that receives the time each task waits in the queue.
+        """
+        cores = os.cpu_count() or 1
+        self.workers = workers or cores
+        self.opencv_threads = claim_opencv_threads(self, self.workers, opencv_threads)
+
+        self._tasks = PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self.max_inflight_bytes = max_inflight_bytes
+        self.metrics = metrics
+        self._waiting = deque()
+        self._inflight_bytes = 0
+        self._inflight_images = 0
+        self._projected_bytes = 0
+        self._retiring = 0
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        self.reset_stats()
+
+    def _put(self, priority, task, on_error=None):
+        self._tasks.put((priority, next(self._sequence), task, time.perf_counter(), on_error))
+
+    def _worker(self):
+        while True:
+            priority, _, task, enqueued, on_error = self._tasks.get()
+            if task is None:
+                return
+            if self.metrics is not None:
+                kind = "decode" if priority == DECODE_PRIORITY else "operation"
+                self.metrics.observe("queue_wait", time.perf_counter() - enqueued, kind, start=enqueued)
+            # A task that raises must neither kill the worker nor leave its image's Future unresolved.
+            try:
+                task()
+            except BaseException as error:
+                try:
+                    if on_error is not None:
+                        on_error(error)
+                    else:
+                        print(f"Error: A scheduler task failed: {error}")
+                except BaseException as failure:
+                    print(f"Error: A scheduler task failed: {failure}")
+            with self._lock:
+                if self._retiring:
+                    self._retiring -= 1
+                    self._threads.remove(threading.current_thread())
+                    return
+
+    def _admit(self):
+        with self._lock:
+            admitted = []
+            while self._waiting and (self._inflight_images == 0 or (
+                    self._projected_bytes and
+                    self._inflight_bytes + self._projected_bytes <= self.max_inflight_bytes)):
+                task, charges, on_error = self._waiting.popleft()
+                charges["image"] = self._projected_bytes
+                self._inflight_bytes += self._projected_bytes
+                self._inflight_images += 1
+                self._peak_inflight_bytes = max(self._peak_inflight_bytes, self._inflight_bytes)
+                admitted.append((task, on_error))
+        for task, on_error in admitted:
+            self._put(DECODE_PRIORITY, task, on_error)
+
+    def _charge(self, nbytes, images=0):
+        with self._lock:
+            self._inflight_bytes += nbytes
+            self._inflight_images += images
+            self._peak_inflight_bytes = max(self._peak_inflight_bytes, self._inflight_bytes)
+        if nbytes < 0 or images < 0:
+            self._admit()
+
+    def submit_image(self, decode, operations, run, done=None, estimate=None, job_stats=None):
+        """
+        Schedule one image: decode it, then run every operation on it.
+
+        :param decode: A callable returning the decoded image, or None if it could not be read. It may instead return
+                       an (image, operations) tuple to replace the operations still to run, e.g. when some results
+                       were served from a cache; image is then only used if operations is not empty.
+        :param operations: The operations to apply to the image.
+        :param run: A callable run(operation, image) that applies and stores one operation.
+        :param done: An optional callable done(decoded) invoked on the worker, before the Future resolves, once the
+                     image has been fully processed without errors.
+        :param estimate: An optional callable estimate(operation, image) returning the expected size in bytes of the
+                         operation's output, charged against the memory budget until that operation has run.
+        :param job_stats: An optional ThroughputStats that the image is counted in as well as the scheduler's own
+                          counters, e.g. to report one job on a scheduler shared by several.
+        :return: A Future resolving to True once every operation has run, or False if the image could not be
+                 decoded. If any operation (or any other part of the image's tasks, such as estimate) raised, the
+                 Future holds the first exception.
+        """
+        future = concurrent.futures.Future()
+        submitted = time.perf_counter()
+        errors = []
+        remaining = [len(operations)]
+        charges = {}
+        budgeted = self.max_inflight_bytes is not None
+        counters = [self._stats] if job_stats is None else [self._stats, job_stats]
+        settled = [False]
+
+        def finish(decoded):
+            # An image is finished once: by its last operation, or early by a task that raised.
+            with self._lock:
+                if settled[0]:
+                    return
+                settled[0] = True
+            for stats in counters:
+                stats.image_done(submitted)
+            if not errors and done is not None:
+                try:
+                    done(decoded)
+                except BaseException as error:
+                    errors.append(error)
+            if budgeted:
+                # Charges of operations that will not run any more are released with the image.
+                released = sum(charges.values())
+                charges.clear()
+                self._charge(-released, images=-1)
+            if errors:
+                future.set_exception(errors[0])
+            else:
+                future.set_result(decoded)
+
+        def failed(error):
+            errors.append(error)
+            finish(False)
+
+        def run_operation(index, operation, image):
+            try:
+                run(operation, image)
+            except BaseException as error:
+                errors.append(error)
+            if budgeted:
+                self._charge(-charges.pop(index, 0))
+            for stats in counters:
+                stats.operation_done()
+            with self._lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                finish(True)
+
+        def decode_image():
+            if not future.set_running_or_notify_cancel():
+                if budgeted:
+                    self._charge(-charges.pop("image", 0), images=-1)
+                return
+            pending = operations
+            try:
+                image = decode()
+            except BaseException as error:
+                errors.append(error)
+                image = None
+            decoded = image is not None
+            if isinstance(image, tuple):
+                (image, pending), decoded = image, True
+                remaining[0] = len(pending)
+            if budgeted:
+                # The charges are only replaced once every estimate is in, so an estimate that raises leaves the
+                # reservation to be released by finish.
+                estimated = {index: estimate(operation, image) if estimate is not None else image.nbytes
+                             for index, operation in enumerate(pending if image is not None else ())}
+                reserved = charges["image"]
+                charges["image"] = image.nbytes if image is not None else 0
+                charges.update(estimated)
+                actual = sum(charges.values())
+                with self._lock:
+                    self._projected_bytes = max(self._projected_bytes, actual)
+                self._charge(actual - reserved)
+            if image is None or not pending:
+                finish(decoded)
+                return
+            for index, operation in enumerate(pending):
+                self._put(OPERATION_PRIORITY,
+                          lambda index=index, operation=operation: run_operation(index, operation, image), failed)
+
+        for stats in counters:
+            stats.submitted(submitted)
+        if budgeted:
+            self._waiting.append((decode_image, charges, failed))
+            self._admit()
+        else:
+            self._put(DECODE_PRIORITY, decode_image, failed)
+        return future
+
+    def set_concurrency(self, workers, opencv_threads=None):
+        """
+        Change the number of worker threads and OpenCV threads while tasks are running. New threads start right away;
+        surplus threads exit once they finish their current task.
+
+        :param workers: The new number of worker threads.
+        :param opencv_threads: The new number of threads OpenCV may use inside each call (defaults to cores // workers);
+                               while other schedulers are live it is only an upper bound.
+        """
+        with self._lock:
+            self.opencv_threads = claim_opencv_threads(self, workers, opencv_threads)
+            change = workers - self.workers
+            self.workers = workers
+            added = []
+            if change < 0:
+                self._retiring -= change
+            else:
+                # Threads that were about to retire are kept before any new ones are started.
+                kept = min(self._retiring, change)
+                self._retiring -= kept
+                added = [threading.Thread(target=self._worker, daemon=True) for _ in range(change - kept)]
+                self._threads.extend(added)
+        for thread in added:
+            thread.start()
+
+    def progress(self):
+        """
+        Report how much work has completed, without computing the latency statistics.
+
+        :return: A tuple of the number of images and the number of operations completed since the last reset.
+        """
+        return self._stats.progress()
+
+    def reset_stats(self):
+        """
+        Clear the throughput and latency counters.
+        """
+        with self._lock:
+            self._stats = ThroughputStats()
+            self._peak_inflight_bytes = self._inflight_bytes
+
+    def stats(self, job_stats=None):
+        """
+        Report throughput and per-image latency since the last reset, or for the images of one job.
+
+        Throughput is measured from the first submission to the last completed image. Latency is measured from submission to the completion of the image's last operation, so it includes the
+        time spent waiting for a worker.
+        :param job_stats: The ThroughputStats the job's images were submitted with, or None for every image.
+        :return: A dictionary of statistics; the peak memory in flight is only reported for the whole scheduler.
+        """
+        stats = {"workers": self.workers, "opencv_threads": self.opencv_threads}
+        stats.update((job_stats or self._stats).summary())
+        if self.max_inflight_bytes is not None and job_stats is None:
+            with self._lock:
+                stats["peak_inflight_mb"] = self._peak_inflight_bytes / (1024 * 1024)
+        return stats
+
+    def shutdown(self):
+        """
+        Stop the workers once every task already queued has run.
+        """
+        with self._lock:
+            threads = list(self._threads)
+        for _ in threads:
+            self._put(DECODE_PRIORITY + 1, None)
+        for thread in threads:
+            thread.join()
+        release_opencv_threads(self)
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Return the process-wide scheduler shared by every caller that does not bring its own, creating it on first use.
+
+    :return: The shared ImageScheduler.
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = ImageScheduler()
+        return _default_scheduler
@@ -0,0 +1,64 @@
+#Libraries used
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+
+def share_array(array, hand_off=False):
+    """
+    Copy a NumPy array into a new shared memory block so another process can attach to it without pickling the pixels.
+
+    :param array: The array to share (typically a decoded image).
+    :param hand_off: Whether ownership of the block passes to another process. The block is then dropped from this
+                     process's resource tracker, so it is not unlinked when this process exits and the receiver
+                     becomes responsible for unlinking it.
+    :return: A tuple (block, ref) where block is the SharedMemory owning the data and ref is a small picklable
+             (name, shape, dtype) descriptor that can be sent to other processes.
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    del view
+    if hand_off:
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def attach_array(ref, take_ownership=False):
+    """
+    Attach to a shared memory block created by share_array and wrap it in a NumPy array without copying.
+
+    The caller must drop every reference to the returned array before calling close() on the block.
+
+    :param ref: The (name, shape, dtype) descriptor returned by share_array.
+    :param take_ownership: Whether this process will unlink the block. Borrowers are kept out of the resource
+                           tracker so that their exit does not destroy a block still owned by another process.
+    :return: A tuple (array, block) with the zero-copy array view and the attached SharedMemory.
+    """
+    name, shape, dtype = ref
+    block = shared_memory.SharedMemory(name=name)
+    if not take_ownership:
+        resource_tracker.unregister(block._name, "shared_memory")
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf), block
+
+
+def release_array(block, unlink=False):
+    """
+    Close a shared memory block and optionally free the underlying segment.
+
+    :param block: The SharedMemory returned by share_array or attach_array.
+    :param unlink: Whether to destroy the segment; only the final owner should do this.
+    """
+    block.close()
+    if unlink:
+        block.unlink()
+
+
+def unlink_array(ref):
+    """
+    Free a shared memory block handed off to this process without looking at its contents, e.g. a result that will
+    not be written because its image failed or the batch was interrupted.
+
+    :param ref: The (name, shape, dtype) descriptor returned by share_array.
+    """
+    _, block = attach_array(ref, take_ownership=True)
+    release_array(block, unlink=True)
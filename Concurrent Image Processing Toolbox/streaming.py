@@ -0,0 +1,101 @@
+#Libraries used
+import glob
+import os
+import sys
+import threading
+import time
+from queue import Queue
+
+_DONE = object()
+
+
+def iter_inputs(sources, stdin=None):
+    """
+    Lazily expand input sources into image paths, so a huge job can start before every path is known.
+
+    Each source may be a directory (its files are listed in directory order), a glob pattern, "-" to read one path
+    per line from standard input, or a plain file path.
+
+    :param sources: An iterable of source strings.
+    :param stdin: The stream to read "-" from (defaults to sys.stdin).
+    :return: A generator of image paths.
+    """
+    for source in sources:
+        if source == "-":
+            for line in stdin or sys.stdin:
+                path = line.strip()
+                if path:
+                    yield path
+        elif os.path.isdir(source):
+            with os.scandir(source) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        yield entry.path
+        elif glob.has_magic(source):
+            yield from glob.iglob(source, recursive=True)
+        else:
+            yield source
+
+
+def run_stages(items, stages, queue_size=16, on_wait=None):
+    """
+    Run items through a chain of producer/consumer stages connected by bounded queues.
+
+    Every stage has its own pool of worker threads. A stage function receives one item and returns an iterable of
+    items for the next stage (an empty one drops the item); the output of the last stage is discarded. Because the
+    queues are bounded, a slow stage blocks the stages before it instead of letting work pile up in memory, and the
+    input iterable is only consumed as fast as the first stage accepts items.
+
+    :param items: An iterable of input items; it is consumed lazily.
+    :param stages: A list of (name, function, workers) tuples.
+    :param queue_size: The capacity of each queue between stages.
+    :param on_wait: An optional callable on_wait(stage_name, seconds, enqueued) told how long each item waited in
+                    the queue in front of a stage.
+    :return: A dictionary mapping each stage name to the number of items it processed.
+    """
+    queues = [Queue(maxsize=queue_size) for _ in stages] + [None]
+    processed = {name: 0 for name, _, _ in stages}
+    lock = threading.Lock()
+    running = [workers for _, _, workers in stages]
+
+    def worker(index, name, function):
+        inbox, outbox = queues[index], queues[index + 1]
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            enqueued, item = item
+            if on_wait is not None:
+                on_wait(name, time.perf_counter() - enqueued, enqueued)
+            try:
+                for output in function(item) or ():
+                    if outbox is not None:
+                        outbox.put((time.perf_counter(), output))
+            except Exception as error:
+                print(f"Error: {name} stage failed: {error}")
+            with lock:
+                processed[name] += 1
+
+        with lock:
+            running[index] -= 1
+            last = running[index] == 0
+        if last and outbox is not None:
+            for _ in range(stages[index + 1][2]):
+                outbox.put(_DONE)
+
+    threads = []
+    for index, (name, function, workers) in enumerate(stages):
+        for _ in range(workers):
+            thread = threading.Thread(target=worker, args=(index, name, function), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+    try:
+        for item in items:
+            queues[0].put((time.perf_counter(), item))
+    finally:
+        for _ in range(stages[0][2]):
+            queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+    return processed
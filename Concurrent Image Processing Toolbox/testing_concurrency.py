@@ -1,32 +1,86 @@
 #Libraries used
+import contextlib
+import math
+import io
+import json
 import unittest
+from unittest import mock
 import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
 import cv2
 import numpy as np
-from main import apply_operation, ImageOperation
+import autotune
+from buffer_pool import BufferPool
+import concurrent_image_processing
+import convolution
+import distributed
+import image_header
+from broker import JobQueue
+from concurrent_image_processing import (adapt_to_decode, apply_chain, apply_operation, decode_image, ImageOperation,
+                                         parse_chain, parse_operation_spec, plan_decode)
+from manifest import Manifest
+from metrics import Metrics
+from output_sink import load_output, OutputSink
+from perceptual_hash import HashIndex
+from result_cache import ResultCache
+from scheduler import ImageScheduler
+import toolbox_daemon
+from toolbox_client import send_request, submit_job
+from video import VideoOutput
+
+# The sample images shipped with the toolbox.
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Images")
+
+
+def make_inputs(directory, count=3, shape=(96, 128, 3)):
+    """
+    Write a few small random images to a directory.
+    :return: The list of their paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    generator = np.random.default_rng(0)
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"input{index}.png")
+        cv2.imwrite(path, generator.integers(0, 256, shape, dtype=np.uint8))
+        paths.append(path)
+    return paths
+
+
+def shared_segments():
+    """
+    List the POSIX shared memory segments, or an empty set where /dev/shm does not exist.
+    """
+    return set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+
 
 class TestImageProcessing(unittest.TestCase):
     def setUp(self):
-        self.input_image = cv2.imread('test_image.jpg', cv2.IMREAD_COLOR)
+        self.input_image = cv2.imread(os.path.join(IMAGES_DIR, 'image2.jpg'), cv2.IMREAD_COLOR)
         self.assertIsNotNone(self.input_image, "Test image not found.")
 
     def test_resize_image(self):
         """
         Test the resize_image operation by comparing the output image's dimensions
-        with the expected dimensions after resizing.
+        with the expected dimensions after resizing (OpenCV rounds to the nearest pixel).
         """
         output_image = apply_operation(ImageOperation.RESIZE, self.input_image, scale_x=0.5, scale_y=0.5)
         self.assertIsNotNone(output_image)
-        self.assertEqual(output_image.shape, (int(self.input_image.shape[0] * 0.5), int(self.input_image.shape[1] * 0.5), 3))
+        self.assertEqual(output_image.shape, (round(self.input_image.shape[0] * 0.5), round(self.input_image.shape[1] * 0.5), 3))
 
     def test_rotate_image(self):
         """
         Test the rotate_image operation by comparing the output image's dimensions
-        with the expected dimensions after rotation.
+        with the expected dimensions after rotation (the image is rotated within its own frame).
         """
         output_image = apply_operation(ImageOperation.ROTATE, self.input_image, angle=90)
         self.assertIsNotNone(output_image)
-        self.assertEqual(output_image.shape, (self.input_image.shape[1], self.input_image.shape[0], 3))
+        self.assertEqual(output_image.shape, self.input_image.shape)
 
     def test_blur_image(self):
         """
@@ -52,7 +106,7 @@ class TestImageProcessing(unittest.TestCase):
         and has the same dimensions as the input image.
         """
         kernel = np.array([[1, 1, 1], [1, -8, 1], [1, 1, 1]], dtype=np.float32)
-        output_image = apply_operation(ImageOperation.IMAGE_FILTERING, self.input_image, kernel=kernel)
+        output_image = apply_operation(ImageOperation.FILTER, self.input_image, kernel=kernel)
         self.assertIsNotNone(output_image)
         self.assertEqual(output_image.shape, self.input_image.shape)
 
@@ -61,7 +115,7 @@ class TestImageProcessing(unittest.TestCase):
         Test the image_thresholding operation by checking if the output image is not None
         and has the same dimensions as the input image.
         """
-        output_image = apply_operation(ImageOperation.IMAGE_THRESHOLDING, self.input_image, threshold=128, max_value=255)
+        output_image = apply_operation(ImageOperation.THRESHOLD, self.input_image, threshold_value=128)
         self.assertIsNotNone(output_image)
         self.assertEqual(output_image.shape, self.input_image.shape)
 
@@ -70,9 +124,1051 @@ class TestImageProcessing(unittest.TestCase):
         Test the morphological_operations (e.g., erosion) by checking if the output image
         is not None and has the same dimensions as the input image.
         """
-        output_image = apply_operation(ImageOperation.MORPHOLOGICAL_OPERATIONS, self.input_image, operation="erode", kernel_size=3, iterations=1)
+        output_image = apply_operation(ImageOperation.EROSION, self.input_image, kernel_size=3, iterations=1)
         self.assertIsNotNone(output_image)
         self.assertEqual(output_image.shape, self.input_image.shape)
 
+    def test_quality_range_per_format(self):
+        """
+        Test that --quality is checked against the range of the chosen format.
+        """
+        parser = concurrent_image_processing.build_parser()
+        with tempfile.TemporaryDirectory() as directory:
+            for format, quality, valid in (("jpg", 0, True), ("jpg", 100, True), ("jpg", 101, False),
+                                           ("png", 9, True), ("png", 10, False), ("webp", 1, True),
+                                           ("webp", 0, False), ("npy", 50, False)):
+                with self.subTest(format=format, quality=quality):
+                    if valid:
+                        self.assertEqual(OutputSink(directory, format, quality).quality, quality)
+                        continue
+                    with self.assertRaises(ValueError):
+                        OutputSink(directory, format, quality)
+                    args = parser.parse_args(["input.png", directory, "--format", format, "--quality", str(quality)])
+                    with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                        concurrent_image_processing.run_job(args, parser)
+
+    def test_npy_output_is_memory_mapped(self):
+        """
+        Test that npy outputs hold the exact result and are loaded as read-only memory maps.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            with contextlib.redirect_stdout(io.StringIO()):
+                concurrent_image_processing.process_images([os.path.join(IMAGES_DIR, 'image2.jpg')], directory,
+                                                           [ImageOperation.BLUR], sink=OutputSink(directory, "npy"))
+            output = load_output(os.path.join(directory, "image2_blur.npy"))
+            self.assertIsInstance(output, np.memmap)
+            self.assertFalse(output.flags.writeable)
+            self.assertTrue(np.array_equal(output, apply_operation(ImageOperation.BLUR, self.input_image)))
+
+    def test_duplicate_basenames_get_hash_prefix(self):
+        """
+        Test that inputs sharing a file name get distinct outputs, the later one with a short path hash.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            inputs = [make_inputs(os.path.join(directory, folder), count=1)[0] for folder in ("a", "b")]
+            output_dir = os.path.join(directory, "outputs")
+            os.makedirs(output_dir)
+            with contextlib.redirect_stdout(io.StringIO()):
+                concurrent_image_processing.process_images(inputs, output_dir, [ImageOperation.BLUR], workers=1)
+            sink = OutputSink(output_dir)
+            expected = [os.path.basename(sink.path(image, "blur")) for image in sink.claim_all(inputs)]
+            self.assertEqual(expected[0], "input0_blur.jpg")
+            self.assertRegex(expected[1], r"^input0-[0-9a-f]{8}_blur\.jpg$")
+            self.assertEqual(sorted(os.listdir(output_dir)), sorted(expected))
+
+
+class TestTiling(unittest.TestCase):
+    """
+    Tiled processing must match whole-image processing bit for bit, whatever the tile size.
+    """
+
+    def setUp(self):
+        self.image = np.random.default_rng(1).integers(0, 256, (301, 437, 3), dtype=np.uint8)
+        self.operations = [parse_operation_spec(text) for text in (
+            "blur:kernel_size=7", "filter", "filter:kernel=laplacian", "threshold",
+            "erosion:kernel_size=5:iterations=2", "dilation:shape=ellipse")]
+
+    def test_tiled_matches_whole_image(self):
+        for operation in self.operations:
+            expected = apply_operation(operation, self.image)
+            for tile_size in (32, 100, 1024):
+                with self.subTest(operation=operation, tile_size=tile_size):
+                    result = concurrent_image_processing.apply_operation_tiled(operation, self.image, tile_size)
+                    self.assertTrue(np.array_equal(result, expected))
+
+    def test_memory_mapped_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "blur.npy")
+            out = np.lib.format.open_memmap(path, mode="w+", dtype=self.image.dtype, shape=self.image.shape)
+            concurrent_image_processing.apply_operation_tiled(ImageOperation.BLUR, self.image, 64, out=out)
+            out.flush()
+            del out
+            self.assertTrue(np.array_equal(np.load(path), apply_operation(ImageOperation.BLUR, self.image)))
+
+    def test_concurrent_calls_share_tile_threads(self):
+        def run():
+            concurrent_image_processing.apply_operation_tiled(ImageOperation.BLUR, self.image, 32)
+
+        callers = [threading.Thread(target=run) for _ in range(4)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        tile_threads = [thread for thread in threading.enumerate() if thread.name.startswith("tile")]
+        self.assertLessEqual(len(tile_threads), os.cpu_count() or 1)
+
+
+class TestPointOperationFusion(unittest.TestCase):
+    """
+    Point operations on uint8 images run as lookup tables; the results must match the original OpenCV operations.
+    """
+
+    def setUp(self):
+        self.image = np.random.default_rng(2).integers(0, 256, (64, 80, 3), dtype=np.uint8)
+
+    def test_threshold_matches_opencv(self):
+        for threshold_value in (0, 1, 127, 127.5, 254, 255):
+            with self.subTest(threshold_value=threshold_value):
+                _, expected = cv2.threshold(self.image, threshold_value, 255, cv2.THRESH_BINARY)
+                result = apply_operation(ImageOperation.THRESHOLD, self.image, threshold_value=threshold_value)
+                self.assertTrue(np.array_equal(result, expected))
+
+    def test_contrast_brightness_matches_opencv(self):
+        for contrast, brightness in ((1.5, 50.0), (0.5, -20.0), (2.7, 3.3), (-1.0, 255.0), (1.0, 0.0)):
+            with self.subTest(contrast=contrast, brightness=brightness):
+                expected = cv2.addWeighted(self.image, contrast, np.zeros_like(self.image), 0, brightness)
+                result = apply_operation(ImageOperation.CONTRAST_BRIGHTNESS, self.image, contrast=contrast,
+                                         brightness=brightness)
+                self.assertTrue(np.array_equal(result, expected))
+
+    def test_fused_chain_matches_steps(self):
+        chain = parse_chain("contrast_brightness:contrast=1.3:brightness=-10,threshold:threshold_value=90,"
+                            "contrast_brightness:contrast=0.5:brightness=40")
+        expected = cv2.addWeighted(self.image, 1.3, self.image, 0, -10)
+        _, expected = cv2.threshold(expected, 90, 255, cv2.THRESH_BINARY)
+        expected = cv2.addWeighted(expected, 0.5, expected, 0, 40)
+        self.assertTrue(np.array_equal(concurrent_image_processing.apply_chain(chain, self.image), expected))
+
+
+class TestResultCache(unittest.TestCase):
+    """
+    A second run over unchanged inputs must be served from the cache, with the same outputs.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.inputs = make_inputs(os.path.join(self.directory, "inputs"))
+        self.operations = [ImageOperation.BLUR, parse_chain("resize,threshold"), ImageOperation.PYRAMID]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_batch(self, name, cache):
+        output_dir = os.path.join(self.directory, name)
+        os.makedirs(output_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            concurrent_image_processing.process_images(self.inputs, output_dir, self.operations, workers=1,
+                                                       cache=cache)
+        outputs = {}
+        for filename in sorted(os.listdir(output_dir)):
+            with open(os.path.join(output_dir, filename), "rb") as output:
+                outputs[filename] = output.read()
+        return outputs
+
+    def test_second_run_hits(self):
+        cache = ResultCache(os.path.join(self.directory, "cache"))
+        first = self.run_batch("first", cache)
+        # blur, resize+threshold and three pyramid levels per input.
+        self.assertEqual(len(first), 3 * 5)
+        self.assertEqual((cache.stats()["cache_hits"], cache.stats()["cache_misses"]), (0, 15))
+        second = self.run_batch("second", ResultCache(os.path.join(self.directory, "cache")))
+        self.assertEqual(second, first)
+
+    def test_hits_skip_decode(self):
+        cache = ResultCache(os.path.join(self.directory, "cache"))
+        self.run_batch("first", cache)
+        decode = concurrent_image_processing.decode_image
+        decoded = []
+        concurrent_image_processing.decode_image = lambda *args: decoded.append(args) or decode(*args)
+        try:
+            self.run_batch("second", cache)
+        finally:
+            concurrent_image_processing.decode_image = decode
+        self.assertEqual(decoded, [])
+        self.assertEqual(cache.stats()["cache_hits"], 15)
+
+    def test_changed_input_misses(self):
+        cache = ResultCache(os.path.join(self.directory, "cache"))
+        self.run_batch("first", cache)
+        cv2.imwrite(self.inputs[0], np.zeros((96, 128, 3), np.uint8))
+        self.run_batch("second", cache)
+        self.assertEqual((cache.stats()["cache_hits"], cache.stats()["cache_misses"]), (10, 20))
+
+    def test_array_results(self):
+        cache = ResultCache(os.path.join(self.directory, "cache"), memory_bytes=1024 * 1024)
+        image = cv2.imread(self.inputs[0])
+        expected = apply_operation(ImageOperation.BLUR, image)
+        for _ in range(2):
+            result = concurrent_image_processing.apply_operation_cached(cache, ImageOperation.BLUR, image)
+            self.assertTrue(np.array_equal(result, expected))
+        self.assertEqual((cache.stats()["cache_hits"], cache.stats()["cache_memory_hits"]), (1, 1))
+
+    def test_memory_hit_replaces_destination(self):
+        cache = ResultCache(os.path.join(self.directory, "cache"), memory_bytes=1024 * 1024)
+        cache.store_file("key", self.inputs[0], ".png")
+        # A memory hit must replace the destination, not write through an existing link to another file.
+        output_dir = os.path.join(self.directory, "outputs")
+        os.makedirs(output_dir)
+        destination = os.path.join(output_dir, "output.png")
+        os.link(self.inputs[1], destination)
+        with open(self.inputs[1], "rb") as other:
+            other_bytes = other.read()
+        self.assertTrue(cache.fetch_file("key", destination, ".png"))
+        self.assertEqual(cache.stats()["cache_memory_hits"], 1)
+        with open(self.inputs[0], "rb") as source, open(destination, "rb") as output:
+            self.assertEqual(output.read(), source.read())
+        with open(self.inputs[1], "rb") as other:
+            self.assertEqual(other.read(), other_bytes)
+        self.assertEqual(os.listdir(output_dir), ["output.png"])
+
+
+class TestManifest(unittest.TestCase):
+    """
+    Inputs the manifest records as processed, unchanged and with their outputs in place are skipped.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.inputs = make_inputs(os.path.join(self.directory, "inputs"))
+        self.output_dir = os.path.join(self.directory, "outputs")
+        os.makedirs(self.output_dir)
+        self.manifest_path = os.path.join(self.directory, "manifest.jsonl")
+        self.operations = [ImageOperation.BLUR, ImageOperation.CANNY]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_batch(self, inputs, prune=False):
+        """
+        :return: The paths of the inputs processed (not skipped) by the run.
+        """
+        report = io.StringIO()
+        with contextlib.redirect_stdout(report):
+            concurrent_image_processing.process_images(inputs, self.output_dir, self.operations, workers=1,
+                                                       manifest=self.manifest_path, prune=prune)
+        prefix = "Image processing completed successfully for: "
+        return sorted(line[len(prefix):] for line in report.getvalue().splitlines() if line.startswith(prefix))
+
+    def test_unchanged_inputs_are_skipped(self):
+        self.assertEqual(self.run_batch(self.inputs), sorted(self.inputs))
+        self.assertEqual(len(Manifest(self.manifest_path)), 3)
+        self.assertEqual(self.run_batch(self.inputs), [])
+
+    def test_interrupted_batch_resumes(self):
+        self.run_batch(self.inputs[:2])
+        self.assertEqual(self.run_batch(self.inputs), [self.inputs[2]])
+
+    def test_changed_input_or_missing_output_is_reprocessed(self):
+        self.run_batch(self.inputs)
+        cv2.imwrite(self.inputs[0], np.zeros((96, 128, 3), np.uint8))
+        os.remove(os.path.join(self.output_dir, "input1_canny.jpg"))
+        self.assertEqual(self.run_batch(self.inputs), sorted(self.inputs[:2]))
+
+    def test_touched_input_is_skipped(self):
+        self.run_batch(self.inputs)
+        os.utime(self.inputs[0], (0, 0))
+        self.assertEqual(self.run_batch(self.inputs), [])
+
+    def test_prune(self):
+        self.run_batch(self.inputs)
+        self.run_batch(self.inputs[1:], prune=True)
+        self.assertEqual(len(Manifest(self.manifest_path)), 2)
+        self.assertEqual(sorted(os.listdir(self.output_dir)),
+                         sorted(f"input{index}_{name}.jpg" for index in (1, 2) for name in ("blur", "canny")))
+
+
+class TestBatching(unittest.TestCase):
+    """
+    Batched processing must give the same results as processing each image on its own.
+    """
+
+    def setUp(self):
+        generator = np.random.default_rng(3)
+        self.images = [generator.integers(0, 256, shape, dtype=np.uint8)
+                       for shape in ((64, 80, 3), (64, 80, 3), (50, 70, 3), (64, 80, 3))]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_batch_matches_per_image(self):
+        operations = list(ImageOperation) + [parse_chain("resize,threshold,blur")]
+        for operation in operations:
+            results = concurrent_image_processing.apply_operation_batch(operation, self.images)
+            for image, result in zip(self.images, results):
+                with self.subTest(operation=operation):
+                    expected = concurrent_image_processing.apply_chain(operation, image) \
+                        if isinstance(operation, tuple) else apply_operation(operation, image)
+                    if isinstance(expected, list):
+                        self.assertEqual(len(result), len(expected))
+                        self.assertTrue(all(np.array_equal(level, want) for level, want in zip(result, expected)))
+                    else:
+                        self.assertTrue(np.array_equal(result, expected))
+
+    def test_batch_backend_matches_thread_backend(self):
+        inputs = make_inputs(os.path.join(self.directory, "inputs"), count=5)
+        operations = [ImageOperation.THRESHOLD, ImageOperation.BLUR, parse_chain("resize,canny"),
+                      ImageOperation.PYRAMID]
+        outputs = {}
+        for backend in ("thread", "batch"):
+            output_dir = os.path.join(self.directory, backend)
+            os.makedirs(output_dir)
+            with contextlib.redirect_stdout(io.StringIO()):
+                concurrent_image_processing.process_images(inputs, output_dir, operations, backend=backend,
+                                                           workers=1, batch_size=2)
+            outputs[backend] = {}
+            for filename in sorted(os.listdir(output_dir)):
+                with open(os.path.join(output_dir, filename), "rb") as output:
+                    outputs[backend][filename] = output.read()
+        self.assertEqual(len(outputs["thread"]), 5 * 6)
+        self.assertEqual(outputs["batch"], outputs["thread"])
+
+
+class TestProcessBackend(unittest.TestCase):
+    """
+    The process backend must write the same results as the thread backend.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pyramid_matches_thread_backend(self):
+        # Images smaller than the 1024 and 512 levels, so those levels are the input itself.
+        inputs = make_inputs(os.path.join(self.directory, "inputs"), count=2, shape=(300, 400, 3))
+        operations = [ImageOperation.PYRAMID, ImageOperation.BLUR]
+        outputs = {}
+        for backend in ("thread", "process"):
+            output_dir = os.path.join(self.directory, backend)
+            os.makedirs(output_dir)
+            with contextlib.redirect_stdout(io.StringIO()):
+                concurrent_image_processing.process_images(inputs, output_dir, operations, backend=backend,
+                                                           workers=1, sink=OutputSink(output_dir, "npy"))
+            outputs[backend] = {filename: np.load(os.path.join(output_dir, filename))
+                                for filename in sorted(os.listdir(output_dir))}
+        self.assertEqual(len(outputs["thread"]), 2 * 4)
+        self.assertEqual(list(outputs["process"]), list(outputs["thread"]))
+        for filename, expected in outputs["thread"].items():
+            with self.subTest(output=filename):
+                self.assertTrue(np.array_equal(outputs["process"][filename], expected))
+        self.assertTrue(np.array_equal(outputs["process"]["input0_pyramid_1024.npy"], cv2.imread(inputs[0])))
+
+
+class TestJobStats(unittest.TestCase):
+    """
+    Jobs sharing a warm scheduler, as in the daemon, must each report their own images.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.scheduler = ImageScheduler(2)
+        self.parser = concurrent_image_processing.build_parser()
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+        shutil.rmtree(self.directory)
+
+    def run_job(self, name, count):
+        inputs = make_inputs(os.path.join(self.directory, name), count=count)
+        args = self.parser.parse_args(inputs + [os.path.join(self.directory, f"{name}_out"), "-o", "blur", "--stats"])
+        return concurrent_image_processing.run_job(args, self.parser, scheduler=self.scheduler)
+
+    def test_consecutive_jobs(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(self.run_job("first", 3)["images"], 3)
+            stats = self.run_job("second", 2)
+        self.assertEqual((stats["images"], stats["operations"]), (2, 2))
+        self.assertEqual(self.scheduler.stats()["images"], 5)
+
+    def test_concurrent_jobs(self):
+        results = {}
+
+        def run(name, count):
+            results[name] = self.run_job(name, count)["images"]
+
+        jobs = [threading.Thread(target=run, args=(f"job{count}", count)) for count in (2, 5)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for job in jobs:
+                job.start()
+            for job in jobs:
+                job.join()
+        self.assertEqual(results, {"job2": 2, "job5": 5})
+
+
+class TestVideoOutput(unittest.TestCase):
+    """
+    A video writer that fails to open must fail every frame, not only the first.
+    """
+
+    def test_open_failure_is_kept(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = VideoOutput(os.path.join(directory, "missing", "video.avi"), 25)
+            frame = np.zeros((32, 32, 3), np.uint8)
+            self.assertEqual([output.write(frame) for _ in range(3)], [False] * 3)
+            self.assertTrue(output.failed)
+            self.assertEqual(output.frames, 0)
+            output.close()
+
+
+class TestBroker(unittest.TestCase):
+    """
+    Jobs whose lease runs out without a heartbeat must go back to the queue, until they use up their attempts.
+    """
+
+    def make_queue(self, count, **options):
+        queue = JobQueue(":memory:", **options)
+        batch = queue.create_batch({})
+        queue.submit(batch, [[f"input{index}.png", None] for index in range(count)])
+        return queue, batch
+
+    def test_expired_lease_is_reclaimed(self):
+        queue, batch = self.make_queue(2, lease_seconds=0.05)
+        jobs = queue.lease("first", 2)
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual(queue.lease("second", 2), [])
+        time.sleep(0.1)
+        reclaimed = queue.lease("second", 2)
+        self.assertEqual([job["id"] for job in reclaimed], [job["id"] for job in jobs])
+        self.assertEqual([job["attempts"] for job in reclaimed], [2, 2])
+        self.assertEqual(queue.heartbeat("first", [job["id"] for job in jobs]), [])
+        for job in reclaimed:
+            queue.complete(job["id"], [])
+        self.assertEqual(queue.progress(batch)["done"], 2)
+
+    def test_heartbeat_renews_lease(self):
+        queue, batch = self.make_queue(1, lease_seconds=0.3)
+        job_ids = [job["id"] for job in queue.lease("first", 1)]
+        time.sleep(0.2)
+        self.assertEqual(queue.heartbeat("first", job_ids), job_ids)
+        time.sleep(0.2)
+        self.assertEqual(queue.lease("second", 1), [])
+        self.assertEqual(queue.progress(batch)["leased"], 1)
+
+    def test_attempts_are_limited(self):
+        queue, batch = self.make_queue(1, lease_seconds=0.05, max_attempts=2)
+        for worker in ("first", "second"):
+            self.assertEqual(len(queue.lease(worker, 1)), 1)
+            time.sleep(0.1)
+        self.assertEqual(queue.lease("third", 1), [])
+        progress = queue.progress(batch)
+        self.assertEqual((progress["pending"], progress["failed"]), (0, 1))
+        self.assertEqual(progress["errors"], [["input0.png", "lease expired"]])
+
+    def test_worker_forgets_finished_inputs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            inputs = make_inputs(os.path.join(directory, "inputs"))
+            queue = JobQueue(":memory:")
+            output_dir = os.path.join(directory, "outputs")
+            batch, queued = distributed.submit_batch(queue, inputs, output_dir, [ImageOperation.BLUR])
+            scheduler = ImageScheduler(1)
+            worker = distributed.Worker(queue, "worker", scheduler)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    worker.run(exit_when_idle=True, idle_wait=0.01)
+            finally:
+                scheduler.shutdown()
+            self.assertEqual((queued, queue.progress(batch)["done"]), (3, 3))
+            self.assertEqual(sorted(os.listdir(output_dir)), [f"input{index}_blur.jpg" for index in range(3)])
+            self.assertEqual([sink._prefixes for sink in worker._sinks.values()], [{}])
+
+
+class TestDaemon(unittest.TestCase):
+    """
+    The daemon must report every input of a job that could not be processed, over its socket.
+    """
+
+    def test_partial_job(self):
+        with tempfile.TemporaryDirectory() as directory:
+            good = make_inputs(os.path.join(directory, "inputs"), count=1)[0]
+            bad = os.path.join(directory, "inputs", "broken.png")
+            with open(bad, "wb") as broken:
+                broken.write(b"not an image")
+            address = os.path.join(directory, "daemon.sock")
+            server = threading.Thread(target=toolbox_daemon.serve,
+                                      args=(address, toolbox_daemon.ToolboxDaemon(workers=1)))
+            with contextlib.redirect_stdout(io.StringIO()):
+                server.start()
+                try:
+                    for _ in range(100):
+                        if os.path.exists(address):
+                            break
+                        time.sleep(0.05)
+                    response = submit_job([good, bad, "outputs", "-o", "blur"], address, cwd=directory)
+                finally:
+                    send_request(address, {"command": "shutdown"})
+                    server.join()
+            self.assertEqual(response["status"], "partial")
+            self.assertEqual([failure["input"] for failure in response["failed"]], [bad])
+            self.assertIn("Could not open the image file", response["failed"][0]["errors"][0])
+            self.assertEqual(os.listdir(os.path.join(directory, "outputs")), ["input0_blur.jpg"])
+
+
+class TestScheduler(unittest.TestCase):
+    """
+    The scheduler must resolve every image's Future and keep its workers alive whatever a task raises.
+    """
+
+    def setUp(self):
+        self.image = np.zeros((8, 8, 3), np.uint8)
+
+    def test_failing_task_resolves_future(self):
+        def estimate(operation, image):
+            raise RuntimeError("estimate failed")
+
+        # An estimate that raises under a memory budget, and a malformed decode result without one; both escape
+        # the decode task's own error handling.
+        for budget, decode, error in ((1024 * 1024, lambda: self.image, RuntimeError),
+                                      (None, lambda: (self.image,), ValueError)):
+            with self.subTest(max_inflight_bytes=budget):
+                scheduler = ImageScheduler(1, max_inflight_bytes=budget)
+                try:
+                    failing = scheduler.submit_image(decode, ["op"], lambda operation, image: None,
+                                                     estimate=estimate)
+                    self.assertIsInstance(failing.exception(timeout=5), error)
+                    ran = []
+                    working = scheduler.submit_image(lambda: self.image, ["a", "b"],
+                                                     lambda operation, image: ran.append(operation))
+                    self.assertTrue(working.result(timeout=5))
+                    self.assertEqual(sorted(ran), ["a", "b"])
+                    self.assertEqual(scheduler._inflight_bytes, 0)
+                finally:
+                    scheduler.shutdown()
+
+    def run_budgeted(self, budget, count):
+        # Every image is 64x64x3 and each of its two operations is estimated at the size of the image.
+        scheduler = ImageScheduler(4, max_inflight_bytes=budget)
+        observed = []
+
+        def run(operation, image):
+            observed.append(scheduler._inflight_bytes)
+            time.sleep(0.005)
+
+        try:
+            futures = [scheduler.submit_image(lambda: np.zeros((64, 64, 3), np.uint8), ["a", "b"], run,
+                                              estimate=lambda operation, image: image.nbytes)
+                       for _ in range(count)]
+            self.assertTrue(all(future.result(timeout=10) for future in futures))
+            self.assertEqual(len(observed), 2 * count)
+            self.assertEqual(scheduler._inflight_bytes, 0)
+            return scheduler.stats()["peak_inflight_mb"] * 1024 * 1024, observed
+        finally:
+            scheduler.shutdown()
+
+    def test_memory_budget_bounds_inflight_bytes(self):
+        image_bytes = 3 * 64 * 64 * 3
+        budget = 5 * image_bytes // 2
+        peak, observed = self.run_budgeted(budget, 20)
+        self.assertLessEqual(peak, budget)
+        self.assertLessEqual(max(observed), budget)
+        # The budget holds two images at a time.
+        self.assertGreater(peak, image_bytes)
+
+    def test_image_over_budget_is_admitted_alone(self):
+        image_bytes = 3 * 64 * 64 * 3
+        peak, observed = self.run_budgeted(1024, 5)
+        self.assertLessEqual(peak, image_bytes)
+        self.assertLessEqual(max(observed), image_bytes)
+
+    def test_thread_backend_reads_inputs_lazily(self):
+        directory = tempfile.mkdtemp()
+        scheduler = ImageScheduler(1)
+        release = threading.Event()
+        try:
+            inputs = make_inputs(os.path.join(directory, "inputs"), count=8, shape=(16, 16, 3))
+            os.makedirs(os.path.join(directory, "outputs"))
+            # Hold the only worker, so no submitted image can finish until the event is set.
+            blocker = scheduler.submit_image(lambda: release.wait() and self.image, ["op"],
+                                             lambda operation, image: None)
+            consumed = []
+
+            def stream():
+                for image in inputs:
+                    consumed.append(image)
+                    yield image
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                runner = threading.Thread(target=concurrent_image_processing.process_images,
+                                          args=(stream(), os.path.join(directory, "outputs"),
+                                                [ImageOperation.BLUR]),
+                                          kwargs={"scheduler": scheduler})
+                runner.start()
+                time.sleep(0.3)
+                # Two images in flight per worker, plus the one waiting for a free slot.
+                self.assertEqual(len(consumed), 3)
+                release.set()
+                runner.join()
+            self.assertTrue(blocker.result(timeout=5))
+            self.assertEqual(len(consumed), 8)
+            self.assertEqual(len(os.listdir(os.path.join(directory, "outputs"))), 8)
+        finally:
+            release.set()
+            scheduler.shutdown()
+            shutil.rmtree(directory)
+
+    def test_schedulers_share_opencv_threads(self):
+        # A new scheduler must not reset OpenCV's process-wide thread pool for the live ones, and shutting one down
+        # hands its share back.
+        previous = cv2.getNumThreads()
+        try:
+            with mock.patch("os.cpu_count", return_value=64):
+                first = ImageScheduler(4)
+                alone = cv2.getNumThreads()
+                second = ImageScheduler(4, opencv_threads=32)
+                self.assertLessEqual(cv2.getNumThreads(), 64 // 8)
+                self.assertLess(cv2.getNumThreads(), alone)
+                second.shutdown()
+                self.assertEqual(cv2.getNumThreads(), alone)
+                first.shutdown()
+        finally:
+            cv2.setNumThreads(previous)
+
+    def test_failing_done_callback_resolves_future(self):
+        scheduler = ImageScheduler(1)
+        try:
+            def done(decoded):
+                raise ValueError("done failed")
+
+            future = scheduler.submit_image(lambda: self.image, ["op"], lambda operation, image: None, done)
+            self.assertIsInstance(future.exception(timeout=5), ValueError)
+            self.assertEqual(scheduler.stats()["images"], 1)
+        finally:
+            scheduler.shutdown()
+
+
+class TestProcessArrays(unittest.TestCase):
+    """
+    In-memory inputs, decoded or encoded, yield every (index, operation) result once; undecodable ones are skipped.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        image = rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)
+        self.items = [image, cv2.imencode(".jpg", image)[1].tobytes(), b"not an image",
+                      cv2.imencode(".png", image[::-1])[1], image[:, ::-1].copy()]
+        # The decoded inputs, by index.
+        self.decoded = {index: item if isinstance(item, np.ndarray) and item.ndim > 1
+                        else cv2.imdecode(np.frombuffer(item, np.uint8), cv2.IMREAD_COLOR)
+                        for index, item in enumerate(self.items) if index != 2}
+        self.operations = [ImageOperation.BLUR, ImageOperation.PYRAMID]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_mixed_inputs(self):
+        scheduler = ImageScheduler(2)
+        try:
+            for cache in (None, ResultCache(self.directory, memory_bytes=1024 * 1024)):
+                for attempt in range(1 if cache is None else 2):
+                    with self.subTest(cache=cache is not None, attempt=attempt):
+                        output = io.StringIO()
+                        with contextlib.redirect_stdout(output):
+                            results = list(concurrent_image_processing.process_arrays(
+                                iter(self.items), self.operations, scheduler=scheduler, cache=cache, max_pending=2))
+                        self.assertIn("Could not decode the image at index 2", output.getvalue())
+                        pairs = [(index, operation) for index, operation, _ in results]
+                        self.assertEqual(len(pairs), len(set(pairs)))
+                        self.assertEqual(set(pairs), {(index, operation) for index in self.decoded
+                                                      for operation in self.operations})
+                        for index, operation, result in results:
+                            expected = apply_operation(operation, self.decoded[index])
+                            if operation == ImageOperation.PYRAMID:
+                                self.assertEqual(len(result), len(expected))
+                                for level, expected_level in zip(result, expected):
+                                    self.assertTrue(np.array_equal(level, expected_level))
+                            else:
+                                self.assertTrue(np.array_equal(result, expected))
+            self.assertGreater(cache.stats()["cache_hits"], 0)
+        finally:
+            scheduler.shutdown()
+
+
+class TestDedupe(unittest.TestCase):
+    """
+    The hash index finds entries within its radius only, and near-duplicate inputs get links to earlier outputs.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "index.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_radius_lookup(self):
+        index = HashIndex(self.path, radius=3)
+        try:
+            base = 0x0123456789ABCDEF
+            index.add(base, "blur|.jpg", "original.png", ["original_blur.jpg"])
+            # Both still share the field of bits 32-47 with the entry, so it is fetched and its distance checked.
+            at_radius = base ^ (1 << 0) ^ (1 << 20) ^ (1 << 63)
+            beyond = at_radius ^ (1 << 1)
+            self.assertEqual([(match.path, match.distance) for match in index.query(at_radius, "blur|.jpg")],
+                             [("original.png", 3)])
+            self.assertEqual(index.nearest(at_radius, "blur|.jpg").outputs, ["original_blur.jpg"])
+            self.assertIsNone(index.nearest(beyond, "blur|.jpg"))
+            self.assertIsNone(index.nearest(base, "resize|.jpg"))
+        finally:
+            index.close()
+
+    def test_larger_radius_rejected(self):
+        HashIndex(self.path, radius=2).close()
+        with self.assertRaises(ValueError):
+            HashIndex(self.path, radius=3)
+        index = HashIndex(self.path, radius=1)
+        self.assertEqual(index.radius, 1)
+        index.close()
+
+    def test_recompressed_copy_is_linked(self):
+        inputs = os.path.join(self.directory, "inputs")
+        output_dir = os.path.join(self.directory, "outputs")
+        os.makedirs(inputs)
+        os.makedirs(output_dir)
+        rng = np.random.default_rng(0)
+        image = cv2.GaussianBlur(rng.integers(0, 256, (120, 160, 3), dtype=np.uint8), (0, 0), 6)
+        cv2.imwrite(os.path.join(inputs, "original.png"), image)
+        cv2.imwrite(os.path.join(inputs, "copy.jpg"), image, [cv2.IMWRITE_JPEG_QUALITY, 60])
+        parser = concurrent_image_processing.build_parser()
+        args = parser.parse_args([os.path.join(inputs, "original.png"), os.path.join(inputs, "copy.jpg"),
+                                  output_dir, "-o", "blur", "threshold", "--dedupe-index", self.path])
+        with contextlib.redirect_stdout(io.StringIO()):
+            concurrent_image_processing.run_job(args, parser)
+        for name in ("blur", "threshold"):
+            with self.subTest(operation=name):
+                original = os.stat(os.path.join(output_dir, f"original_{name}.jpg"))
+                copy = os.stat(os.path.join(output_dir, f"copy_{name}.jpg"))
+                self.assertEqual((copy.st_dev, copy.st_ino), (original.st_dev, original.st_ino))
+
+
+class TestBufferPool(unittest.TestCase):
+    """
+    Same-sized batches stop allocating once the pool is warm, and free buffers stay within the byte cap.
+    """
+
+    def test_second_pass_reuses_buffers(self):
+        directory = tempfile.mkdtemp()
+        pool = BufferPool()
+        try:
+            inputs = make_inputs(os.path.join(directory, "inputs"), count=4)
+            operations = [ImageOperation.BLUR, parse_chain("resize,threshold")]
+            allocations = []
+            for name in ("first", "second"):
+                output_dir = os.path.join(directory, name)
+                os.makedirs(output_dir)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    concurrent_image_processing.process_images(inputs, output_dir, operations, workers=1,
+                                                               buffer_pool=pool)
+                self.assertEqual(len(os.listdir(output_dir)), 8)
+                allocations.append(pool.stats()["buffer_pool_allocations"])
+            self.assertGreater(allocations[0], 0)
+            self.assertEqual(allocations[1], allocations[0])
+            self.assertGreater(pool.stats()["buffer_pool_reuses"], 0)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_eviction_at_byte_cap(self):
+        pool = BufferPool(max_bytes=2 * 1000)
+        buffers = [pool.acquire((10, 100), np.uint8) for _ in range(2)] + [pool.acquire((100, 10), np.uint8),
+                                                                            pool.acquire((1000,), np.uint8)]
+        for buffer in buffers:
+            pool.release(buffer)
+        # Both (10, 100) buffers, the least recently released shape, were evicted to stay within the cap.
+        self.assertEqual(pool.stats()["buffer_pool_evictions"], 2)
+        self.assertEqual(pool.stats()["buffer_pool_free_mb"] * 1024 * 1024, 2 * 1000)
+        pool.acquire((1000,), np.uint8)
+        pool.acquire((100, 10), np.uint8)
+        pool.acquire((10, 100), np.uint8)
+        self.assertEqual((pool.stats()["buffer_pool_reuses"], pool.stats()["buffer_pool_allocations"]), (2, 5))
+        # A buffer larger than the whole cap is never kept.
+        pool.release(np.empty(3000, np.uint8))
+        self.assertEqual(pool.stats()["buffer_pool_evictions"], 3)
+
+
+def exif_segment(orientation):
+    """
+    Build an APP1 Exif segment holding only an orientation tag.
+    """
+    tiff = b"II" + struct.pack("<HIH", 42, 8, 1) + struct.pack("<HHIHHI", 0x0112, 3, 1, orientation, 0, 0)
+    payload = b"Exif\x00\x00" + tiff
+    return b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+
+
+class TestReducedDecode(unittest.TestCase):
+    """
+    JPEG sizes are read from the header, and a reduced decode gives the same output shapes as a full one.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.path = os.path.join(self.directory, "photo.jpg")
+        cv2.imwrite(self.path, cv2.GaussianBlur(rng.integers(0, 256, (403, 610, 3), dtype=np.uint8), (0, 0), 3))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_jpeg_size(self):
+        self.assertEqual(image_header.jpeg_size(self.path), (403, 610))
+        with open(self.path, "rb") as image:
+            data = image.read()
+        rotated = os.path.join(self.directory, "rotated.jpg")
+        with open(rotated, "wb") as image:
+            image.write(data[:2] + exif_segment(6) + data[2:])
+        self.assertEqual(image_header.jpeg_size(rotated), (610, 403))
+        self.assertEqual(cv2.imread(rotated).shape[:2], (610, 403))
+        self.assertIsNone(image_header.jpeg_size(make_inputs(os.path.join(self.directory, "png"), count=1)[0]))
+
+    def test_reduced_decode_keeps_output_shape(self):
+        for text in ("resize:scale_x=0.1:scale_y=0.1", "resize:scale_x=0.1:scale_y=0.1,threshold"):
+            with self.subTest(operation=text):
+                operation = parse_chain(text) if "," in text else parse_operation_spec(text)
+                apply = apply_chain if isinstance(operation, tuple) else apply_operation
+                plan = plan_decode([operation])
+                self.assertEqual(plan, (8, "threshold" in text))
+                image, full_size = decode_image(self.path, plan)
+                self.assertEqual(full_size, (403, 610))
+                self.assertLess(image.shape[0], 403)
+                expected = apply(operation, cv2.imread(self.path))
+                result = apply(adapt_to_decode(operation, full_size, image.shape), image)
+                self.assertEqual(result.shape[:2], expected.shape[:2])
+
+    def test_full_decode_without_leading_downscale(self):
+        for operations in ([parse_chain("blur,resize:scale_x=0.1:scale_y=0.1")],
+                           [parse_operation_spec("resize:scale_x=0.6:scale_y=0.6")],
+                           [parse_operation_spec("resize:scale_x=0.1:scale_y=0.1"), ImageOperation.BLUR]):
+            with self.subTest(operations=operations):
+                factor, _ = plan_decode(operations)
+                self.assertEqual(factor, 1)
+                image, full_size = decode_image(self.path, plan_decode(operations))
+                self.assertEqual(image.shape[:2], full_size)
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    A traced job exports parseable Prometheus histograms and Chrome trace events for every stage.
+    """
+
+    def test_exports(self):
+        directory = tempfile.mkdtemp()
+        try:
+            inputs = make_inputs(os.path.join(directory, "inputs"))
+            output_dir = os.path.join(directory, "outputs")
+            os.makedirs(output_dir)
+            metrics = Metrics(trace=True)
+            with contextlib.redirect_stdout(io.StringIO()):
+                concurrent_image_processing.process_images(inputs, output_dir, [ImageOperation.BLUR,
+                                                                                ImageOperation.THRESHOLD],
+                                                           workers=1, metrics=metrics)
+            metrics.write_prometheus(os.path.join(directory, "metrics.prom"))
+            metrics.write_chrome_trace(os.path.join(directory, "trace.json"))
+
+            with open(os.path.join(directory, "metrics.prom")) as exposition:
+                lines = exposition.read().splitlines()
+            sample = re.compile(r'^(\w+)\{((?:\w+="[^"]*",?)*)\} (\S+)$')
+            series = {}
+            for line in lines:
+                if line.startswith("#"):
+                    continue
+                match = sample.match(line)
+                self.assertIsNotNone(match, line)
+                labels = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2)))
+                value = float(match.group(3))
+                key = (labels["stage"], labels["operation"], labels["size"])
+                series.setdefault(key, {}).setdefault(match.group(1), []).append(value)
+            for key, samples in series.items():
+                buckets = samples["image_toolbox_stage_seconds_bucket"]
+                self.assertEqual(buckets, sorted(buckets), key)
+                self.assertEqual(buckets[-1], samples["image_toolbox_stage_seconds_count"][0], key)
+            counts = {}
+            for (stage, operation, _), samples in series.items():
+                counts[stage, operation] = counts.get((stage, operation), 0) + \
+                    samples["image_toolbox_stage_seconds_count"][0]
+            self.assertEqual(counts["decode", ""], 3)
+            for operation in ("blur", "threshold"):
+                self.assertEqual(counts["operation", operation], 3)
+                self.assertEqual(counts["encode", operation], 3)
+
+            with open(os.path.join(directory, "trace.json")) as trace:
+                events = json.load(trace)["traceEvents"]
+            self.assertTrue(events)
+            self.assertTrue(all(event["ph"] == "X" and event["dur"] >= 0 for event in events))
+            names = {event["name"] for event in events}
+            self.assertTrue({"decode", "operation:blur", "operation:threshold", "encode:blur", "encode:threshold"}
+                            <= names, names)
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestAutotune(unittest.TestCase):
+    """
+    The hill climber settles on the fastest configuration, and a saved profile is where the next run starts.
+    """
+
+    @staticmethod
+    def throughput(workers, opencv_threads):
+        # Peaks at 4 workers x 2 OpenCV threads and falls off with every doubling or halving away from it.
+        return 100 / (1 + abs(math.log2(workers / 4)) + abs(math.log2(opencv_threads / 2)))
+
+    def climb(self, climber):
+        config, trials = climber.current, 0
+        while config is not None:
+            config = climber.record(self.throughput(*config))
+            trials += 1
+            self.assertLessEqual(trials, climber.max_trials)
+        return trials
+
+    def test_hill_climber_converges(self):
+        climber = autotune.HillClimber((1, 1), cores=8, max_workers=16)
+        trials = self.climb(climber)
+        self.assertTrue(climber.settled)
+        self.assertEqual((climber.best, climber.current), ((4, 2), (4, 2)))
+        self.assertEqual(len(climber.measured), trials)
+        self.assertEqual(climber.best_rate, 100)
+
+    def test_hill_climber_stops_after_max_trials(self):
+        climber = autotune.HillClimber((1, 1), cores=8, max_workers=16, max_trials=3)
+        self.assertEqual(self.climb(climber), 3)
+        self.assertTrue(climber.settled)
+        self.assertEqual(climber.current, climber.best)
+
+    def test_profile_is_reused(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "profile.json")
+            self.assertIsNone(autotune.load_profile(path, "blur"))
+            autotune.save_profile(path, "blur", {"workers": 3, "opencv_threads": 1, "outputs_per_s": 50.0})
+            autotune.save_profile(path, "threshold", {"workers": 2, "opencv_threads": 1, "outputs_per_s": 80.0})
+            self.assertEqual(autotune.load_profile(path, "blur")["workers"], 3)
+            with open(path) as profile:
+                saved = profile.read()
+
+            inputs = make_inputs(os.path.join(directory, "inputs"))
+            parser = concurrent_image_processing.build_parser()
+            args = parser.parse_args(inputs + [os.path.join(directory, "outputs"), "-o", "blur", "--profile", path])
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                stats = concurrent_image_processing.run_job(args, parser)
+            # The run starts on the profiled configuration instead of tuning again.
+            self.assertEqual((stats["workers"], stats["opencv_threads"], stats["images"]), (3, 1, 3))
+            self.assertNotIn("Autotuned", output.getvalue())
+            with open(path) as profile:
+                self.assertEqual(profile.read(), saved)
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestConvolution(unittest.TestCase):
+    """
+    Every convolution path must match cv2.filter2D, borders included, and be counted when taken.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.image = rng.integers(0, 256, (61, 83, 3), dtype=np.uint8)
+        self.rng = rng
+        self.threshold = (convolution._fft_threshold, convolution._calibrated)
+
+    def tearDown(self):
+        convolution._fft_threshold, convolution._calibrated = self.threshold
+
+    def check_path(self, kernel, path):
+        before = convolution.path_counts()
+        result = convolution.convolve(self.image, kernel)
+        after = convolution.path_counts()
+        expected = cv2.filter2D(self.image, -1, kernel)
+        self.assertEqual({name: after[name] - before[name] for name in after},
+                         {name: int(name == f"filter_{path}") for name in after})
+        difference = np.abs(result.astype(np.int16) - expected)
+        border = max(kernel.shape)
+        for region in (difference[:border], difference[-border:], difference[:, :border], difference[:, -border:],
+                       difference):
+            self.assertLessEqual(int(region.max()), 1)
+
+    def test_rank_one_kernel_is_separable(self):
+        column = self.rng.random((9, 1))
+        kernel = (column @ self.rng.random((1, 11))).astype(np.float32)
+        kernel /= kernel.sum()
+        self.assertEqual(convolution.choose_path(kernel), "separable")
+        self.check_path(kernel, "separable")
+
+    def test_non_separable_kernel(self):
+        kernel = self.rng.random((11, 11)).astype(np.float32)
+        kernel /= kernel.sum()
+        convolution.set_fft_threshold(11)
+        self.check_path(kernel, "fft")
+        convolution.set_fft_threshold(None)
+        self.check_path(kernel, "direct")
+
+    def test_small_kernel_is_direct(self):
+        convolution.set_fft_threshold(1)
+        column = self.rng.random((7, 1))
+        # Rank 1 and at the FFT threshold, but below DIRECT_KERNEL_AREA.
+        kernel = (column @ column.T).astype(np.float32)
+        self.assertLess(kernel.size, convolution.DIRECT_KERNEL_AREA)
+        kernel /= kernel.sum()
+        self.check_path(kernel, "direct")
+
+
+class TestOperationFailures(unittest.TestCase):
+    """
+    An operation that raises on an image must not stop the batch: the image's other outputs are still written,
+    the error is reported, and the image is not recorded as completed.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.inputs = make_inputs(os.path.join(self.directory, "inputs"))
+        # The failing blur shares its resize with a chain that succeeds.
+        self.operations = [parse_operation_spec("blur:kernel_size=0"), ImageOperation.CANNY,
+                           parse_chain("resize,blur:kernel_size=0"), parse_chain("resize,canny")]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_backend(self, backend, **options):
+        output_dir = os.path.join(self.directory, backend)
+        os.makedirs(output_dir)
+        manifest = Manifest(os.path.join(self.directory, f"{backend}.manifest"))
+        report = io.StringIO()
+        with contextlib.redirect_stdout(report):
+            concurrent_image_processing.process_images(self.inputs, output_dir, self.operations, backend=backend,
+                                                       workers=1, manifest=manifest, **options)
+        return output_dir, manifest, report.getvalue()
+
+    def check_failure(self, backend, **options):
+        output_dir, manifest, report = self.run_backend(backend, **options)
+        self.assertEqual(sorted(os.listdir(output_dir)),
+                         sorted(f"input{index}_{name}.jpg" for index in range(3) for name in ("canny", "resize+canny")))
+        self.assertEqual(report.count("Error: blur_kernel_size=0 failed on"), 3)
+        self.assertEqual(report.count("Error: resize+blur_kernel_size=0 failed on"), 3)
+        self.assertEqual(len(manifest), 0)
+
+    def test_thread_backend(self):
+        self.check_failure("thread")
+
+    def test_pipeline_backend(self):
+        self.check_failure("pipeline")
+
+    def test_batch_backend(self):
+        self.check_failure("batch", batch_size=2)
+
+    def test_process_backend(self):
+        segments = shared_segments()
+        self.check_failure("process")
+        self.assertEqual(shared_segments() - segments, set())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,97 @@
+#Libraries used
+import concurrent.futures
+import os
+import threading
+import numpy as np
+
+
+def iter_tiles(shape, tile_size):
+    """
+    Split an image shape into a grid of tiles.
+
+    :param shape: The shape of the image.
+    :param tile_size: The edge length of each tile in pixels (edge tiles may be smaller).
+    :return: A generator of (row_start, row_end, col_start, col_end) tuples.
+    """
+    rows, cols = shape[:2]
+    for row in range(0, rows, tile_size):
+        for col in range(0, cols, tile_size):
+            yield row, min(row + tile_size, rows), col, min(col + tile_size, cols)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _tile_executor():
+    """
+    Return the process-wide pool that runs tiles, creating it on first use. It has one thread per core and is
+    shared by every tiled call, so concurrent calls (e.g. from several scheduler workers) never run more tile
+    threads than there are cores.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1,
+                                                              thread_name_prefix="tile")
+        return _executor
+
+
+def _forget_executor():
+    # A forked process (e.g. a worker of the process backend) inherits the pool object but none of its threads.
+    global _executor, _executor_lock
+    _executor, _executor_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_executor)
+
+
+def tiled_apply(function, image, halo, tile_size=1024, out=None, workers=None):
+    """
+    Apply a shape-preserving neighbourhood operation to an image tile by tile, in parallel.
+
+    Each tile is extended by halo pixels on every side that lies inside the image, the function runs on that
+    extended view, and only the tile's own region of the result is copied into the output. As long as halo is at
+    least the operation's reach, every output pixel sees exactly the same neighbourhood as in a whole-image call,
+    and image edges still get the operation's own border handling, so the result is identical to function(image).
+
+    :param function: A callable taking an image and returning a result of the same shape and dtype.
+    :param image: The input image as a NumPy array (may be a memory-mapped array).
+    :param halo: The number of overlapping pixels each tile needs from its neighbours.
+    :param tile_size: The edge length of each tile in pixels.
+    :param out: An optional preallocated output array with the same shape and dtype as the image, e.g. a
+                memory-mapped .npy file from np.lib.format.open_memmap for a result too large to hold in memory.
+    :param workers: The maximum number of this call's tiles processed at once (defaults to the number of CPUs).
+                    Tiles run on a pool of one thread per core shared by all calls, so callers running side by side
+                    should each pass their share of the cores.
+    :return: The output array.
+    """
+    if out is None:
+        out = np.empty_like(image)
+    rows, cols = image.shape[:2]
+
+    def run_tile(tile):
+        row_start, row_end, col_start, col_end = tile
+        top, left = max(row_start - halo, 0), max(col_start - halo, 0)
+        bottom, right = min(row_end + halo, rows), min(col_end + halo, cols)
+        result = function(np.ascontiguousarray(image[top:bottom, left:right]))
+        out[row_start:row_end, col_start:col_end] = result[row_start - top:row_end - top,
+                                                           col_start - left:col_end - left]
+
+    executor = _tile_executor()
+    limit = max(1, workers or os.cpu_count() or 1)
+    pending = set()
+    try:
+        for tile in iter_tiles(image.shape, tile_size):
+            if len(pending) >= limit:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(executor.submit(run_tile, tile))
+        for future in concurrent.futures.as_completed(pending):
+            future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        concurrent.futures.wait(pending)
+    return out
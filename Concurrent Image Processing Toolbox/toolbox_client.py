@@ -0,0 +1,100 @@
+#Libraries used
+import json
+import os
+import socket
+import sys
+import tempfile
+
+# Where the daemon listens unless told otherwise; overridden by the IMAGE_TOOLBOX_DAEMON environment variable.
+DEFAULT_ADDRESS = os.environ.get("IMAGE_TOOLBOX_DAEMON", os.path.join(tempfile.gettempdir(), "image_toolbox.sock"))
+
+
+def parse_address(text):
+    """
+    Interpret a daemon address: "host:port" for local TCP, anything else as the path of a Unix domain socket.
+
+    :param text: The address.
+    :return: A (family, address) tuple for socket.socket and connect/bind.
+    """
+    host, _, port = text.rpartition(":")
+    if host and port.isdigit():
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, text
+
+
+def send_request(address, request):
+    """
+    Send one request to the daemon and wait for its response. Requests and responses are single lines of JSON.
+
+    :param address: The daemon address, as accepted by parse_address.
+    :param request: The request as a JSON-serializable dictionary.
+    :return: The response dictionary.
+    """
+    family, target = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as connection:
+        connection.connect(target)
+        with connection.makefile("rwb") as stream:
+            stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            line = stream.readline()
+    if not line:
+        raise ConnectionError("The daemon closed the connection without a response")
+    return json.loads(line)
+
+
+def submit_job(argv, address=DEFAULT_ADDRESS, cwd=None, stdin=None):
+    """
+    Run a job on the daemon. The arguments are those of concurrent_image_processing.py; relative paths in them are
+    resolved against cwd on the daemon's side.
+
+    :param argv: The command-line arguments of the job.
+    :param address: The daemon address.
+    :param cwd: The directory relative paths are resolved against (defaults to the current directory).
+    :param stdin: The text an input of "-" reads paths from, if any.
+    :return: The response: status, and either error or elapsed_s, stats and per-stage timings.
+    """
+    request = {"command": "run", "argv": list(argv), "cwd": cwd or os.getcwd()}
+    if stdin is not None:
+        request["stdin"] = stdin
+    return send_request(address, request)
+
+
+def main():
+    """
+    Run one job on a toolbox daemon. Every argument is passed through unchanged, so the command line is the same as
+    for concurrent_image_processing.py; the daemon address comes from IMAGE_TOOLBOX_DAEMON, or from --address as
+    the first argument.
+    """
+    argv = sys.argv[1:]
+    address = DEFAULT_ADDRESS
+    if argv and argv[0].startswith("--address"):
+        option = argv.pop(0)
+        address = option.partition("=")[2] if "=" in option else argv.pop(0)
+    if argv in (["status"], ["shutdown"]):
+        response = send_request(address, {"command": argv[0]})
+    else:
+        stdin = sys.stdin.read() if "-" in argv else None
+        response = submit_job(argv, address, stdin=stdin)
+
+    if response.get("output"):
+        print(response["output"], end="")
+    if response["status"] == "error":
+        print(f"Error: {response['error']}", file=sys.stderr)
+        sys.exit(1)
+    for failure in response.get("failed", []):
+        for error in failure["errors"]:
+            print(f"Error: {error}", file=sys.stderr)
+    if argv == ["status"]:
+        for name, value in response.items():
+            print(f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}")
+    for name, value in response.get("stats", {}).items():
+        print(f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}")
+    if "elapsed_s" in response:
+        print(f"Job completed in {response['elapsed_s']:.3f} s.")
+    if response["status"] == "partial":
+        print(f"{len(response['failed'])} inputs could not be processed.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
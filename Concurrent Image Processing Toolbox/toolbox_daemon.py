@@ -0,0 +1,282 @@
+#Libraries used
+import argparse
+import io
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import concurrent_image_processing
+import convolution
+import result_cache
+from buffer_pool import BufferPool
+from metrics import Metrics
+from scheduler import ImageScheduler
+from toolbox_client import DEFAULT_ADDRESS, parse_address
+
+# Arguments holding paths, resolved against the client's working directory.
+PATH_ARGUMENTS = ("output", "chain_file", "cache_dir", "manifest", "metrics_prometheus", "metrics_json", "trace",
+                  "dedupe_index")
+
+
+class _JobParser(argparse.ArgumentParser):
+    """
+    A command-line parser that raises ValueError on invalid arguments instead of exiting the daemon.
+    """
+
+    def error(self, message):
+        raise ValueError(message)
+
+    def exit(self, status=0, message=None):
+        raise ValueError(message or f"exited with status {status}")
+
+
+class ToolboxDaemon:
+    """
+    Runs jobs given as concurrent_image_processing.py command lines in one long-lived process, so each job skips
+    interpreter start-up, the cv2/NumPy imports and executor creation.
+
+    Schedulers, process pools, result caches and buffer pools are created on first use and kept for later jobs with
+    the same settings, along with everything cached in the process (structuring elements, rotation matrices, filter
+    kernels and the FFT calibration). Jobs may run concurrently; they then share the warm executors.
+    """
+
+    def __init__(self, workers=None, opencv_threads=None):
+        """
+        :param workers: The default number of worker threads or processes for jobs that do not set --workers.
+        :param opencv_threads: The default number of OpenCV threads for jobs that do not set --opencv-threads.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.opencv_threads = opencv_threads
+        self.started = time.perf_counter()
+        self.jobs = 0
+        self._lock = threading.Lock()
+        self._schedulers = {}
+        self._pools = {}
+        self._caches = {}
+        self._buffer_pools = {}
+
+    def warm_up(self):
+        """
+        Create the default scheduler and calibrate the FFT filter path ahead of the first job.
+        """
+        self._scheduler(self.workers, self.opencv_threads, None)
+        convolution.fft_threshold()
+
+    def _scheduler(self, workers, opencv_threads, max_inflight_mb):
+        key = (workers, opencv_threads, max_inflight_mb)
+        with self._lock:
+            if key not in self._schedulers:
+                max_inflight_bytes = None if max_inflight_mb is None else int(max_inflight_mb * 1024 * 1024)
+                self._schedulers[key] = ImageScheduler(workers, opencv_threads, max_inflight_bytes)
+            return self._schedulers[key]
+
+    def _pool(self, workers):
+        with self._lock:
+            if workers not in self._pools:
+                self._pools[workers] = concurrent_image_processing.make_process_pool(workers)
+            return self._pools[workers]
+
+    def _cache(self, directory, max_mb, memory_mb):
+        key = (os.path.abspath(directory), max_mb, memory_mb)
+        with self._lock:
+            if key not in self._caches:
+                self._caches[key] = result_cache.ResultCache(directory, int(max_mb * 1024 * 1024),
+                                                             int(memory_mb * 1024 * 1024))
+            return self._caches[key]
+
+    def _buffer_pool(self, max_mb):
+        with self._lock:
+            if max_mb not in self._buffer_pools:
+                self._buffer_pools[max_mb] = BufferPool(int(max_mb * 1024 * 1024))
+            return self._buffer_pools[max_mb]
+
+    def run(self, argv, cwd=None, stdin=None):
+        """
+        Run one job.
+        :param argv: The command-line arguments of the job, as for concurrent_image_processing.py.
+        :param cwd: The directory relative paths are resolved against (defaults to the daemon's).
+        :param stdin: The text an input of "-" reads paths from.
+        :return: The response dictionary: status "ok" with the elapsed time, per-stage timings and (with --stats)
+                 statistics; status "partial" with the same fields plus failed, a list of {"input", "errors"}
+                 dictionaries for the inputs that could not be fully processed; or status "error" with an error
+                 message when the job as a whole could not run.
+        """
+        parser = concurrent_image_processing.build_parser(_JobParser)
+        parser.prog = "concurrent_image_processing.py"
+        if "-h" in argv or "--help" in argv:
+            return {"status": "ok", "output": parser.format_help()}
+        try:
+            args = parser.parse_args(argv)
+            if args.autotune or args.profile:
+                raise ValueError("--autotune and --profile are not supported by the daemon; start it with the tuned "
+                                 "--workers and --opencv-threads instead")
+            cwd = cwd or os.getcwd()
+            args.inputs = [source if source == "-" else os.path.join(cwd, source) for source in args.inputs]
+            stdin = "".join(os.path.join(cwd, line.strip()) + "\n" for line in (stdin or "").splitlines()
+                            if line.strip())
+            for name in PATH_ARGUMENTS:
+                if getattr(args, name):
+                    setattr(args, name, os.path.join(cwd, getattr(args, name)))
+
+            resources = {}
+            if args.backend == "thread":
+                resources["scheduler"] = self._scheduler(args.workers or self.workers,
+                                                         args.opencv_threads or self.opencv_threads,
+                                                         args.max_inflight_mb)
+                if args.cache_dir:
+                    resources["cache"] = self._cache(args.cache_dir, args.cache_max_mb, args.cache_memory_mb)
+            elif args.backend == "process":
+                resources["pool"] = self._pool(args.workers or self.workers)
+                args.workers = args.workers or self.workers
+            if args.backend in ("thread", "pipeline") and args.buffer_pool_mb:
+                resources["buffer_pool"] = self._buffer_pool(args.buffer_pool_mb)
+            if args.backend != "process":
+                resources["metrics"] = Metrics(trace=bool(args.trace))
+
+            # Errors are collected per job, since the daemon's own output mixes the lines of concurrent jobs.
+            failures = {}
+            failures_lock = threading.Lock()
+
+            def failed(input_path, message):
+                with failures_lock:
+                    failures.setdefault(input_path, []).append(message)
+
+            start = time.perf_counter()
+            stats = concurrent_image_processing.run_job(args, parser, stdin=io.StringIO(stdin), failed=failed,
+                                                        **resources)
+            elapsed = time.perf_counter() - start
+        except Exception as error:
+            return {"status": "error", "error": str(error) or type(error).__name__}
+        finally:
+            with self._lock:
+                self.jobs += 1
+
+        response = {"status": "partial" if failures else "ok", "elapsed_s": elapsed}
+        if failures:
+            response["failed"] = [{"input": path, "errors": errors} for path, errors in failures.items()]
+        if "metrics" in resources:
+            response["timings"] = resources["metrics"].summary()
+        if args.stats:
+            response["stats"] = stats
+        return response
+
+    def status(self):
+        """
+        Describe the daemon.
+        :return: A dictionary with the uptime, the number of jobs run, and the warm schedulers, pools and caches.
+        """
+        with self._lock:
+            return {"status": "ok", "uptime_s": time.perf_counter() - self.started, "jobs": self.jobs,
+                    "schedulers": len(self._schedulers), "pools": len(self._pools), "caches": len(self._caches)}
+
+    def handle(self, request):
+        """
+        Answer one request: {"command": "run", "argv": [...], "cwd": ..., "stdin": ...}, {"command": "status"} or
+        {"command": "shutdown"} (which is answered by the server).
+        :param request: The request dictionary.
+        :return: The response dictionary.
+        """
+        command = request.get("command", "run")
+        if command == "run":
+            return self.run(request.get("argv", []), request.get("cwd"), request.get("stdin"))
+        if command == "status":
+            return self.status()
+        return {"status": "error", "error": f"Unsupported command: {command}"}
+
+    def close(self):
+        """
+        Stop every warm scheduler and process pool.
+        """
+        with self._lock:
+            for scheduler in self._schedulers.values():
+                scheduler.shutdown()
+            for pool in self._pools.values():
+                pool.shutdown()
+            self._schedulers.clear()
+            self._pools.clear()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads newline-delimited JSON requests from one connection and writes one JSON response line per request.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {"status": "error", "error": "Malformed request"}
+            else:
+                if request.get("command") == "shutdown":
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    response = {"status": "ok"}
+                else:
+                    response = self.server.toolbox.handle(request)
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(address=DEFAULT_ADDRESS, toolbox=None):
+    """
+    Serve jobs on a Unix domain socket or a local TCP port until a shutdown request arrives.
+
+    :param address: A socket path, or "host:port" for TCP.
+    :param toolbox: The ToolboxDaemon running the jobs (defaults to a new one with default settings).
+    """
+    toolbox = toolbox or ToolboxDaemon()
+    family, target = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.remove(target)
+        server = _UnixServer(target, _RequestHandler)
+    else:
+        server = _TCPServer(target, _RequestHandler)
+    server.toolbox = toolbox
+    print(f"Listening on {address}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        toolbox.close()
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.remove(target)
+
+
+def main():
+    """
+    Start the daemon. Jobs are submitted with toolbox_client.py.
+    """
+    parser = argparse.ArgumentParser(description="Serve image processing jobs from a long-running process.")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS,
+                        help="Unix domain socket path, or host:port to listen on local TCP.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Default number of worker threads or processes for jobs that do not set --workers.")
+    parser.add_argument("--opencv-threads", type=int, default=None,
+                        help="Default number of threads OpenCV may use inside each call.")
+    parser.add_argument("--no-warm-up", action="store_true",
+                        help="Skip creating the default scheduler and calibrating the FFT filter path at start-up.")
+    args = parser.parse_args()
+
+    toolbox = ToolboxDaemon(args.workers, args.opencv_threads)
+    if not args.no_warm_up:
+        toolbox.warm_up()
+    try:
+        serve(args.address, toolbox)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#Libraries used
+import os
+import re
+import threading
+import cv2
+
+# File extensions read as videos through cv2.VideoCapture.
+VIDEO_EXTENSIONS = {".mp4", ".avi", ".mov", ".mkv", ".m4v", ".webm", ".mpg", ".mpeg", ".wmv"}
+
+# Video containers that can be written, with the codec used for each.
+VIDEO_CODECS = {".mp4": "mp4v", ".avi": "MJPG"}
+
+# Frame rate assumed when the source does not report one, as for most numbered frame sequences.
+DEFAULT_FPS = 25.0
+
+# A printf-style frame number in a frame-sequence pattern, e.g. the "%05d" in "frames/frame_%05d.png".
+_FRAME_NUMBER = re.compile(r"%0?\d*d")
+
+
+def is_frame_sequence(source):
+    """
+    Check whether an input is a numbered frame sequence, given as a printf-style pattern such as frame_%05d.png.
+
+    :param source: The input path.
+    :return: True if the file name contains a frame number placeholder.
+    """
+    return _FRAME_NUMBER.search(os.path.basename(source)) is not None
+
+
+def is_video(source):
+    """
+    Check whether an input should be read frame by frame: a video file or a numbered frame sequence.
+
+    :param source: The input path.
+    :return: True for videos and frame sequences.
+    """
+    return os.path.splitext(source)[1].lower() in VIDEO_EXTENSIONS or is_frame_sequence(source)
+
+
+def source_name(source):
+    """
+    Name a video input for its outputs: the path without extension and, for a frame sequence, without the frame
+    number placeholder, e.g. "frames/frame_%05d.png" becomes "frames/frame".
+
+    :param source: The input path.
+    :return: The path to derive output names from.
+    """
+    directory, filename = os.path.split(source)
+    stem = _FRAME_NUMBER.sub("", os.path.splitext(filename)[0]).strip("_-. ") or "frames"
+    return os.path.join(directory, stem)
+
+
+def open_capture(source, fps=None):
+    """
+    Open a video file or a numbered frame sequence for reading.
+
+    :param source: The input path.
+    :param fps: The frame rate to assume, overriding the one reported by the source.
+    :return: A tuple of the opened cv2.VideoCapture and its frame rate, or (None, None) if it cannot be opened.
+    """
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        capture.release()
+        return None, None
+    return capture, fps or capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+
+
+def iter_frames(capture, slots=None):
+    """
+    Read the frames of a capture in order.
+
+    :param capture: An opened cv2.VideoCapture; it is released once every frame has been read.
+    :param slots: An optional threading.Semaphore acquired before each frame is read, so the reader waits while too
+                  many frames are in flight; whoever consumes a frame must release it.
+    :return: A generator of (index, frame) tuples.
+    """
+    index = 0
+    try:
+        while True:
+            if slots is not None:
+                slots.acquire()
+            read, frame = capture.read()
+            if not read:
+                if slots is not None:
+                    slots.release()
+                return
+            yield index, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+class ReorderBuffer:
+    """
+    Puts results that complete out of order back into frame order.
+
+    Results are pushed with their frame index as they complete; each one is released to a callback as soon as every
+    earlier frame has been released. Frames that produced no result are pushed as None so later frames are not held
+    back. The buffer is thread-safe; release is called with the buffer's lock held, so releases never interleave.
+    """
+
+    def __init__(self, release, start=0):
+        """
+        :param release: A callable release(index, item) receiving the items in index order.
+        :param start: The index of the first item.
+        """
+        self.release = release
+        self.next_index = start
+        self.peak = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def push(self, index, item):
+        """
+        Add an item and release every item that is now in order.
+        :param index: The index of the item.
+        :param item: The item.
+        """
+        with self._lock:
+            self._pending[index] = item
+            self.peak = max(self.peak, len(self._pending))
+            while self.next_index in self._pending:
+                self.release(self.next_index, self._pending.pop(self.next_index))
+                self.next_index += 1
+
+
+class VideoOutput:
+    """
+    A video file written frame by frame. The underlying cv2.VideoWriter is opened on the first frame, once the frame
+    size and whether frames are in color are known. If it cannot be opened, every later write fails as well.
+    """
+
+    def __init__(self, path, fps):
+        """
+        :param path: The output path; its extension (.mp4 or .avi) selects the codec.
+        :param fps: The frame rate of the output.
+        """
+        self.path = path
+        self.fps = fps
+        self.frames = 0
+        self.failed = False
+        self._writer = None
+
+    def write(self, frame):
+        """
+        Append a frame.
+        :param frame: The frame as a uint8 NumPy array, with the same shape as every other frame of this output.
+        :return: Whether the frame was written; always False once the writer has failed to open.
+        """
+        if self.failed:
+            return False
+        if self._writer is None:
+            fourcc = cv2.VideoWriter_fourcc(*VIDEO_CODECS[os.path.splitext(self.path)[1].lower()])
+            self._writer = cv2.VideoWriter(self.path, fourcc, self.fps, (frame.shape[1], frame.shape[0]),
+                                           frame.ndim == 3)
+            if not self._writer.isOpened():
+                self.failed = True
+                return False
+        self._writer.write(frame)
+        self.frames += 1
+        return True
+
+    def close(self):
+        """
+        Finish the file.
+        """
+        if self._writer is not None:
+            self._writer.release()